@@ -0,0 +1,167 @@
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from sys import exit, stderr, stdout
+from typing import AsyncIterator
+
+from app.config.settings import Settings, get_settings
+from app.core.bulk_import import import_users
+from app.core.export import export_table, export_watermark
+from app.core.referrals import backfill_referral_counts
+from app.db.db import db_lifespan
+from app.db.migrator import (
+    get_current_revision,
+    get_head_revision,
+    upgrade,
+)
+from app.serializers.bulk_import import UserImportReportSerializer
+
+settings: Settings = get_settings()
+
+
+async def backfill_referral_counts_command(arguments: Namespace) -> None:
+    async with db_lifespan():
+        processed: int = await backfill_referral_counts(arguments.batch_size)
+    print(f"Recomputed referral counts of {processed} users.")
+
+
+async def export_command(arguments: Namespace) -> None:
+    output = (
+        nullcontext(stdout.buffer)
+        if arguments.output is None
+        else arguments.output.open("wb")
+    )
+    # taken before any row is read
+    watermark: datetime = export_watermark()
+    async with db_lifespan():
+        with output as file:
+            async for chunk in export_table(
+                arguments.table,
+                arguments.format,
+                arguments.updated_since,
+                compress=arguments.gzip,
+            ):
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                file.write(chunk)
+    # stdout may hold the export itself
+    print(
+        f"Watermark of the next export: {watermark.isoformat()}", file=stderr
+    )
+
+
+async def import_users_command(arguments: Namespace) -> None:
+    path: Path = arguments.file
+    file_format: str = arguments.format or (
+        "jsonl" if path.suffix in (".jsonl", ".ndjson") else "csv"
+    )
+
+    async def read_lines() -> AsyncIterator[str]:
+        with path.open(encoding="utf-8", newline="") as file:
+            for line in file:
+                yield line.rstrip("\r\n")
+
+    async with db_lifespan():
+        report: UserImportReportSerializer = await import_users(
+            read_lines(), file_format
+        )
+    print(report.model_dump_json(indent=4))
+
+
+async def migrate_command(arguments: Namespace) -> None:
+    async with db_lifespan() as engine:
+        if arguments.check:
+            async with engine.connect() as connection:
+                current: int = await get_current_revision(connection)
+            head: int = get_head_revision()
+            print(f"Database at revision {current}, head is {head}.")
+            if current < head:
+                exit(1)
+            return
+        applied: list[int] = await upgrade(engine)
+    if applied:
+        print(f"Applied revisions {', '.join(map(str, applied))}.")
+    else:
+        print("Database already at the head revision.")
+
+
+def serve_command(arguments: Namespace) -> None:
+    # imported here, so the other commands do not build the application
+    from app.server import PreforkServer
+
+    PreforkServer(arguments.host, arguments.port, arguments.workers).run()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Entry point of `python -m app`, the administration command line.
+    """
+    parser = ArgumentParser(prog="python -m app")
+    commands = parser.add_subparsers(required=True, metavar="command")
+
+    backfill = commands.add_parser(
+        "backfill-referral-counts",
+        help="recompute the referral count of every user",
+    )
+    backfill.add_argument("--batch-size", type=int, default=1000)
+    backfill.set_defaults(handler=backfill_referral_counts_command)
+
+    export = commands.add_parser(
+        "export", help="export a table as NDJSON or CSV for a data warehouse"
+    )
+    export.add_argument("table", choices=["users", "referral_codes"])
+    export.add_argument(
+        "--format", choices=["ndjson", "csv"], default="ndjson"
+    )
+    export.add_argument(
+        "--updated-since",
+        type=datetime.fromisoformat,
+        help="only export the rows updated at or after this ISO 8601 time",
+    )
+    export.add_argument(
+        "--gzip", action="store_true", help="compress the export with gzip"
+    )
+    export.add_argument(
+        "--output", type=Path, help="defaults to the standard output"
+    )
+    export.set_defaults(handler=export_command)
+
+    import_parser = commands.add_parser(
+        "import-users", help="bulk import users from a CSV or JSONL file"
+    )
+    import_parser.add_argument("file", type=Path)
+    import_parser.add_argument(
+        "--format",
+        choices=["csv", "jsonl"],
+        help="defaults to jsonl for .jsonl/.ndjson files and csv otherwise",
+    )
+    import_parser.set_defaults(handler=import_users_command)
+
+    migrate = commands.add_parser(
+        "migrate", help="migrate the database schema to the head revision"
+    )
+    migrate.add_argument(
+        "--check",
+        action="store_true",
+        help="only exit with status 1 if the schema is behind the head",
+    )
+    migrate.set_defaults(handler=migrate_command)
+
+    serve = commands.add_parser(
+        "serve", help="serve the API from prefork worker processes"
+    )
+    serve.add_argument("--host", default=settings.SERVER_HOST)
+    serve.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    serve.add_argument(
+        "--workers", type=int, default=settings.SERVER_WORKERS
+    )
+    serve.set_defaults(handler=serve_command)
+
+    arguments: Namespace = parser.parse_args(argv)
+    if arguments.handler is serve_command:
+        # runs event loops of its own, in every worker
+        serve_command(arguments)
+        return
+    run(arguments.handler(arguments))
@@ -0,0 +1,372 @@
+import re
+from collections import Counter
+from csv import reader
+from dataclasses import dataclass
+from json import JSONDecodeError, loads
+from time import perf_counter
+from typing import AsyncIterator, Literal
+from uuid import UUID, uuid4
+
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.config.settings import Settings, get_settings
+from app.core.security import PasswordHasher
+from app.db.db import get_engine
+from app.db.db_interactions import record_cache
+from app.models.model_mixins import utc_now
+from app.models.user import User
+from app.serializers.bulk_import import (
+    RejectedRowSerializer,
+    UserImportReportSerializer,
+)
+
+settings: Settings = get_settings()
+BCRYPT_HASH: re.Pattern = re.compile(r"^\$2[aby]?\$\d{2}\$[./A-Za-z0-9]{53}$")
+EMAIL_ADAPTER: TypeAdapter = TypeAdapter(EmailStr)
+STAGING_COLUMNS: tuple[str, ...] = (
+    "line",
+    "uuid",
+    "email",
+    "password",
+    "referrer_email",
+    "created_at",
+)
+
+ImportFormat = Literal["csv", "jsonl"]
+
+
+class RejectedRow(Exception):
+    def __init__(self, reason: str, email: str | None = None):
+        super().__init__(reason)
+        self.reason: str = reason
+        self.email: str | None = email
+
+
+@dataclass
+class ImportRow:
+    line: int
+    email: str
+    password: str | None = None
+    password_hash: str | None = None
+    referrer_email: str | None = None
+
+
+async def import_users(
+    lines: AsyncIterator[str], file_format: ImportFormat
+) -> UserImportReportSerializer:
+    """
+    Bulk-load users from CSV or JSON Lines.
+
+    Every row has an `email`, either a plain-text `password` or an existing
+    bcrypt `password_hash`, and an optional `referrer_email`. CSV input
+    starts with a header row naming these columns.
+
+    Rows are validated and hashed in chunks of `BULK_IMPORT_CHUNK_SIZE`
+    (plain-text passwords in parallel on the password hashing pool) before
+    any transaction is opened. Each chunk is then copied with `COPY` into a
+    temporary staging table, inserted and linked to its referrers by email
+    with set-based statements in a short transaction of its own, so a
+    large import neither holds a connection while hashing nor keeps the
+    rows of `user` locked until its end. Referrers may be existing users or
+    other rows of the same import: the ones of a later chunk are linked in
+    a final pass. The cached lookups of the referrers whose referral count
+    changed are invalidated after every commit.
+
+    The chunks committed before a failure stay imported; running the
+    import again rejects their rows as existing users.
+
+    Args:
+        lines (AsyncIterator[str]): The lines of the input.
+        file_format (ImportFormat): Either "csv" or "jsonl".
+
+    Returns:
+        UserImportReportSerializer: Counts, throughput and the rejected rows.
+
+    Raises:
+        RuntimeError: If the database is not PostgreSQL.
+    """
+    started: float = perf_counter()
+    report = UserImportReportSerializer()
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("Bulk import requires PostgreSQL.")
+
+    staged_emails: set[str] = set()
+    pending: list[tuple[UUID, str]] = []
+    async for chunk in _parse_chunks(lines, file_format, report):
+        records: list[tuple] = await _hash_chunk(
+            _drop_duplicates(chunk, staged_emails, report)
+        )
+        if not records:
+            continue
+        async with engine.begin() as conn:
+            referrers, unresolved = await _import_chunk(conn, records, report)
+        pending.extend(unresolved)
+        await record_cache.invalidate_committed(User, referrers)
+
+    report.unresolved_referrers = len(pending)
+    size: int = settings.BULK_IMPORT_CHUNK_SIZE
+    for offset in range(0, len(pending), size):
+        async with engine.begin() as conn:
+            linked, referrers = await _link_pending(
+                conn, pending[offset:offset + size]
+            )
+        report.unresolved_referrers -= linked
+        await record_cache.invalidate_committed(User, referrers)
+
+    report.seconds = perf_counter() - started
+    report.rows_per_second = report.total_rows / report.seconds
+    return report
+
+
+async def _parse_chunks(
+    lines: AsyncIterator[str],
+    file_format: ImportFormat,
+    report: UserImportReportSerializer,
+) -> AsyncIterator[list[ImportRow]]:
+    header: list[str] | None = None
+    chunk: list[ImportRow] = []
+    line_number: int = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        if file_format == "csv" and header is None:
+            header = [column.strip() for column in next(reader([line]))]
+            continue
+
+        report.total_rows += 1
+        try:
+            chunk.append(_parse_row(line_number, line, header))
+        except RejectedRow as rejected:
+            _reject(report, line_number, rejected.email, rejected.reason)
+        if len(chunk) >= settings.BULK_IMPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parse_row(
+    line_number: int, line: str, header: list[str] | None
+) -> ImportRow:
+    if header is None:
+        try:
+            fields = loads(line)
+        except JSONDecodeError:
+            raise RejectedRow("Malformed JSON.")
+        if not isinstance(fields, dict):
+            raise RejectedRow("Expected a JSON object.")
+    else:
+        values: list[str] = next(reader([line]))
+        if len(values) != len(header):
+            raise RejectedRow(f"Expected {len(header)} columns.")
+        fields = {
+            column: value or None for column, value in zip(header, values)
+        }
+
+    email = fields.get("email")
+    if not email or not isinstance(email, str):
+        raise RejectedRow("Missing email.")
+    try:
+        row = ImportRow(
+            line=line_number,
+            email=EMAIL_ADAPTER.validate_python(email),
+            password=fields.get("password"),
+            password_hash=fields.get("password_hash"),
+        )
+        if fields.get("referrer_email"):
+            row.referrer_email = EMAIL_ADAPTER.validate_python(
+                fields["referrer_email"]
+            )
+    except ValidationError:
+        raise RejectedRow("Invalid email.", email)
+
+    if row.referrer_email == row.email:
+        raise RejectedRow("A user cannot be their own referrer.", email)
+    if row.password_hash is not None:
+        if not isinstance(row.password_hash, str) or not BCRYPT_HASH.match(
+            row.password_hash
+        ):
+            raise RejectedRow("Password hash is not a bcrypt hash.", email)
+    elif not isinstance(row.password, str) or not (
+        8 <= len(row.password) <= 255
+    ):
+        raise RejectedRow("Password must be 8 to 255 characters long.", email)
+    return row
+
+
+def _drop_duplicates(
+    chunk: list[ImportRow],
+    staged_emails: set[str],
+    report: UserImportReportSerializer,
+) -> list[ImportRow]:
+    unique: list[ImportRow] = []
+    for row in chunk:
+        if row.email in staged_emails:
+            _reject(
+                report, row.line, row.email, "Duplicate email in the import."
+            )
+            continue
+        staged_emails.add(row.email)
+        unique.append(row)
+    return unique
+
+
+async def _hash_chunk(chunk: list[ImportRow]) -> list[tuple]:
+    to_hash: list[ImportRow] = [
+        row for row in chunk if row.password_hash is None
+    ]
+    hashes: list[str] = await PasswordHasher.hash_passwords(
+        [row.password for row in to_hash]
+    )
+    for row, password_hash in zip(to_hash, hashes):
+        row.password_hash = password_hash
+    created_at = utc_now()
+    return [
+        (
+            row.line,
+            uuid4(),
+            row.email,
+            row.password_hash,
+            row.referrer_email,
+            created_at,
+        )
+        for row in chunk
+    ]
+
+
+async def _import_chunk(
+    conn: AsyncConnection,
+    records: list[tuple],
+    report: UserImportReportSerializer,
+) -> tuple[list[dict], list[tuple[UUID, str]]]:
+    await conn.execute(
+        text(
+            "CREATE TEMPORARY TABLE user_import ("
+            "line integer PRIMARY KEY, uuid uuid NOT NULL, "
+            "email varchar(255) NOT NULL, password varchar(255) NOT NULL, "
+            "referrer_email varchar(255), created_at timestamptz NOT NULL"
+            ") ON COMMIT DROP"
+        )
+    )
+    driver_connection = (await conn.get_raw_connection()).driver_connection
+    await driver_connection.copy_records_to_table(
+        "user_import", records=records, columns=STAGING_COLUMNS
+    )
+
+    await _reject_staged(
+        conn,
+        report,
+        "User with this email already exists.",
+        'DELETE FROM user_import AS i USING "user" AS u '
+        "WHERE u.email = i.email RETURNING i.line, i.email",
+    )
+    imported = await conn.execute(
+        text(
+            'INSERT INTO "user" '
+            "(uuid, email, password, created_at, referral_count) "
+            "SELECT uuid, email, password, created_at, 0 FROM user_import"
+        )
+    )
+    report.imported += imported.rowcount
+    await conn.execute(
+        text(
+            'UPDATE "user" AS u '
+            "SET referrer_uuid = r.uuid, updated_at = :updated_at, "
+            "row_version = u.row_version + 1 "
+            'FROM user_import AS i JOIN "user" AS r '
+            "ON r.email = i.referrer_email WHERE u.uuid = i.uuid"
+        ),
+        {"updated_at": utc_now()},
+    )
+    # the referrers of a later chunk do not exist yet
+    unresolved = await conn.execute(
+        text(
+            "SELECT uuid, referrer_email FROM user_import AS i "
+            "WHERE referrer_email IS NOT NULL AND NOT EXISTS ("
+            'SELECT 1 FROM "user" AS r WHERE r.email = i.referrer_email)'
+        )
+    )
+    pending: list[tuple[UUID, str]] = [tuple(row) for row in unresolved]
+    counted = await conn.execute(
+        text(
+            'UPDATE "user" AS r '
+            "SET referral_count = r.referral_count + c.referrals, "
+            "updated_at = :updated_at, row_version = r.row_version + 1 "
+            "FROM (SELECT u.referrer_uuid, count(*) AS referrals "
+            'FROM "user" AS u JOIN user_import AS i ON i.uuid = u.uuid '
+            "WHERE u.referrer_uuid IS NOT NULL "
+            "GROUP BY u.referrer_uuid) AS c "
+            "WHERE r.uuid = c.referrer_uuid RETURNING r.uuid"
+        ),
+        {"updated_at": utc_now()},
+    )
+    return [{"uuid": uuid} for (uuid,) in counted], pending
+
+
+async def _link_pending(
+    conn: AsyncConnection, pending: list[tuple[UUID, str]]
+) -> tuple[int, list[dict]]:
+    updated_at = utc_now()
+    linked = await conn.execute(
+        text(
+            'UPDATE "user" AS u '
+            "SET referrer_uuid = r.uuid, updated_at = :updated_at, "
+            "row_version = u.row_version + 1 "
+            "FROM unnest(CAST(:uuids AS uuid[]), "
+            "CAST(:referrer_emails AS varchar[])) AS p(uuid, referrer_email) "
+            'JOIN "user" AS r ON r.email = p.referrer_email '
+            "WHERE u.uuid = p.uuid RETURNING r.uuid"
+        ),
+        {
+            "uuids": [uuid for uuid, _ in pending],
+            "referrer_emails": [email for _, email in pending],
+            "updated_at": updated_at,
+        },
+    )
+    referrals: Counter[UUID] = Counter(uuid for (uuid,) in linked)
+    if not referrals:
+        return 0, []
+    # a separate statement, as a referrer may be one of the linked rows
+    await conn.execute(
+        text(
+            'UPDATE "user" AS r '
+            "SET referral_count = r.referral_count + c.referrals, "
+            "updated_at = :updated_at, row_version = r.row_version + 1 "
+            "FROM unnest(CAST(:uuids AS uuid[]), "
+            "CAST(:referrals AS integer[])) AS c(referrer_uuid, referrals) "
+            "WHERE r.uuid = c.referrer_uuid"
+        ),
+        {
+            "uuids": list(referrals),
+            "referrals": list(referrals.values()),
+            "updated_at": updated_at,
+        },
+    )
+    return sum(referrals.values()), [{"uuid": uuid} for uuid in referrals]
+
+
+async def _reject_staged(
+    conn: AsyncConnection,
+    report: UserImportReportSerializer,
+    reason: str,
+    statement: str,
+) -> None:
+    for line, email in await conn.execute(text(statement)):
+        _reject(report, line, email, reason)
+
+
+def _reject(
+    report: UserImportReportSerializer,
+    line: int,
+    email: str | None,
+    reason: str,
+) -> None:
+    report.rejected += 1
+    if len(report.rejected_rows) < settings.BULK_IMPORT_MAX_REPORTED_ROWS:
+        report.rejected_rows.append(
+            RejectedRowSerializer(line=line, email=email, reason=reason)
+        )
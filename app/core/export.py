@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Literal
+
+from pydantic import BaseModel
+from sqlmodel import SQLModel
+
+from app.config.settings import Settings, get_settings
+from app.core.streaming import (
+    CSV_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    csv_chunks,
+    gzip_chunks,
+    ndjson_chunks,
+)
+from app.db.db_interactions import DBInteractionsManager
+from app.models.model_mixins import utc_now
+from app.models.referral_code import ReferralCode
+from app.models.user import User
+from app.serializers.export import (
+    ReferralCodeExportSerializer,
+    UserExportSerializer,
+)
+
+settings: Settings = get_settings()
+ExportTable = Literal["users", "referral_codes"]
+ExportFormat = Literal["ndjson", "csv"]
+EXPORT_MEDIA_TYPES: dict[str, str] = {
+    "ndjson": NDJSON_MEDIA_TYPE,
+    "csv": CSV_MEDIA_TYPE,
+}
+# the model of every exported table and the serializer of its fields
+EXPORTED_TABLES: dict[str, tuple[SQLModel, type[BaseModel]]] = {
+    "users": (User, UserExportSerializer),
+    "referral_codes": (ReferralCode, ReferralCodeExportSerializer),
+}
+
+
+def export_watermark() -> datetime:
+    """
+    Get the `updated_since` of the export following one that starts now.
+
+    A row is stamped when its transaction writes it but only read once the
+    transaction commits, so an export can miss rows stamped shortly before
+    it started. The watermark is set back by
+    `EXPORT_WATERMARK_OVERLAP_SECONDS` so that the next export reads them;
+    the rows it reads again are to be upserted on their `uuid`.
+    """
+    return utc_now() - timedelta(
+        seconds=settings.EXPORT_WATERMARK_OVERLAP_SECONDS
+    )
+
+
+def export_table(
+    table: ExportTable,
+    file_format: ExportFormat,
+    updated_since: datetime | None = None,
+    compress: bool = False,
+) -> AsyncIterator[str] | AsyncIterator[bytes]:
+    """
+    Stream the rows of a table as newline-delimited JSON or CSV, read
+    through a server-side cursor and written chunk by chunk, so the memory
+    used does not grow with the table.
+
+    Deleted rows, such as the expired referral codes removed by the
+    sweeper, are not part of an incremental export; a full export is the
+    only way to notice them.
+
+    Args:
+        table (ExportTable): The table to export.
+        file_format (ExportFormat): The format of the rows.
+        updated_since (datetime | None): Only export the rows updated at or\
+            after this time, e.g. the `export_watermark` of the previous\
+            export, in UTC when it has no time zone. All rows are exported\
+            when it is not given.
+        compress (bool): Whether to compress the stream into a gzip file.
+
+    Returns:
+        AsyncIterator[str]: The chunks of text of the export.\n
+        AsyncIterator[bytes]: The chunks of the gzip file, with `compress`.
+    """
+    model, serializer = EXPORTED_TABLES[table]
+    chunks: AsyncIterator[list] = DBInteractionsManager.stream_table_from_db(
+        model,
+        serializer,
+        updated_since=updated_since,
+        chunk_size=settings.EXPORT_CHUNK_SIZE,
+    )
+    body: AsyncIterator[str] = (
+        ndjson_chunks(chunks, serializer)
+        if file_format == "ndjson"
+        else csv_chunks(chunks, list(serializer.model_fields))
+    )
+    return gzip_chunks(body) if compress else body
@@ -0,0 +1,429 @@
+from asyncio import CancelledError, Task, create_task, sleep
+from bisect import bisect_left
+from json import dumps, loads
+from logging import Logger, getLogger
+from math import inf
+from os import getpid, kill, listdir, replace
+from os.path import join
+
+logger: Logger = getLogger(__name__)
+
+# latency buckets in seconds, from a cache hit to a slow report
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+STATEMENT_BUCKETS: tuple[float, ...] = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class Metric:
+    """
+    A metric of the Prometheus text format, with one series per combination
+    of label values.
+    """
+
+    type_name: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labels: tuple[str, ...] = labels
+        self.series: dict[tuple, object] = {}
+
+    def render(self, series: dict[tuple, object] | None = None) -> list[str]:
+        lines: list[str] = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for label_values, value in sorted(
+            (self.series if series is None else series).items()
+        ):
+            lines.extend(self._render_series(label_values, value))
+        return lines
+
+    def merge(self, workers_series: list[dict[tuple, object]]) -> dict:
+        """
+        Combine the series of several workers into the series of the server,
+        summing the values of the same labels.
+        """
+        merged: dict[tuple, object] = {}
+        for series in workers_series:
+            for label_values, value in series.items():
+                merged[label_values] = (
+                    self._add(merged[label_values], value)
+                    if label_values in merged
+                    else value
+                )
+        return merged
+
+    def _add(self, value, other):
+        return value + other
+
+    def _render_series(self, label_values: tuple, value) -> list[str]:
+        return [f"{self.name}{self._labels(label_values)} {value}"]
+
+    def _labels(self, label_values: tuple, **extra: str) -> str:
+        pairs: list[tuple[str, str]] = [
+            *zip(self.labels, label_values),
+            *extra.items(),
+        ]
+        if not pairs:
+            return ""
+        return (
+            "{"
+            + ",".join(
+                f'{name}="{_escape(str(value))}"' for name, value in pairs
+            )
+            + "}"
+        )
+
+
+class Counter(Metric):
+    type_name: str = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. The gauges of the workers are summed, or
+    with `aggregate="max"`, such as for ratios, the highest one is kept.
+    """
+
+    type_name: str = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        aggregate: str = "sum",
+    ):
+        super().__init__(name, documentation, labels)
+        self.aggregate: str = aggregate
+
+    def set(self, *label_values: str, value: float) -> None:
+        self.series[label_values] = value
+
+    def _add(self, value: float, other: float) -> float:
+        if self.aggregate == "max":
+            return max(value, other)
+        return value + other
+
+
+class Histogram(Metric):
+    type_name: str = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets: tuple[float, ...] = (*buckets, inf)
+
+    def observe(self, *label_values: str, value: float) -> None:
+        # per series: the count of every bucket, the sum and the total count
+        series: list = self.series.setdefault(
+            label_values, [[0] * len(self.buckets), 0.0, 0]
+        )
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def _add(self, value: list, other: list) -> list:
+        return [
+            [a + b for a, b in zip(value[0], other[0])],
+            value[1] + other[1],
+            value[2] + other[2],
+        ]
+
+    def _render_series(self, label_values: tuple, value: list) -> list[str]:
+        bucket_counts, total, count = value
+        lines: list[str] = []
+        cumulative: int = 0
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            le: str = "+Inf" if bound == inf else repr(float(bound))
+            lines.append(
+                f"{self.name}_bucket{self._labels(label_values, le=le)} "
+                f"{cumulative}"
+            )
+        lines.append(f"{self.name}_sum{self._labels(label_values)} {total}")
+        lines.append(f"{self.name}_count{self._labels(label_values)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of this worker, rendered in the Prometheus text format.
+    Collectors registered with `add_collector` refresh gauges right before
+    the metrics are rendered.
+
+    Once `share` is given a directory, as `python -m app serve` does before
+    forking several workers, every worker writes its series there every
+    `interval_seconds` and when it stops, and the metrics of all the
+    workers are rendered together, whichever worker is scraped. Counters
+    and histograms of workers that exited are kept, so they never go down,
+    while the gauges are those of the running workers. The series of the
+    other workers are as old as their last write.
+    """
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        self.collectors: list = []
+        self.directory: str | None = None
+        self.interval_seconds: float = 5
+        self._task: Task | None = None
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector) -> None:
+        self.collectors.append(collector)
+
+    def share(self, directory: str, interval_seconds: float) -> None:
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+
+    def start(self) -> None:
+        if self.directory is not None and self._task is None:
+            self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+            self.write()
+
+    def write(self) -> None:
+        """Write the series of this worker to the shared directory."""
+        self._collect()
+        path: str = join(self.directory, f"{getpid()}.json")
+        with open(f"{path}.tmp", "w") as file:
+            file.write(
+                dumps(
+                    {
+                        metric.name: [
+                            [list(label_values), value]
+                            for label_values, value in metric.series.items()
+                        ]
+                        for metric in self.metrics
+                    }
+                )
+            )
+        # readers never see a file half written
+        replace(f"{path}.tmp", path)
+
+    def render(self) -> str:
+        if self.directory is None:
+            self._collect()
+            lines: list[str] = [
+                line for metric in self.metrics for line in metric.render()
+            ]
+            return "\n".join(lines) + "\n"
+        self.write()
+        workers: list[tuple[bool, dict]] = self._read_workers()
+        lines = [
+            line
+            for metric in self.metrics
+            for line in metric.render(
+                metric.merge(
+                    [
+                        series.get(metric.name, {})
+                        for running, series in workers
+                        if running or not isinstance(metric, Gauge)
+                    ]
+                )
+            )
+        ]
+        return "\n".join(lines) + "\n"
+
+    def _collect(self) -> None:
+        for collector in self.collectors:
+            collector()
+
+    def _read_workers(self) -> list[tuple[bool, dict]]:
+        # whether every worker is running, and its series by metric name
+        workers: list[tuple[bool, dict]] = []
+        for name in listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(join(self.directory, name)) as file:
+                    metrics: dict = loads(file.read())
+            except (OSError, ValueError):
+                continue
+            workers.append(
+                (
+                    _is_running(int(name.removesuffix(".json"))),
+                    {
+                        metric_name: {
+                            tuple(label_values): value
+                            for label_values, value in series
+                        }
+                        for metric_name, series in metrics.items()
+                    },
+                )
+            )
+        return workers
+
+    async def _run(self) -> None:
+        while True:
+            await sleep(self.interval_seconds)
+            try:
+                self.write()
+            except OSError:
+                logger.exception("Writing the metrics of the worker failed.")
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    )
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.register(
+    Counter(
+        "http_requests_total",
+        "HTTP requests by route and status.",
+        ("method", "route", "status"),
+    )
+)
+http_request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time to serve a request, background tasks included.",
+        ("method", "route"),
+    )
+)
+http_request_db_statements = registry.register(
+    Histogram(
+        "http_request_db_statements",
+        "SQL statements executed per request.",
+        ("method", "route"),
+        buckets=STATEMENT_BUCKETS,
+    )
+)
+http_request_db_duration = registry.register(
+    Histogram(
+        "http_request_db_duration_seconds",
+        "Time spent executing SQL statements per request.",
+        ("method", "route"),
+    )
+)
+http_request_pool_wait = registry.register(
+    Histogram(
+        "http_request_pool_wait_seconds",
+        "Time spent waiting for database connections per request.",
+        ("method", "route"),
+    )
+)
+db_slow_queries = registry.register(
+    Counter(
+        "db_slow_queries_total",
+        "SQL statements slower than the SLOW_QUERY_SECONDS setting.",
+        ("engine",),
+    )
+)
+db_pool_size = registry.register(
+    Gauge("db_pool_size", "Connections the pool keeps open.", ("engine",))
+)
+db_pool_checked_out = registry.register(
+    Gauge(
+        "db_pool_checked_out",
+        "Connections of the pool currently in use.",
+        ("engine",),
+    )
+)
+db_pool_overflow = registry.register(
+    Gauge(
+        "db_pool_overflow",
+        "Connections opened beyond the pool size.",
+        ("engine",),
+    )
+)
+db_pool_utilization = registry.register(
+    Gauge(
+        "db_pool_utilization",
+        "Connections in use out of the most the pool may open, in the "
+        "busiest worker.",
+        ("engine",),
+        aggregate="max",
+    )
+)
+db_pool_checkout_wait = registry.register(
+    Histogram(
+        "db_pool_checkout_wait_seconds",
+        "Time to get a connection from the pool, opening one included.",
+        ("engine",),
+    )
+)
+db_pool_timeouts = registry.register(
+    Counter(
+        "db_pool_timeouts_total",
+        "Connection requests that gave up waiting for a free connection.",
+        ("engine",),
+    )
+)
+write_queue_depth = registry.register(
+    Gauge("write_queue_depth", "Writes waiting in the write-behind queue.")
+)
+write_queue_written = registry.register(
+    Counter(
+        "write_queue_written_total",
+        "Writes applied from the write-behind queue.",
+        ("handler",),
+    )
+)
+write_queue_coalesced = registry.register(
+    Counter(
+        "write_queue_coalesced_total",
+        "Queued writes replaced by a later write to the same row.",
+        ("handler",),
+    )
+)
+write_queue_failed = registry.register(
+    Counter(
+        "write_queue_failed_total",
+        "Queued writes dropped because they failed.",
+        ("handler",),
+    )
+)
+write_queue_flush_duration = registry.register(
+    Histogram(
+        "write_queue_flush_duration_seconds",
+        "Time to apply a batch of the write-behind queue.",
+    )
+)
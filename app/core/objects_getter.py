@@ -1,16 +1,30 @@
 from typing import Annotated
+from uuid import UUID
 
+from authlib.jose import JWTClaims
 from fastapi import Depends, HTTPException
 
+from app.config.settings import Settings, get_settings
+from app.core.principal import UserPrincipal
 from app.core.security import JWT_Token, oauth2
 from app.db.db_interactions import DBInteractionsManager
 from app.models.user import User
+from app.serializers.user import UserSerializer
 
+settings: Settings = get_settings()
 
-async def get_user_from_jwt(token: Annotated[str, Depends(oauth2)]):
+
+async def get_principal_from_jwt(
+    token: Annotated[str, Depends(oauth2)]
+) -> UserPrincipal:
     """
-    This function validates the JWT token, extracts the user's email from it,
-    and then fetches the corresponding user from the database.
+    This function validates the JWT token and builds the principal of the
+    user it was issued to.
+
+    With `STATELESS_AUTH` enabled the principal is taken from the token
+    claims alone and the database is not touched. Otherwise, or for tokens
+    issued without the `user_uuid` claim, the uuid and the email of the
+    user are fetched from the database by the email from the token.
 
     Args:
         token (Annotated[str, Depends(oauth2)]): The JWT token to be validated.
@@ -18,20 +32,49 @@ async def get_user_from_jwt(token: Annotated[str, Depends(oauth2)]):
             system.
 
     Returns:
-        User: The user object retrieved from the database.
+        UserPrincipal: The authenticated user.
 
     Raises:
         HTTPException:
             - 401 error if the token is invalid.
             - 404 error if the user is not found in the database.
     """
-    user_email: str | None = JWT_Token.check_jwt_token(token)
-    if not user_email:
+    claims: JWTClaims | None = JWT_Token.check_jwt_token(token)
+    if not claims or not claims.get("user_email"):
         raise HTTPException(401, "Invalid token. Please log in again.")
 
-    user: User | None = await DBInteractionsManager.get_record_from_db(
-        {"email": user_email}, User
+    if settings.STATELESS_AUTH and claims.get("user_uuid"):
+        try:
+            return UserPrincipal(
+                UUID(claims["user_uuid"]), claims["user_email"]
+            )
+        except ValueError:
+            raise HTTPException(401, "Invalid token. Please log in again.")
+
+    # only the uuid and the email, the full record is loaded when needed
+    user: UserSerializer | None = (
+        await DBInteractionsManager.get_record_from_db(
+            {"email": claims["user_email"]}, User, projection=UserSerializer
+        )
     )
     if not user:
         raise HTTPException(404, "User not found.")
-    return user
+    return UserPrincipal(user.uuid, user.email)
+
+
+async def get_user_from_jwt(
+    principal: Annotated[UserPrincipal, Depends(get_principal_from_jwt)]
+) -> User:
+    """
+    This function resolves the authenticated principal to the full `User`
+    record, for handlers that need more than the user's uuid and email.
+
+    Returns:
+        User: The user object retrieved from the database.
+
+    Raises:
+        HTTPException:
+            - 401 error if the token is invalid.
+            - 404 error if the user is not found in the database.
+    """
+    return await principal.get_user()
@@ -0,0 +1,30 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+from uuid import UUID
+
+from fastapi import HTTPException
+
+
+def encode_cursor(created_at: datetime, uuid: UUID) -> str:
+    """
+    Encode the position of a record in a (created_at, uuid) ordered list
+    into an opaque cursor for the next page.
+    """
+    raw: str = f"{created_at.isoformat()}|{uuid}"
+    return urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """
+    Decode a cursor made by `encode_cursor`.
+
+    Raises:
+        HTTPException: A 400 error if the cursor is malformed.
+    """
+    try:
+        raw: str = urlsafe_b64decode(cursor.encode("utf-8")).decode("utf-8")
+        created_at, uuid = raw.split("|")
+        return datetime.fromisoformat(created_at), UUID(uuid)
+    except (BinasciiError, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
@@ -0,0 +1,43 @@
+from uuid import UUID
+
+from fastapi import HTTPException
+
+from app.db.db_interactions import DBInteractionsManager
+from app.models.user import User
+
+
+class UserPrincipal:
+    """
+    The authenticated user as seen by the views.
+
+    It always carries the user's uuid and email. The full `User` record is
+    either attached right away (when it was already fetched during
+    authentication) or loaded from the database on the first call to
+    `get_user`.
+    """
+
+    __slots__ = ("uuid", "email", "_user")
+
+    def __init__(self, uuid: UUID, email: str, user: User | None = None):
+        self.uuid: UUID = uuid
+        self.email: str = email
+        self._user: User | None = user
+
+    async def get_user(self) -> User:
+        """
+        Return the full `User` record behind this principal.
+
+        Returns:
+            User: The user object retrieved from the database.
+
+        Raises:
+            HTTPException: A 404 error if the user no longer exists.
+        """
+        if self._user is None:
+            user: User | None = await DBInteractionsManager.get_record_from_db(
+                {"uuid": self.uuid}, User, loading_profile="auth"
+            )
+            if not user:
+                raise HTTPException(404, "User not found.")
+            self._user = user
+        return self._user
@@ -0,0 +1,282 @@
+from asyncio import Task, current_task, to_thread
+from collections import Counter
+from json import loads
+from logging import Logger, getLogger
+from pathlib import Path
+from random import random
+from re import fullmatch
+from secrets import compare_digest
+from sys import _current_frames
+from threading import Lock, Thread, get_ident
+from time import perf_counter, sleep, time_ns
+from types import FrameType
+from uuid import uuid4
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config.settings import Settings, get_settings
+from app.models.model_mixins import utc_now
+from app.serializers.profiling import ProfileSerializer
+
+settings: Settings = get_settings()
+logger: Logger = getLogger(__name__)
+PROFILE_HEADER: str = "x-profile-token"
+PROFILE_ID_PATTERN: str = r"\d+-[0-9a-f]{32}"
+# leaf frame of the samples taken while the request waited, e.g. on the
+# database or on a worker thread, rather than running on the event loop
+WAITING_FRAME: str = "(waiting)"
+
+
+class Profile:
+    """
+    The stacks sampled for one request, counted per distinct stack.
+    """
+
+    def __init__(self, task: Task, thread_id: int):
+        self.task: Task = task
+        self.thread_id: int = thread_id
+        self.stacks: Counter[str] = Counter()
+
+    def sample(self, frames: dict[int, FrameType]) -> str | None:
+        """
+        Return the stack of the request in the collapsed format, None when
+        it has none, from the stacks of the threads in `frames`.
+        """
+        if current_task(self.task.get_loop()) is self.task:
+            frame: FrameType | None = frames.get(self.thread_id)
+            stack: list[str] = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.reverse()
+        else:
+            stack = [
+                _frame_name(frame)
+                for frame in _awaited_frames(self.task.get_coro())
+            ]
+            stack.append(WAITING_FRAME)
+        return ";".join(stack) if stack else None
+
+    def collapsed(self) -> str:
+        """
+        Render the samples in the collapsed stacks format read by
+        `flamegraph.pl`, speedscope and most flamegraph viewers.
+        """
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.items()
+        )
+
+
+class StackSampler:
+    """
+    Samples the stacks of the requests being profiled from a thread of its
+    own, which runs only while there is at least one of them.
+
+    A request is attributed the stack of the event loop while its task is
+    the one running, and the stack its task is suspended at otherwise, so
+    requests served concurrently do not show up in each other's profiles.
+
+    The stacks are walked without holding the lock `start` and `stop` take
+    on the event loop, which only guards the set of profiles and the
+    counting of the samples, so the event loop never waits on a walk.
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds: float = interval_seconds
+        self._profiles: set[Profile] = set()
+        self._lock = Lock()
+        self._thread: Thread | None = None
+
+    def start(self) -> Profile:
+        profile = Profile(current_task(), get_ident())
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+        return profile
+
+    def stop(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles: list[Profile] = list(self._profiles)
+            frames: dict[int, FrameType] = _current_frames()
+            samples: list[tuple[Profile, str]] = []
+            for profile in profiles:
+                try:
+                    stack: str | None = profile.sample(frames)
+                except Exception:
+                    # the task moved on while it was being sampled
+                    continue
+                if stack is not None:
+                    samples.append((profile, stack))
+            del frames
+            # counted under the lock, and only for the profiles still
+            # running, so that a stopped profile does not change anymore
+            with self._lock:
+                for profile, stack in samples:
+                    if profile in self._profiles:
+                        profile.stacks[stack] += 1
+            sleep(self.interval_seconds)
+
+
+class ProfileStore:
+    """
+    Ring buffer of the captured profiles on disk.
+
+    Every profile is kept as its collapsed stacks next to a JSON file of
+    its metadata, named after the time it was captured; the oldest ones
+    are deleted as soon as there are more than `max_profiles`. The
+    directory may be shared by the workers of an instance.
+    """
+
+    def __init__(self, directory: str, max_profiles: int):
+        self.directory = Path(directory)
+        self.max_profiles: int = max_profiles
+
+    def save(self, profile: ProfileSerializer, stacks: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._path(profile.id, ".collapsed").write_text(stacks)
+        self._path(profile.id, ".json").write_text(
+            profile.model_dump_json()
+        )
+        for stale in sorted(self.directory.glob("*.json"))[
+            : -self.max_profiles
+        ]:
+            self._path(stale.stem, ".collapsed").unlink(missing_ok=True)
+            stale.unlink(missing_ok=True)
+
+    def list(self) -> list[ProfileSerializer]:
+        """
+        Return the metadata of the kept profiles, the latest first.
+        """
+        profiles: list[ProfileSerializer] = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True):
+            try:
+                profiles.append(
+                    ProfileSerializer.model_validate(loads(path.read_text()))
+                )
+            except (OSError, ValueError):
+                # deleted by another worker or still being written
+                continue
+        return profiles
+
+    def get_stacks_path(self, profile_id: str) -> Path | None:
+        """
+        Return the path of the collapsed stacks of a kept profile, None
+        when there is no such profile.
+        """
+        if not fullmatch(PROFILE_ID_PATTERN, profile_id):
+            return None
+        path: Path = self._path(profile_id, ".collapsed")
+        return path if path.is_file() else None
+
+    def _path(self, profile_id: str, suffix: str) -> Path:
+        return self.directory / f"{profile_id}{suffix}"
+
+
+stack_sampler = StackSampler(settings.PROFILING_INTERVAL_SECONDS)
+profile_store = ProfileStore(
+    settings.PROFILING_DIR, settings.PROFILING_MAX_PROFILES
+)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests that carry the `ADMIN_TOKEN` in the
+    `X-Profile-Token` header, and a `PROFILING_SAMPLE_RATE` fraction of all
+    requests, with the stack sampler.
+
+    The profile is saved to the profile store once the request is served,
+    its id is returned in the `X-Profile-Id` header. The middleware is only
+    installed when `PROFILING_ENABLED` is set, so requests cost nothing
+    more otherwise.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        profile_id: str = f"{time_ns()}-{uuid4().hex}"
+        status: int = 500
+
+        async def send_with_profile_id(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-profile-id", profile_id.encode()),
+                    ],
+                }
+            await send(message)
+
+        profile: Profile = stack_sampler.start()
+        started: float = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            duration: float = perf_counter() - started
+            stack_sampler.stop(profile)
+            route = scope.get("route")
+            metadata = ProfileSerializer(
+                id=profile_id,
+                method=scope["method"],
+                path=scope["path"],
+                route=route.path if route is not None else None,
+                status=status,
+                duration_seconds=duration,
+                samples=profile.stacks.total(),
+                created_at=utc_now(),
+            )
+            try:
+                await to_thread(
+                    profile_store.save, metadata, profile.collapsed()
+                )
+            except OSError:
+                logger.exception("Could not save profile %s.", profile_id)
+
+    @staticmethod
+    def _should_profile(scope: Scope) -> bool:
+        token: str | None = Headers(scope=scope).get(PROFILE_HEADER)
+        if token is not None and settings.ADMIN_TOKEN:
+            return compare_digest(
+                token.encode("utf-8"), settings.ADMIN_TOKEN.encode("utf-8")
+            )
+        return random() < settings.PROFILING_SAMPLE_RATE
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _awaited_frames(coroutine) -> list[FrameType]:
+    # the frames of a suspended coroutine and of those it awaits, down to
+    # the one waiting on a future; `Task.get_stack` stops at the first one
+    frames: list[FrameType] = []
+    while coroutine is not None:
+        frame: FrameType | None = getattr(
+            coroutine, "cr_frame", None
+        ) or getattr(coroutine, "gi_frame", None)
+        if frame is not None:
+            frames.append(frame)
+        coroutine = getattr(coroutine, "cr_await", None) or getattr(
+            coroutine, "gi_yieldfrom", None
+        )
+    return frames
@@ -1,34 +1,183 @@
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
 from secrets import token_hex
+from uuid import UUID
+
+from sqlalchemy import bindparam, delete, select, tuple_
+from sqlalchemy.engine import Result
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import Select
 
 from app.config.settings import Settings, get_settings
-from app.db.db_interactions import DBInteractionsManager
+from app.db.db import async_session_decorator, commit_or_flush
+from app.db.db_interactions import DBInteractionsManager, record_cache
+from app.db.write_queue import write_queue
+from app.models.model_mixins import utc_now
 from app.models.referral_code import ReferralCode
 from app.models.user import User
+from app.serializers.referral_code import ReferralCodeSerializer
+from app.serializers.user import UserSerializer
 
 settings: Settings = get_settings()
+# a new code is only retried when the random one collides with an existing
+# code, which is practically impossible for 128 random bits
+MAX_GENERATION_ATTEMPTS: int = 3
+DELETE_REFERRAL_CODES: str = "delete_referral_codes"
+# the active referral codes of the users with the given emails, built once;
+# the emails are expanded into the `IN` list when it is executed
+REFERRAL_CODES_BY_EMAILS: Select = (
+    select(User.email, ReferralCode.code, ReferralCode.expiration_time)
+    .join(ReferralCode, ReferralCode.owner_uuid == User.uuid)
+    .where(
+        User.email.in_(bindparam("emails", expanding=True)),
+        ReferralCode.active_criteria(),
+    )
+)
 
 
-async def generate_new_referral_code(user: User) -> None:
-    current_active_code: ReferralCode | None = (
-        await DBInteractionsManager.get_record_from_db(
-            {"owner_uuid": user.uuid}, ReferralCode
+async def generate_new_referral_code(owner_uuid: UUID) -> ReferralCode | None:
+    """
+    Give the user a new referral code, replacing the current one if any.
+
+    The code is rotated atomically with a single upsert on the owner, so
+    concurrent calls can never leave the user with two codes. Only when the
+    upsert fails is the owner looked up, as the principal of a stateless
+    token may be a user deleted since.
+
+    Returns:
+        `ReferralCode`: The new referral code.\n
+        `None`: If the user does not exist.
+
+    Raises:
+        RuntimeError: If no code could be stored.
+    """
+    for _ in range(MAX_GENERATION_ATTEMPTS):
+        referral_code: ReferralCode | None = (
+            await DBInteractionsManager.upsert_record_in_db(
+                {
+                    "code": token_hex(16),
+                    "expiration_time": utc_now()
+                    + timedelta(days=settings.REFERRAL_CODE_DAYS),
+                    "owner_uuid": owner_uuid,
+                },
+                ReferralCode,
+                conflict_fields=["owner_uuid"],
+            )
         )
+        if referral_code:
+            return referral_code
+        owner: UserSerializer | None = (
+            await DBInteractionsManager.get_record_from_db(
+                {"uuid": owner_uuid},
+                User,
+                projection=UserSerializer,
+                use_cache=False,
+            )
+        )
+        if owner is None:
+            return None
+    raise RuntimeError(
+        f"Could not store a new referral code for user {owner_uuid}."
     )
-    if current_active_code:
-        await DBInteractionsManager.delete_record_from_db(current_active_code)
-
-    while True:
-        status: str | None = await DBInteractionsManager.create_record_in_db(
-            {
-                "code": token_hex(16),
-                "expiration_time": (
-                    datetime.now(timezone.utc)
-                    + timedelta(days=settings.REFERRAL_CODE_DAYS)
-                ).replace(tzinfo=None),
-                "owner_uuid": user.uuid,
-            },
-            ReferralCode,
+
+
+@async_session_decorator(read_only=True)
+async def get_referral_codes_by_emails(
+    emails: list[str], session: AsyncSession
+) -> dict[str, ReferralCodeSerializer | None]:
+    """
+    Look up the active referral codes of the users with the given emails,
+    all with a single query joining the users to their codes.
+
+    Returns:
+        dict[str, ReferralCodeSerializer | None]: The referral code of\
+            every email, None for the emails of unknown users and of users\
+            without an active referral code.
+    """
+    referral_codes: dict[str, ReferralCodeSerializer | None] = dict.fromkeys(
+        emails
+    )
+    if not emails:
+        return referral_codes
+    db_result: Result = await session.execute(
+        REFERRAL_CODES_BY_EMAILS, {"emails": list(referral_codes)}
+    )
+    for email, code, expiration_time in db_result:
+        referral_code = ReferralCodeSerializer.model_construct(
+            code=code, expiration_time=expiration_time
         )
-        if status:
-            break
+        if not is_revoked(referral_code):
+            referral_codes[email] = referral_code
+    return referral_codes
+
+
+async def revoke_referral_code(code: str, owner_uuid: UUID) -> bool:
+    """
+    Delete the referral code `code` if it belongs to the user.
+
+    The ownership is part of the condition of the `DELETE`, so the code is
+    deleted with a single statement. When the write queue is enabled, the
+    code is looked up in the database, past the record cache, to answer
+    right away and the deletion is queued.
+
+    Returns:
+        bool: Whether the user has an active referral code `code`.
+    """
+    if not write_queue.enabled:
+        return bool(
+            await DBInteractionsManager.delete_records_where(
+                {"code": code, "owner_uuid": owner_uuid}, ReferralCode
+            )
+        )
+    referral_code: ReferralCode | None = (
+        await DBInteractionsManager.get_record_from_db(
+            {"code": code}, ReferralCode, use_cache=False
+        )
+    )
+    if referral_code is None or referral_code.owner_uuid != owner_uuid:
+        return False
+    await write_queue.submit(
+        DELETE_REFERRAL_CODES,
+        code,
+        {"code": code, "owner_uuid": str(owner_uuid)},
+    )
+    return True
+
+
+def is_revoked(referral_code: ReferralCodeSerializer) -> bool:
+    """
+    Whether the deletion of the referral code was queued by this worker and
+    is not applied yet, in which case the code is served as deleted.
+    """
+    return write_queue.get_pending(
+        DELETE_REFERRAL_CODES, referral_code.code
+    ) is not None
+
+
+@async_session_decorator
+async def delete_referral_codes(
+    referral_codes: list[dict], session: AsyncSession
+) -> None:
+    """
+    Delete referral codes by code and owner in one statement. Codes already
+    deleted, or replaced by a new code of their owner, are skipped.
+
+    Args:
+        referral_codes (list[dict]): The `code` and the `owner_uuid` of\
+            every deleted referral code.
+    """
+    await session.execute(
+        delete(ReferralCode).where(
+            tuple_(ReferralCode.code, ReferralCode.owner_uuid).in_(
+                [
+                    (referral_code["code"], UUID(referral_code["owner_uuid"]))
+                    for referral_code in referral_codes
+                ]
+            )
+        ),
+        execution_options={"synchronize_session": False},
+    )
+    await commit_or_flush(session)
+    await record_cache.invalidate(session, ReferralCode, referral_codes)
+
+
+write_queue.register(DELETE_REFERRAL_CODES, delete_referral_codes)
@@ -0,0 +1,406 @@
+from datetime import datetime
+from typing import AsyncIterator
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import case, exists, func, select, true, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.config.settings import Settings, get_settings
+from app.core.referral_codes import is_revoked
+from app.db.db import async_session_decorator, commit_or_flush
+from app.db.db_interactions import DBInteractionsManager, record_cache
+from app.db.write_queue import write_queue
+from app.models.model_mixins import utc_now
+from app.models.referral_code import ReferralCode
+from app.models.user import User
+from app.serializers.user import (
+    ReferralSerializer,
+    ReferralTreeNodeSerializer,
+    ReferralTreeSummarySerializer,
+)
+
+settings: Settings = get_settings()
+ASSIGN_REFERRERS: str = "assign_referrers"
+
+
+async def assign_referrer_by_code(
+    user_uuid: UUID, ref_code: str
+) -> UUID | None:
+    """
+    Make the user a referral of the owner of the referral code `ref_code`,
+    unless the user owns it.
+
+    On PostgreSQL, the code is looked up and the referrer assigned with a
+    single statement. When the write queue is enabled, the code is looked
+    up in the database, past the record cache, to answer right away and
+    the assignment is queued.
+
+    Returns:
+        `UUID`: The owner of the referral code.\n
+        `None`: If there is no active referral code `ref_code`.
+
+    Raises:
+        HTTPException: A 404 error if the user no longer exists. With the\
+            write queue, the assignment of a missing user is accepted and\
+            skipped once applied instead.
+    """
+    if not write_queue.enabled:
+        return await _assign_referrer_by_code(user_uuid, ref_code)
+    referral_code: ReferralCode | None = (
+        await DBInteractionsManager.get_record_from_db(
+            {"code": ref_code}, ReferralCode, use_cache=False
+        )
+    )
+    if referral_code is None or is_revoked(referral_code):
+        return None
+    if referral_code.owner_uuid != user_uuid:
+        await write_queue.submit(
+            ASSIGN_REFERRERS,
+            str(user_uuid),
+            {
+                "user_uuid": str(user_uuid),
+                "referrer_uuid": str(referral_code.owner_uuid),
+            },
+        )
+    return referral_code.owner_uuid
+
+
+@async_session_decorator
+async def _assign_referrer_by_code(
+    user_uuid: UUID, ref_code: str, session: AsyncSession
+) -> UUID | None:
+    """
+    Assign the referrer of `assign_referrer_by_code` right away.
+
+    PostgreSQL runs a single statement of data-modifying CTEs. The other
+    databases, which cannot lock rows or update in CTEs, look the code up
+    and then run the batch assignment of the write queue, four statements
+    in all, or one when the code is missing or owned by the user. Both
+    check that the user still exists, which a stateless token does not
+    prove.
+
+    Raises:
+        HTTPException: A 404 error if the user no longer exists.
+    """
+    user_found = exists().where(User.uuid == user_uuid).label("user_found")
+    if session.bind.dialect.name != "postgresql":
+        found = (
+            await session.execute(
+                select(ReferralCode.owner_uuid, user_found).where(
+                    ReferralCode.code == ref_code,
+                    ReferralCode.active_criteria(),
+                )
+            )
+        ).one_or_none()
+        if found is None:
+            return None
+        if not found.user_found:
+            raise HTTPException(404, "User not found.")
+        if found.owner_uuid != user_uuid:
+            await _assign_referrers({user_uuid: found.owner_uuid}, session)
+        return found.owner_uuid
+
+    # the referrer, the user locked with their previous referrer, the new
+    # referrer set on the user and the referral counts of both referrers
+    # adjusted, all as data-modifying CTEs of one statement; `onupdate` does
+    # not apply to the updates of CTEs, which set `updated_at` and bump
+    # `row_version` themselves
+    updated_at: datetime = utc_now()
+    code = (
+        select(ReferralCode.owner_uuid)
+        .where(ReferralCode.code == ref_code, ReferralCode.active_criteria())
+        .cte("code")
+    )
+    target = (
+        select(User.uuid, User.referrer_uuid.label("previous"))
+        .where(User.uuid == user_uuid, User.uuid != code.c.owner_uuid)
+        .with_for_update(of=User)
+        .cte("target")
+    )
+    assigned = (
+        update(User)
+        .where(
+            User.uuid == target.c.uuid,
+            target.c.previous.is_distinct_from(code.c.owner_uuid),
+        )
+        .values(
+            referrer_uuid=code.c.owner_uuid,
+            updated_at=updated_at,
+            row_version=User.row_version + 1,
+        )
+        .returning(target.c.previous, User.referrer_uuid.label("referrer"))
+        .cte("assigned")
+    )
+    counted = (
+        update(User)
+        .where(User.uuid.in_([assigned.c.referrer, assigned.c.previous]))
+        .values(
+            referral_count=User.referral_count
+            + case((User.uuid == assigned.c.referrer, 1), else_=-1),
+            updated_at=updated_at,
+            row_version=User.row_version + 1,
+        )
+        .returning(User.uuid)
+        .cte("counted")
+    )
+    row = (
+        await session.execute(
+            select(
+                code.c.owner_uuid,
+                user_found,
+                assigned.c.previous,
+                assigned.c.referrer,
+                select(func.count())
+                .select_from(counted)
+                .scalar_subquery()
+                .label("counted"),
+            ).select_from(code.outerjoin(assigned, true()))
+        )
+    ).one_or_none()
+    await commit_or_flush(session)
+    if row is None:
+        return None
+    if not row.user_found:
+        raise HTTPException(404, "User not found.")
+    if row.referrer is not None:
+        await record_cache.invalidate(
+            session,
+            User,
+            [
+                {"uuid": uuid}
+                for uuid in (user_uuid, row.referrer, row.previous)
+                if uuid is not None
+            ],
+        )
+    return row.owner_uuid
+
+
+@async_session_decorator
+async def assign_referrers(
+    assignments: list[dict], session: AsyncSession
+) -> None:
+    """
+    Make every user a referral of their referrer, in one transaction.
+
+    The `referral_count` of the new referrers, and of the previous ones of
+    users who already had a referrer, is adjusted in the same transaction.
+    Users that no longer exist and users who already are referrals of their
+    referrer are skipped, so assigning again changes nothing.
+
+    Args:
+        assignments (list[dict]): The `user_uuid` and the `referrer_uuid`\
+            of every assignment, the last one winning for a user.
+    """
+    await _assign_referrers(
+        {
+            UUID(assignment["user_uuid"]): UUID(assignment["referrer_uuid"])
+            for assignment in assignments
+        },
+        session,
+    )
+
+
+async def _assign_referrers(
+    referrers: dict[UUID, UUID], session: AsyncSession
+) -> None:
+    # locked in a fixed order, so concurrent batches cannot deadlock
+    previous_referrers: dict[UUID, UUID | None] = dict(
+        (
+            await session.execute(
+                select(User.uuid, User.referrer_uuid)
+                .where(User.uuid.in_(list(referrers)))
+                .order_by(User.uuid)
+                .with_for_update()
+            )
+        ).all()
+    )
+    changed: dict[UUID, UUID] = {
+        user_uuid: referrer_uuid
+        for user_uuid, referrer_uuid in referrers.items()
+        if user_uuid in previous_referrers
+        and previous_referrers[user_uuid] != referrer_uuid
+    }
+    if not changed:
+        return
+
+    await session.execute(
+        update(User)
+        .where(User.uuid.in_(list(changed)))
+        .values(referrer_uuid=case(changed, value=User.uuid))
+    )
+    count_changes: dict[UUID, int] = {}
+    for user_uuid, referrer_uuid in changed.items():
+        count_changes[referrer_uuid] = count_changes.get(referrer_uuid, 0) + 1
+        if (previous := previous_referrers[user_uuid]) is not None:
+            count_changes[previous] = count_changes.get(previous, 0) - 1
+    count_changes = {
+        uuid: change for uuid, change in count_changes.items() if change
+    }
+    if count_changes:
+        await session.execute(
+            update(User)
+            .where(User.uuid.in_(list(count_changes)))
+            .values(
+                referral_count=User.referral_count
+                + case(count_changes, value=User.uuid)
+            )
+        )
+    await commit_or_flush(session)
+    await record_cache.invalidate(
+        session,
+        User,
+        [{"uuid": uuid} for uuid in {*changed, *count_changes}],
+    )
+
+
+write_queue.register(ASSIGN_REFERRERS, assign_referrers)
+
+
+@async_session_decorator(read_only=True)
+async def get_top_referrers(limit: int, session: AsyncSession) -> list:
+    """
+    Return the users with the most referrals, best first.
+
+    The rows are read in index order from the `referral_count` index, so
+    the user table is never scanned or aggregated.
+    """
+    db_result = await session.execute(
+        select(User.uuid, User.email, User.referral_count)
+        .where(User.referral_count > 0)
+        .order_by(User.referral_count.desc(), User.uuid.desc())
+        .limit(limit)
+    )
+    return list(db_result.mappings())
+
+
+@async_session_decorator(read_only=True)
+async def get_referrals_page(
+    uuid_referrer: UUID,
+    limit: int | None,
+    after: tuple[datetime, UUID] | None,
+    session: AsyncSession,
+) -> tuple[int, list[ReferralSerializer]] | None:
+    """
+    Read a page of the referrals of a user, the oldest first, along with the
+    `row_version` of the user.
+
+    Every change of the referrals of a user changes their referral count,
+    so the version of the user is the version of the page. Both are read
+    with one statement, and so from one snapshot, even on replicas.
+
+    Returns:
+        `tuple[int, list[ReferralSerializer]]`: The version of the user and\
+            the referrals after `after`, at most `limit` of them.\n
+        `None`: If there is no such user.
+    """
+    page = select(User.uuid, User.email, User.created_at).where(
+        User.referrer_uuid == uuid_referrer
+    )
+    if after is not None:
+        page = page.where(tuple_(User.created_at, User.uuid) > tuple_(*after))
+    page = page.order_by(User.created_at, User.uuid).limit(limit).subquery()
+    # the user is joined to its page, so it is returned when the page is
+    # empty too
+    rows: list = (
+        await session.execute(
+            select(User.row_version, page)
+            .outerjoin(page, true())
+            .where(User.uuid == uuid_referrer)
+            .order_by(page.c.created_at, page.c.uuid)
+        )
+    ).all()
+    if not rows:
+        return None
+    return rows[0].row_version, [
+        ReferralSerializer.model_construct(
+            uuid=row.uuid, email=row.email, created_at=row.created_at
+        )
+        for row in rows
+        if row.uuid is not None
+    ]
+
+
+async def backfill_referral_counts(batch_size: int = 1000) -> int:
+    """
+    Recompute `referral_count` of every user from the `referrer_uuid` links.
+
+    Users are processed in batches of `batch_size` in uuid order, each batch
+    in its own short transaction.
+
+    Returns:
+        int: The number of users processed.
+    """
+    processed: int = 0
+    last_uuid: UUID | None = None
+    while True:
+        batch_uuids: list[UUID] = await _backfill_referral_counts_batch(
+            last_uuid, batch_size
+        )
+        processed += len(batch_uuids)
+        if len(batch_uuids) < batch_size:
+            return processed
+        last_uuid = batch_uuids[-1]
+
+
+@async_session_decorator
+async def _backfill_referral_counts_batch(
+    last_uuid: UUID | None, batch_size: int, session: AsyncSession
+) -> list[UUID]:
+    batch_query = select(User.uuid).order_by(User.uuid).limit(batch_size)
+    if last_uuid is not None:
+        batch_query = batch_query.where(User.uuid > last_uuid)
+    batch_uuids: list[UUID] = list(await session.scalars(batch_query))
+    if not batch_uuids:
+        return batch_uuids
+
+    referral = aliased(User)
+    await session.execute(
+        update(User)
+        .where(User.uuid.in_(batch_uuids))
+        .values(
+            referral_count=select(func.count(referral.uuid))
+            .where(referral.referrer_uuid == User.uuid)
+            .scalar_subquery()
+        ),
+        execution_options={"synchronize_session": False},
+    )
+    await session.commit()
+    return batch_uuids
+
+
+async def referral_tree_ndjson(
+    uuid_referrer: UUID, max_depth: int
+) -> AsyncIterator[str]:
+    """
+    Stream the referral downline of a user as newline-delimited JSON.
+
+    Every referral down to `max_depth` levels is written on its own line as
+    it is read from the database. The last line is
+    `{"summary": {"total": ..., "levels": {depth: count}}}`.
+    """
+    levels: dict[int, int] = {}
+    async for chunk in DBInteractionsManager.stream_tree_from_db(
+        uuid_referrer,
+        User,
+        parent_field="referrer_uuid",
+        fields=["uuid", "email", "referrer_uuid"],
+        max_depth=max_depth,
+        chunk_size=settings.STREAM_CHUNK_SIZE,
+    ):
+        lines: list[str] = []
+        for row in chunk:
+            levels[row["depth"]] = levels.get(row["depth"], 0) + 1
+            lines.append(
+                ReferralTreeNodeSerializer.model_validate(
+                    row
+                ).model_dump_json()
+                + "\n"
+            )
+        yield "".join(lines)
+
+    summary = ReferralTreeSummarySerializer(
+        total=sum(levels.values()), levels=levels
+    )
+    yield f'{{"summary":{summary.model_dump_json()}}}\n'
@@ -1,5 +1,12 @@
+from asyncio import gather, get_running_loop
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from secrets import compare_digest
 from time import time
-from uuid import UUID
+from typing import Annotated, Callable
 
 from authlib.jose import JWTClaims, jwt
 from authlib.jose.errors import (
@@ -8,7 +15,7 @@ from authlib.jose.errors import (
     ExpiredTokenError,
 )
 from bcrypt import checkpw, gensalt, hashpw
-from fastapi import HTTPException
+from fastapi import Header, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlmodel import SQLModel
 
@@ -19,6 +26,8 @@ oauth2 = OAuth2PasswordBearer(tokenUrl="login")
 
 
 class PasswordHasher:
+    _executor: Executor | None = None
+    _queue_depth: int = 0
 
     @staticmethod
     def hash_password(password: str) -> str:
@@ -31,7 +40,9 @@ class PasswordHasher:
         Returns:
             str: The hashed password as a UTF-8 encoded string.
         """
-        return hashpw(password.encode("utf-8"), gensalt()).decode("utf-8")
+        return hashpw(
+            password.encode("utf-8"), gensalt(settings.BCRYPT_ROUNDS)
+        ).decode("utf-8")
 
     @staticmethod
     def check_password(password: str, hashed_password: str) -> bool:
@@ -49,6 +60,112 @@ class PasswordHasher:
             password.encode("utf-8"), hashed_password.encode("utf-8")
         )
 
+    @classmethod
+    async def async_hash_password(cls, password: str) -> str:
+        """
+        Hash a plain-text password without blocking the event loop.
+
+        Args:
+            password (str): The plain-text password to be hashed.
+
+        Returns:
+            str: The hashed password as a UTF-8 encoded string.
+
+        Raises:
+            HTTPException: A 503 error if the hashing queue is full.
+        """
+        return await cls._run_in_executor(cls.hash_password, password)
+
+    @classmethod
+    async def async_check_password(
+        cls, password: str, hashed_password: str
+    ) -> bool:
+        """
+        Verify a plain-text password without blocking the event loop.
+
+        Args:
+            password (str): The plain-text password to be checked.
+            hashed_password (str): The hashed password to compare against.
+
+        Returns:
+            bool: True if the password matches the hash, False otherwise.
+
+        Raises:
+            HTTPException: A 503 error if the hashing queue is full.
+        """
+        return await cls._run_in_executor(
+            cls.check_password, password, hashed_password
+        )
+
+    @classmethod
+    async def hash_passwords(cls, passwords: list[str]) -> list[str]:
+        """
+        Hash many plain-text passwords in parallel on the worker pool.
+
+        Meant for batch jobs such as bulk imports, so the calls are not
+        counted against `PASSWORD_HASHER_MAX_QUEUE`.
+
+        Args:
+            passwords (list[str]): The plain-text passwords to be hashed.
+
+        Returns:
+            list[str]: The hashed passwords, in the same order.
+        """
+        loop = get_running_loop()
+        executor: Executor = cls.get_executor()
+        return await gather(
+            *(
+                loop.run_in_executor(executor, cls.hash_password, password)
+                for password in passwords
+            )
+        )
+
+    @classmethod
+    def get_executor(cls) -> Executor:
+        """
+        Return the worker pool used for bcrypt, creating it on first use.
+
+        The kind of pool and its size are taken from the
+        `PASSWORD_HASHER_EXECUTOR` and `PASSWORD_HASHER_WORKERS` settings.
+        """
+        if cls._executor is None:
+            if settings.PASSWORD_HASHER_EXECUTOR == "process":
+                cls._executor = ProcessPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHER_WORKERS
+                )
+            else:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHER_WORKERS,
+                    thread_name_prefix="bcrypt",
+                )
+        return cls._executor
+
+    @classmethod
+    def shutdown_executor(cls) -> None:
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=True, cancel_futures=True)
+            cls._executor = None
+
+    @classmethod
+    async def _run_in_executor(cls, func: Callable, *args):
+        if settings.PASSWORD_HASHER_EXECUTOR == "inline":
+            return func(*args)
+        # bcrypt calls are queued inside the pool, so we count every call
+        # that has been submitted but has not finished yet
+        if cls._queue_depth >= settings.PASSWORD_HASHER_MAX_QUEUE:
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please try again later.",
+                headers={"Retry-After": "1"},
+            )
+        cls._queue_depth += 1
+        try:
+            return await get_running_loop().run_in_executor(
+                cls.get_executor(), func, *args
+            )
+        finally:
+            cls._queue_depth -= 1
+
 
 class JWT_Token:
     @staticmethod
@@ -75,7 +192,25 @@ class JWT_Token:
         return jwt_token.decode("utf-8")
 
     @staticmethod
-    def check_jwt_token(jwt_token: str) -> str | None:
+    def create_user_token(user: SQLModel) -> str:
+        """
+        Create a JWT token for the given user.
+
+        The token carries both the user's email and uuid, so the principal
+        can be rebuilt from the claims without a database lookup.
+
+        Args:
+            user (SQLModel): The user the token is issued to.
+
+        Returns:
+            str: The encoded JWT token as a UTF-8 string.
+        """
+        return JWT_Token.create_token(
+            {"user_email": user.email, "user_uuid": str(user.uuid)}
+        )
+
+    @staticmethod
+    def check_jwt_token(jwt_token: str) -> JWTClaims | None:
         """
         Validate and decode a JWT token.
 
@@ -87,26 +222,32 @@ class JWT_Token:
             jwt_token (str): The JWT token to be validated and decoded.
 
         Returns:
-            `str`: The user's email extracted from the token if valid.\n
+            `JWTClaims`: The claims of the token if valid.\n
             `None`: If the token is invalid or expired.
         """
         try:
             token: JWTClaims = jwt.decode(jwt_token, settings.SECRET_KEY)
             token.validate_exp(time(), 0)
-            return token.get("user_email")
+            return token
         except (BadSignatureError, DecodeError, ExpiredTokenError):
             return None
 
 
-def verify_ownership(object: SQLModel, fieldname_owner: str, user_uuid: UUID):
-    if not hasattr(object, fieldname_owner):
-        raise AttributeError(
-            (
-                f"Model {object.__class__.__name__} does not have "
-                f"attribute '{fieldname_owner}'."
-            )
-        )
-    if getattr(object, fieldname_owner) != user_uuid:
+def verify_admin_token(
+    x_admin_token: Annotated[str | None, Header()] = None
+) -> None:
+    """
+    Allow the request only if it carries the configured `ADMIN_TOKEN` in the
+    `X-Admin-Token` header.
+
+    Raises:
+        HTTPException: A 403 error if admin access is not configured or the\
+            token does not match.
+    """
+    if not settings.ADMIN_TOKEN or not compare_digest(
+        (x_admin_token or "").encode("utf-8"),
+        settings.ADMIN_TOKEN.encode("utf-8"),
+    ):
         raise HTTPException(
             status_code=403,
             detail="You are not allowed to perform this action.",
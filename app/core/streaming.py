@@ -0,0 +1,93 @@
+from codecs import getincrementaldecoder
+from csv import writer
+from datetime import datetime
+from io import StringIO
+from typing import AsyncIterator
+from zlib import MAX_WBITS, compressobj
+
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE: str = "application/x-ndjson"
+CSV_MEDIA_TYPE: str = "text/csv"
+GZIP_MEDIA_TYPE: str = "application/gzip"
+
+
+async def ndjson_chunks(
+    chunks: AsyncIterator[list], serializer: type[BaseModel]
+) -> AsyncIterator[str]:
+    """
+    Serialize chunks of records into newline-delimited JSON, one response
+    body chunk per chunk of records.
+
+    Args:
+        chunks (AsyncIterator[list]): Chunks of records, e.g. from\\
+            `DBInteractionsManager.stream_records_from_db`.
+        serializer (type[BaseModel]): The serializer every record is dumped\\
+            with.
+    """
+    async for chunk in chunks:
+        yield "".join(
+            serializer.model_validate(record).model_dump_json() + "\n"
+            for record in chunk
+        )
+
+
+async def csv_chunks(
+    chunks: AsyncIterator[list], fields: list[str]
+) -> AsyncIterator[str]:
+    """
+    Serialize chunks of records into CSV, starting with a header row of
+    `fields`, one response body chunk per chunk of records.
+
+    Timestamps are written in ISO 8601 and missing values as empty cells.
+    """
+    buffer = StringIO()
+    rows = writer(buffer)
+    rows.writerow(fields)
+    yield buffer.getvalue()
+    async for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        rows.writerows(
+            [_csv_cell(getattr(record, name)) for name in fields]
+            for record in chunk
+        )
+        yield buffer.getvalue()
+
+
+def _csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def gzip_chunks(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """
+    Compress a stream of text into a gzip file as it is read, holding no
+    more than one chunk of it in memory.
+    """
+    # a window of MAX_WBITS with 16 added writes the gzip header and trailer
+    compressor = compressobj(wbits=MAX_WBITS | 16)
+    async for chunk in chunks:
+        if compressed := compressor.compress(chunk.encode()):
+            yield compressed
+    yield compressor.flush()
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Split a stream of UTF-8 encoded bytes, e.g. a request body, into lines
+    without reading the whole stream into memory.
+    """
+    decoder = getincrementaldecoder("utf-8")()
+    buffer: str = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
@@ -0,0 +1,159 @@
+from asyncio import CancelledError, Task, create_task, sleep
+from logging import Logger, getLogger
+from time import perf_counter
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.config.settings import Settings, get_settings
+from app.db.db import get_engine
+from app.db.db_interactions import DBInteractionsManager
+from app.models.model_mixins import utc_now
+from app.models.referral_code import ReferralCode
+from app.serializers.sweeper import SweeperStatsSerializer
+
+settings: Settings = get_settings()
+logger: Logger = getLogger(__name__)
+# key of the advisory lock held by the one process that sweeps, so that the
+# workers of every server do not all sweep on each interval
+SWEEPER_LOCK_KEY: int = 4_611_686_018_427_387_912
+
+
+class ExpiredCodesSweeper:
+    """
+    Background job that periodically deletes expired referral codes.
+
+    Every run deletes the expired codes in batches of at most `batch_size`
+    rows, each batch in its own short transaction, so the table is never
+    locked for long. The figures of the runs are kept in `stats`.
+
+    The job is started by every worker, but on PostgreSQL only the worker
+    holding an advisory lock sweeps. The lock is held on a connection of
+    its own until the worker stops, and the other workers try to take it
+    on every interval, so one of them takes over when the sweeping worker
+    dies.
+    """
+
+    def __init__(self, interval_seconds: float, batch_size: int):
+        self.interval_seconds: float = interval_seconds
+        self.batch_size: int = batch_size
+        self.stats = SweeperStatsSerializer()
+        self._task: Task | None = None
+        self._lock_connection: AsyncConnection | None = None
+
+    async def sweep(self) -> int:
+        """
+        Delete all referral codes that are expired right now.
+
+        Returns:
+            int: The number of deleted codes.
+        """
+        started: float = perf_counter()
+        removed: int = 0
+        while True:
+            batch_removed: int = (
+                await DBInteractionsManager.delete_batch_from_db(
+                    ReferralCode,
+                    [ReferralCode.expiration_time <= utc_now()],
+                    self.batch_size,
+                )
+            )
+            removed += batch_removed
+            if batch_removed < self.batch_size:
+                break
+            # let requests waiting on the event loop in between batches
+            await sleep(0)
+
+        self.stats.runs += 1
+        self.stats.last_run_at = utc_now()
+        self.stats.last_run_seconds = perf_counter() - started
+        self.stats.last_run_removed = removed
+        self.stats.total_removed += removed
+        logger.info("Removed %d expired referral codes.", removed)
+        return removed
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+        await self._release_lock()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self._acquire_lock():
+                    await self.sweep()
+            except CancelledError:
+                raise
+            except Exception:
+                self.stats.failed_runs += 1
+                logger.exception("Sweeping expired referral codes failed.")
+                # the lock may be lost with its connection, take it again
+                await self._release_lock()
+            await sleep(self.interval_seconds)
+
+    async def _acquire_lock(self) -> bool:
+        """
+        Whether this worker holds the sweeper lock, trying to take it when it
+        does not. Databases other than PostgreSQL, meant for local runs with
+        one process, are always swept.
+        """
+        if self._lock_connection is not None:
+            try:
+                await self._lock_connection.execute(text("SELECT 1"))
+                return True
+            except Exception:
+                logger.warning("Lost the connection of the sweeper lock.")
+                await self._release_lock()
+        if get_engine().dialect.name != "postgresql":
+            return True
+        connection: AsyncConnection = await get_engine().connect()
+        try:
+            connection = await connection.execution_options(
+                isolation_level="AUTOCOMMIT"
+            )
+            acquired: bool = await connection.scalar(
+                text("SELECT pg_try_advisory_lock(:key)"),
+                {"key": SWEEPER_LOCK_KEY},
+            )
+        except BaseException:
+            await connection.close()
+            raise
+        if not acquired:
+            await connection.close()
+            return False
+        self._lock_connection = connection
+        self.stats.holds_lock = True
+        logger.info("Sweeping expired referral codes in this process.")
+        return True
+
+    async def _release_lock(self) -> None:
+        connection: AsyncConnection | None = self._lock_connection
+        if connection is None:
+            return
+        self._lock_connection = None
+        self.stats.holds_lock = False
+        try:
+            await connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"),
+                {"key": SWEEPER_LOCK_KEY},
+            )
+        except Exception:
+            # the lock went away with the connection, which is discarded
+            await connection.invalidate()
+        finally:
+            await connection.close()
+
+
+expired_codes_sweeper = ExpiredCodesSweeper(
+    settings.EXPIRED_CODES_SWEEP_INTERVAL_SECONDS,
+    settings.EXPIRED_CODES_SWEEP_BATCH_SIZE,
+)
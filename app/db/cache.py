@@ -0,0 +1,519 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from functools import lru_cache, wraps
+from importlib import import_module
+from time import monotonic
+from typing import Any, Protocol
+
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import from_json, to_json
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from sqlmodel import SQLModel
+
+from app.config.settings import Settings, get_settings
+from app.db.db import (
+    has_pending_writes,
+    is_replica_session,
+    is_request_session,
+    run_after_commit,
+)
+from app.db.loading_profiles import get_loading_profile
+from app.models.model_mixins import utc_now
+
+settings: Settings = get_settings()
+# fields no lookup reading them is cached with: password hashes are kept
+# out of the in-process and the shared caches, and are always read fresh
+UNCACHED_FIELDS: frozenset[str] = frozenset({"password"})
+
+
+class CacheBackend(ABC):
+    """
+    Storage of the record cache. Entries hold the column values of a record
+    and are tagged, so that they can be invalidated without knowing their
+    keys.
+    """
+
+    # whether the workers of a server see the entries, and the invalidations,
+    # of one another
+    shared: bool = False
+
+    @abstractmethod
+    async def get(self, key: str) -> dict | None:
+        """Return the values stored under `key`, `None` if there are none."""
+
+    @abstractmethod
+    async def set(
+        self, key: str, values: dict, tags: list[str], ttl: float
+    ) -> None:
+        """Store `values` under `key` for `ttl` seconds."""
+
+    @abstractmethod
+    async def invalidate(self, tags: list[str]) -> None:
+        """Remove the entries stored with any of `tags`."""
+
+
+class InProcessCache(CacheBackend):
+    """
+    Cache held in the memory of the worker, evicting the least recently used
+    entries beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries: int = max_entries
+        self.entries: OrderedDict[str, tuple[float, dict, list[str]]] = (
+            OrderedDict()
+        )
+        self.tagged_keys: dict[str, set[str]] = {}
+
+    async def get(self, key: str) -> dict | None:
+        entry: tuple[float, dict, list[str]] | None = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    async def set(
+        self, key: str, values: dict, tags: list[str], ttl: float
+    ) -> None:
+        self._remove(key)
+        self.entries[key] = (monotonic() + ttl, values, tags)
+        for tag in tags:
+            self.tagged_keys.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    async def invalidate(self, tags: list[str]) -> None:
+        for tag in tags:
+            for key in self.tagged_keys.pop(tag, ()):
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry: tuple[float, dict, list[str]] | None = self.entries.pop(
+            key, None
+        )
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys: set[str] | None = self.tagged_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tagged_keys[tag]
+
+
+class NetworkCacheClient(Protocol):
+    """
+    The commands of a Redis-compatible client the network cache relies on.
+    """
+
+    async def get(self, name: str) -> bytes | None: ...
+
+    async def smembers(self, name: str) -> set[bytes]: ...
+
+    async def set(self, name: str, value: bytes, px: int) -> Any: ...
+
+    async def delete(self, *names: str) -> Any: ...
+
+    async def sadd(self, name: str, *values: str) -> Any: ...
+
+    async def pexpire(self, name: str, time: int) -> Any: ...
+
+
+class NetworkCache(CacheBackend):
+    """
+    Cache shared by all the workers through a Redis-compatible server. The
+    keys of the entries stored with a tag are kept in a set named after the
+    tag.
+    """
+
+    def __init__(self, client: NetworkCacheClient, prefix: str, ttl: float):
+        self.client: NetworkCacheClient = client
+        self.shared: bool = not isinstance(client, FakeNetworkCacheClient)
+        self.prefix: str = prefix
+        # tag sets outlive every entry they list, whose ttl is at most this
+        self.tag_ttl_ms: int = int(ttl * 1000)
+
+    async def get(self, key: str) -> dict | None:
+        raw: bytes | None = await self.client.get(f"{self.prefix}{key}")
+        return None if raw is None else from_json(raw)
+
+    async def set(
+        self, key: str, values: dict, tags: list[str], ttl: float
+    ) -> None:
+        name: str = f"{self.prefix}{key}"
+        await self.client.set(name, to_json(values), px=int(ttl * 1000))
+        for tag in tags:
+            await self.client.sadd(f"{self.prefix}tag:{tag}", name)
+            await self.client.pexpire(
+                f"{self.prefix}tag:{tag}", self.tag_ttl_ms
+            )
+
+    async def invalidate(self, tags: list[str]) -> None:
+        for tag in tags:
+            tag_name: str = f"{self.prefix}tag:{tag}"
+            names: set[bytes] = await self.client.smembers(tag_name)
+            await self.client.delete(
+                tag_name,
+                *(
+                    name.decode() if isinstance(name, bytes) else name
+                    for name in names
+                ),
+            )
+
+
+class FakeNetworkCacheClient:
+    """
+    In-memory stand-in for a Redis client implementing `NetworkCacheClient`,
+    to run the network cache in tests and local development without a
+    server.
+    """
+
+    def __init__(self):
+        self.values: dict[str, tuple[float | None, Any]] = {}
+
+    async def get(self, name: str) -> bytes | None:
+        return self._get(name)
+
+    async def smembers(self, name: str) -> set[bytes]:
+        return set(self._get(name) or ())
+
+    async def set(self, name: str, value: bytes, px: int) -> bool:
+        self.values[name] = (monotonic() + px / 1000, value)
+        return True
+
+    async def delete(self, *names: str) -> int:
+        return sum(
+            self.values.pop(name, None) is not None for name in names
+        )
+
+    async def sadd(self, name: str, *values: str) -> int:
+        members: set[bytes] = self._get(name) or set()
+        added: int = len({value.encode() for value in values} - members)
+        members.update(value.encode() for value in values)
+        expires_at: float | None = self.values.get(name, (None, None))[0]
+        self.values[name] = (expires_at, members)
+        return added
+
+    async def pexpire(self, name: str, time: int) -> bool:
+        if self._get(name) is None:
+            return False
+        self.values[name] = (monotonic() + time / 1000, self.values[name][1])
+        return True
+
+    def _get(self, name: str) -> Any:
+        expires_at, value = self.values.get(name, (None, None))
+        if expires_at is not None and expires_at <= monotonic():
+            del self.values[name]
+            return None
+        return value
+
+
+class RecordCache:
+    """
+    Read-through cache of the lookups of a single record by one of its
+    unique fields, such as a user by email or a referral code by owner.
+
+    Entries are keyed by model and filter, and tagged with every unique
+    field value of the cached record, so that a write to the record
+    invalidates all the lookups that could return it. Only found records
+    are cached; records whose model defines `active_until` are not cached
+    beyond it. Hits and misses are counted per model.
+    """
+
+    def __init__(self, backend: CacheBackend | None, ttl: float):
+        self.backend: CacheBackend | None = backend
+        self.ttl: float = ttl
+        self.hits: defaultdict[str, int] = defaultdict(int)
+        self.misses: defaultdict[str, int] = defaultdict(int)
+        self.invalidations: defaultdict[str, int] = defaultdict(int)
+
+    def read_through(self, get_record):
+        """
+        Decorate `DBInteractionsManager.get_record_from_db` to answer the
+        lookups it can cache from the cache. Lookups made with a session
+        that has uncommitted writes always go to the database.
+
+        Projected lookups are cached apart from the records, with only the
+        projected values, provided the projection holds every unique field
+        the entry must be invalidated by. Lookups reading any of the
+        `UNCACHED_FIELDS`, such as the user lookup of the login, always go
+        to the database, as do the lookups made with `use_cache=False`.
+
+        Misses read from a replica are not stored: the replica may not have
+        replayed a write whose invalidation already ran, and the entry would
+        serve the previous record for the whole TTL. Only reads from the
+        primary fill the cache.
+        """
+
+        @wraps(get_record)
+        async def wrapper(
+            serializer_data: dict,
+            needed_model: SQLModel,
+            session: AsyncSession,
+            relationship_names: list[str] = [],
+            loading_profile: str | None = None,
+            projection: type[BaseModel] | None = None,
+            use_cache: bool = True,
+        ):
+            key: str | None = self._lookup_key(
+                serializer_data,
+                needed_model,
+                relationship_names,
+                loading_profile,
+                projection,
+            )
+            if not use_cache or key is None or has_pending_writes(session):
+                return await get_record(
+                    serializer_data,
+                    needed_model,
+                    session=session,
+                    relationship_names=relationship_names,
+                    loading_profile=loading_profile,
+                    projection=projection,
+                )
+            values: dict | None = await self.backend.get(key)
+            if values is not None:
+                self.hits[needed_model.__name__] += 1
+                if projection is not None:
+                    return _construct(values, needed_model, projection)
+                return await self._revive(values, needed_model, session)
+            self.misses[needed_model.__name__] += 1
+            record: SQLModel | BaseModel | None = await get_record(
+                serializer_data,
+                needed_model,
+                session=session,
+                projection=projection,
+            )
+            if record is not None and not is_replica_session(session):
+                await self._store(key, record, needed_model)
+            return record
+
+        return wrapper
+
+    async def invalidate(
+        self,
+        session: AsyncSession,
+        needed_model: SQLModel,
+        records: list[SQLModel | dict],
+    ) -> None:
+        """
+        Invalidate the cached lookups that may return any of `records`, once
+        the writes made with `session` are committed.
+
+        Args:
+            session (AsyncSession): The session the records were written\
+                with.
+            needed_model (SQLModel): The model of the records.
+            records (list[SQLModel | dict]): Written records, or dictionaries\
+                with the values of some of their unique fields.
+        """
+        if self.backend is None:
+            return
+
+        async def invalidate_records() -> None:
+            await self.invalidate_committed(needed_model, records)
+
+        await run_after_commit(session, invalidate_records)
+
+    async def invalidate_committed(
+        self, needed_model: SQLModel, records: list[SQLModel | dict]
+    ) -> None:
+        """
+        Invalidate the cached lookups that may return any of `records`, for
+        writes already committed outside of a session.
+
+        Args:
+            needed_model (SQLModel): The model of the records.
+            records (list[SQLModel | dict]): Written records, or dictionaries\
+                with the values of some of their unique fields.
+        """
+        if self.backend is None or not records:
+            return
+        self.invalidations[needed_model.__name__] += 1
+        await self.backend.invalidate(
+            [
+                tag
+                for record in records
+                for tag in self._tags(needed_model, record)
+            ]
+        )
+
+    @property
+    def process_local(self) -> bool:
+        """
+        Whether the entries are held by this worker alone, so that the
+        writes of the other workers do not invalidate them.
+        """
+        return self.backend is not None and not self.backend.shared
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        Return the hits, misses and invalidations of this worker per model.
+        """
+        return {
+            name: {
+                "hits": self.hits[name],
+                "misses": self.misses[name],
+                "invalidations": self.invalidations[name],
+            }
+            for name in sorted(
+                {*self.hits, *self.misses, *self.invalidations}
+            )
+        }
+
+    def _lookup_key(
+        self,
+        serializer_data: dict,
+        needed_model: SQLModel,
+        relationship_names: list[str],
+        loading_profile: str | None,
+        projection: type[BaseModel] | None,
+    ) -> str | None:
+        if self.backend is None or len(serializer_data) != 1:
+            return None
+        if relationship_names or (
+            loading_profile is not None
+            and get_loading_profile(loading_profile)
+        ):
+            return None
+        [(field, value)] = serializer_data.items()
+        if field not in _unique_fields(needed_model):
+            return None
+        read_fields = (
+            inspect(needed_model).columns.keys()
+            if projection is None
+            else projection.model_fields
+        )
+        if not UNCACHED_FIELDS.isdisjoint(read_fields):
+            return None
+        if projection is None:
+            return _tag(needed_model, field, value)
+        # entries without every unique field, or without the expiry of the
+        # record, could not be invalidated or expired in time
+        if hasattr(needed_model, "active_until") or not set(
+            _unique_fields(needed_model)
+        ).issubset(projection.model_fields):
+            return None
+        return f"{_tag(needed_model, field, value)}#{projection.__name__}"
+
+    def _tags(
+        self, needed_model: SQLModel, record: SQLModel | BaseModel | dict
+    ) -> list[str]:
+        values: dict = (
+            record if isinstance(record, dict) else _column_values(record)
+        )
+        return [
+            _tag(needed_model, field, values[field])
+            for field in _unique_fields(needed_model)
+            if values.get(field) is not None
+        ]
+
+    async def _store(
+        self, key: str, record: SQLModel | BaseModel, needed_model: SQLModel
+    ) -> None:
+        ttl: float = self.ttl
+        if hasattr(record, "active_until"):
+            ttl = min(
+                ttl, (record.active_until() - utc_now()).total_seconds()
+            )
+            if ttl <= 0:
+                return
+        await self.backend.set(
+            key,
+            _column_values(record),
+            self._tags(needed_model, record),
+            ttl,
+        )
+
+    @staticmethod
+    async def _revive(
+        values: dict, needed_model: SQLModel, session: AsyncSession
+    ) -> SQLModel:
+        """
+        Rebuild a record from cached values as if it had just been loaded, so
+        it can be deleted or updated like any other record.
+        """
+        adapters: dict[str, TypeAdapter] = _field_adapters(needed_model)
+        record: SQLModel = needed_model(
+            **{
+                name: adapters[name].validate_python(value)
+                for name, value in values.items()
+            }
+        )
+        make_transient_to_detached(record)
+        if is_request_session(session):
+            record = await session.merge(record, load=False)
+        return record
+
+
+@lru_cache
+def _unique_fields(needed_model: SQLModel) -> tuple[str, ...]:
+    return tuple(
+        column.key
+        for column in inspect(needed_model).columns
+        if column.primary_key or column.unique
+    )
+
+
+@lru_cache
+def _field_adapters(needed_model: SQLModel) -> dict[str, TypeAdapter]:
+    # plain type adapters, the field constraints apply to user input only
+    return {
+        column.key: TypeAdapter(
+            needed_model.model_fields[column.key].annotation
+        )
+        for column in inspect(needed_model).columns
+    }
+
+
+def _column_values(record: SQLModel | BaseModel) -> dict:
+    if getattr(type(record), "__table__", None) is None:
+        # a projection of the record
+        return dict(record.__dict__)
+    return {
+        column.key: getattr(record, column.key)
+        for column in inspect(type(record)).columns
+    }
+
+
+def _construct(
+    values: dict, needed_model: SQLModel, projection: type[BaseModel]
+) -> BaseModel:
+    adapters: dict[str, TypeAdapter] = _field_adapters(needed_model)
+    return projection.model_construct(
+        **{
+            name: adapters[name].validate_python(value)
+            for name, value in values.items()
+        }
+    )
+
+
+def _tag(needed_model: SQLModel, field: str, value: Any) -> str:
+    return f"{needed_model.__name__}:{field}={value}"
+
+
+@lru_cache
+def get_record_cache() -> RecordCache:
+    """
+    Return the record cache of this worker, with the backend chosen by the
+    `CACHE_BACKEND` setting.
+    """
+    backend: CacheBackend | None = None
+    if settings.CACHE_BACKEND == "memory":
+        backend = InProcessCache(settings.CACHE_MAX_ENTRIES)
+    elif settings.CACHE_BACKEND == "network":
+        module_name, _, factory_name = (
+            settings.CACHE_NETWORK_CLIENT.partition(":")
+        )
+        client: NetworkCacheClient = getattr(
+            import_module(module_name), factory_name
+        )()
+        backend = NetworkCache(
+            client, settings.CACHE_KEY_PREFIX, settings.CACHE_TTL_SECONDS
+        )
+    return RecordCache(backend, settings.CACHE_TTL_SECONDS)
@@ -1,50 +1,186 @@
-from contextlib import asynccontextmanager
-from functools import wraps
-from typing import AsyncGenerator
+from contextlib import (
+    AbstractAsyncContextManager,
+    asynccontextmanager,
+    nullcontext,
+)
+from contextvars import ContextVar
+from functools import partial, wraps
+from inspect import isasyncgenfunction
+from logging import Logger, getLogger
+from time import monotonic
+from typing import AsyncGenerator, Awaitable, Callable
 
-from fastapi import FastAPI
+from sqlalchemy import URL, event, make_url
+from sqlalchemy.exc import DBAPIError, InterfaceError
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
 from sqlalchemy.ext.asyncio.engine import AsyncEngine
-from sqlmodel import SQLModel
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.config.settings import Settings, get_settings
+from app.db.instrumentation import (
+    TimedAsyncAdaptedQueuePool,
+    instrument_engine,
+)
 from app.models import *    # noqa: F401, F403
 
 settings: Settings = get_settings()
+logger: Logger = getLogger(__name__)
+# session bound to the current request by `RequestSessionMiddleware`
+request_session: ContextVar[AsyncSession | None] = ContextVar(
+    "request_session", default=None
+)
+# set once something was written in the current context, whose reads then
+# stay on the primary to see their own writes
+wrote_to_primary: ContextVar[bool] = ContextVar(
+    "wrote_to_primary", default=False
+)
+
+
+class Replica:
+    """
+    A read-only replica of the database and its session factory.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine: AsyncEngine = engine
+        self.sessions: async_sessionmaker = async_sessionmaker(
+            engine, expire_on_commit=False
+        )
+        # monotonic time before which the replica is not used
+        self.ejected_until: float = 0
+
+
+class ReplicaSet:
+    """
+    Spreads reads over the replicas in turn. A replica whose connection
+    fails is ejected for `eject_seconds`, after which it is tried again.
+    """
+
+    def __init__(self, replicas: list[Replica], eject_seconds: float):
+        self.replicas: list[Replica] = replicas
+        self.eject_seconds: float = eject_seconds
+        self.turn: int = 0
+
+    def choose(self) -> Replica | None:
+        """
+        Return the next replica that is not ejected, `None` if there is
+        none.
+        """
+        now: float = monotonic()
+        for _ in range(len(self.replicas)):
+            replica: Replica = self.replicas[self.turn % len(self.replicas)]
+            self.turn += 1
+            if replica.ejected_until <= now:
+                return replica
+        return None
+
+    def eject(self, replica: Replica, error: Exception) -> None:
+        replica.ejected_until = monotonic() + self.eject_seconds
+        logger.warning(
+            "Replica %s ejected for %s seconds: %r",
+            replica.engine.url.render_as_string(hide_password=True),
+            self.eject_seconds,
+            error,
+        )
+
+
+replica_set: ReplicaSet = ReplicaSet([], settings.REPLICA_EJECT_SECONDS)
 
 
 @asynccontextmanager
-async def app_lifespan(app: FastAPI):
+async def db_lifespan() -> AsyncGenerator[AsyncEngine, None]:
     """
-    Manages the lifespan of the FastAPI application by setting up and tearing
-    down the database connection.
+    Sets up and tears down the database connection.
 
-    This function creates an asynchronous SQLAlchemy engine and session
-    factory, initializes the database schema, and ensures proper disposal of
-    the engine when the application shuts down.
+    This function creates an asynchronous SQLAlchemy engine and the global
+    session factory, plus an engine per replica from the
+    `POSTGRES_REPLICA_URLS` setting, and disposes of the engines on exit. It
+    is used by the application lifespan and by the command line tools.
     """
+    engine: AsyncEngine = create_engine(settings.database_url, "primary")
+    replicas: list[Replica] = [
+        Replica(create_engine(url, f"replica{index}"))
+        for index, url in enumerate(settings.POSTGRES_REPLICA_URLS)
+    ]
+    global async_sessions_factory, current_engine, replica_set
+    async_sessions_factory = async_sessionmaker(engine, expire_on_commit=False)
+    current_engine = engine
+    replica_set = ReplicaSet(replicas, settings.REPLICA_EJECT_SECONDS)
+    try:
+        yield engine
+    finally:
+        await engine.dispose()
+        for replica in replicas:
+            await replica.engine.dispose()
+
+
+def create_engine(url: str, name: str) -> AsyncEngine:
+    """
+    Create the engine of the database at `url`, logging as `name`, with the
+    statements and the pool waits recorded in the request stats, and the
+    pool sized by the `DATABASE_POOL_*` settings.
+
+    SQLite, meant for local runs, waits for the lock of a concurrent writer
+    instead of failing, runs in WAL mode so readers do not block writers,
+    and enforces foreign keys like PostgreSQL.
+    """
+    options: dict = {
+        "pool_recycle": settings.DATABASE_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": settings.DATABASE_POOL_PRE_PING,
+    }
+    url_object: URL = make_url(url)
+    if url_object.get_backend_name() == "sqlite":
+        options["connect_args"] = {"timeout": 30}
+    elif url_object.get_driver_name() == "asyncpg":
+        options["connect_args"] = {
+            "prepared_statement_cache_size": (
+                settings.DATABASE_STATEMENT_CACHE_SIZE
+            )
+        }
+    if issubclass(
+        url_object.get_dialect().get_pool_class(url_object),
+        AsyncAdaptedQueuePool,
+    ):
+        options.update(
+            poolclass=TimedAsyncAdaptedQueuePool,
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_timeout=settings.DATABASE_POOL_TIMEOUT_SECONDS,
+        )
     engine: AsyncEngine = create_async_engine(
-        url=(
-            f"postgresql+asyncpg://{settings.POSTGRES_USER}"
-            f":{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}"
-            f":{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}"
-        ),
-        echo=True,
+        url,
+        echo=settings.DATABASE_ECHO,
+        logging_name=name,
+        pool_logging_name=name,
+        **options,
     )
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine.sync_engine, "connect", _configure_sqlite)
+    instrument_engine(engine, name)
+    return engine
 
-    global async_sessions_factory
-    async_sessions_factory = async_sessionmaker(engine, expire_on_commit=False)
-    yield
-    await engine.dispose()
+
+def _configure_sqlite(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
 
 
-async def get_session() -> AsyncGenerator[AsyncSession]:
+def get_engine() -> AsyncEngine:
+    """
+    Return the engine created by `db_lifespan`, for operations that need a
+    connection rather than a session.
+    """
+    return current_engine
+
+
+async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """
     Creates and yields an asynchronous database session.
 
@@ -52,15 +188,21 @@ async def get_session() -> AsyncGenerator[AsyncSession]:
     session using the global `async_sessions_factory`. It yields the session
     for use within an asynchronous context manager.
 
+    When a session is bound to the current request, that session is yielded
+    instead of a new one.
+
     Yields:
         AsyncSession: An asynchronous SQLAlchemy session object that can be
                       used for database operations.
     """
+    if (session := request_session.get()) is not None:
+        yield session
+        return
     async with async_sessions_factory() as session:
         yield session
 
 
-def async_session_decorator(async_func):
+def async_session_decorator(async_func=None, *, read_only: bool = False):
     """
     A decorator that provides an asynchronous database session to the decorated
     function.
@@ -68,7 +210,16 @@ def async_session_decorator(async_func):
     This decorator wraps an asynchronous function and automatically creates and
     manages an asynchronous database session for it. The session is created
     using the global async_sessions_factory and is passed as a keyword
-    argument to the decorated function.
+    argument to the decorated function. When a session is bound to the
+    current request, that session is passed instead.
+
+    Functions decorated with `read_only=True` get a session on a replica
+    when replicas are configured, unless the current context already wrote
+    to the primary. If the replica cannot be reached, it is ejected and the
+    function runs on the primary instead.
+
+    Asynchronous generators are supported too, the session then stays open
+    until the generator is exhausted or closed.
 
     Usage:
     ------
@@ -77,12 +228,185 @@ def async_session_decorator(async_func):
     async def my_function(arg1, arg2, session: AsyncSession):
         # Use the session here
         ...
+
+    @async_session_decorator(read_only=True)
+    async def my_query(arg1, session: AsyncSession):
+        ...
     ```
     """
+    if async_func is None:
+        return partial(async_session_decorator, read_only=read_only)
+
+    if isasyncgenfunction(async_func):
+
+        @wraps(async_func)
+        async def generator_wrapper(*args, **kwargs):
+            if (session := request_session.get()) is not None:
+                async for item in async_func(*args, **kwargs, session=session):
+                    yield item
+                return
+            if read_only and (replica := _choose_replica()) is not None:
+                started: bool = False
+                try:
+                    async with replica.sessions() as session:
+                        async for item in async_func(
+                            *args, **kwargs, session=session
+                        ):
+                            started = True
+                            yield item
+                    return
+                except Exception as error:
+                    # rows already sent cannot be read again elsewhere
+                    if started or not is_disconnect(error):
+                        raise
+                    replica_set.eject(replica, error)
+            async with async_sessions_factory() as session:
+                async for item in async_func(*args, **kwargs, session=session):
+                    yield item
+
+        return generator_wrapper
 
     @wraps(async_func)
     async def wrapper(*args, **kwargs):
+        if (session := request_session.get()) is not None:
+            return await async_func(*args, **kwargs, session=session)
+        if read_only and (replica := _choose_replica()) is not None:
+            try:
+                async with replica.sessions() as session:
+                    return await async_func(*args, **kwargs, session=session)
+            except Exception as error:
+                if not is_disconnect(error):
+                    raise
+                replica_set.eject(replica, error)
         async with async_sessions_factory() as session:
             return await async_func(*args, **kwargs, session=session)
 
     return wrapper
+
+
+def _choose_replica() -> Replica | None:
+    if wrote_to_primary.get():
+        return None
+    return replica_set.choose()
+
+
+def is_disconnect(error: Exception) -> bool:
+    """
+    Whether `error` means the database could not be reached, rather than
+    that the query itself failed.
+    """
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (OSError, TimeoutError, InterfaceError))
+
+
+def is_request_session(session: AsyncSession) -> bool:
+    return session is request_session.get()
+
+
+def is_replica_session(session: AsyncSession) -> bool:
+    """
+    Whether `session` reads from a replica, which may lag behind the
+    primary.
+    """
+    return session.bind is not current_engine
+
+
+async def commit_or_flush(session: AsyncSession) -> None:
+    """
+    Commit the session, or only flush it when it is the session bound to the
+    current request, which is committed once by `RequestSessionMiddleware`.
+
+    The reads that follow in the current context go to the primary, so they
+    see the write even before it reaches the replicas.
+    """
+    wrote_to_primary.set(True)
+    if is_request_session(session):
+        await session.flush()
+    else:
+        await session.commit()
+
+
+async def run_after_commit(
+    session: AsyncSession, callback: Callable[[], Awaitable[None]]
+) -> None:
+    """
+    Run `callback` once the writes made with `session` are committed.
+
+    Sessions that are not bound to a request commit their own writes, so the
+    callback runs right away. For the session bound to the current request
+    it runs after `RequestSessionMiddleware` commits, and is dropped if the
+    request is rolled back.
+    """
+    if is_request_session(session):
+        session.info.setdefault("after_commit", []).append(callback)
+    else:
+        await callback()
+
+
+def has_pending_writes(session: AsyncSession) -> bool:
+    """
+    Whether writes made with `session` wait for callbacks registered with
+    `run_after_commit`.
+    """
+    return bool(session.info.get("after_commit"))
+
+
+def savepoint_if_request_session(
+    session: AsyncSession,
+) -> AbstractAsyncContextManager:
+    """
+    Wrap a statement that may fail in a savepoint when the session is bound
+    to the current request, so the failure does not abort the transaction
+    shared by the whole request. For other sessions nothing is done.
+    """
+    if is_request_session(session):
+        return session.begin_nested()
+    return nullcontext()
+
+
+class RequestSessionMiddleware:
+    """
+    Unit of work per HTTP request.
+
+    Opens one session for the request and binds it to the request context,
+    so `get_session`, `async_session_decorator` and everything built on them
+    (`get_user_from_jwt`, `get_object_or_404`, `DBInteractionsManager`) share
+    a single connection and transaction. The transaction is committed right
+    before a successful response is sent and rolled back for error
+    responses. Writes made afterwards by background tasks are committed when
+    the request finishes. Callbacks registered with `run_after_commit` run
+    after each commit.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async with async_sessions_factory() as session:
+
+            async def send_after_commit(message: Message):
+                if message["type"] == "http.response.start":
+                    if message["status"] < 400:
+                        await self._commit(session)
+                    else:
+                        await session.rollback()
+                        session.info.pop("after_commit", None)
+                await send(message)
+
+            token = request_session.set(session)
+            try:
+                await self.app(scope, receive, send_after_commit)
+                if session.in_transaction():
+                    await self._commit(session)
+            finally:
+                request_session.reset(token)
+
+    @staticmethod
+    async def _commit(session: AsyncSession) -> None:
+        await session.commit()
+        for callback in session.info.pop("after_commit", []):
+            await callback()
@@ -1,24 +1,312 @@
-from sqlalchemy.engine import Result
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, AsyncIterator
+
+from pydantic import BaseModel
+from sqlalchemy import (
+    String,
+    bindparam,
+    cast,
+    delete,
+    inspect,
+    literal,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Result, RowMapping
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
-from sqlalchemy.sql.expression import Select
+from sqlalchemy.ext.asyncio import AsyncResult, AsyncSession
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import CTE, Select
 from sqlmodel import SQLModel, select
 
-from app.db.db import async_session_decorator
+from app.db.cache import RecordCache, get_record_cache
+from app.db.db import (
+    async_session_decorator,
+    commit_or_flush,
+    savepoint_if_request_session,
+)
+from app.db.loading_profiles import get_loading_profile
+
+record_cache: RecordCache = get_record_cache()
 
 
 class DBInteractionsManager:
 
     @staticmethod
-    @async_session_decorator
+    @async_session_decorator(read_only=True)
+    @record_cache.read_through
     async def get_record_from_db(
         serializer_data: dict,
         needed_model: SQLModel,
         session: AsyncSession,
         relationship_names: list[str] = [],
+        loading_profile: str | None = None,
+        projection: type[BaseModel] | None = None,
+        use_cache: bool = True,
     ):
+        """
+        Fetch the record matching `serializer_data`.
+
+        With a `projection`, only the columns of the fields it declares are
+        selected, and the projection is built from them without validation
+        or ORM instances, so for a user no password hash is read.
+
+        With `use_cache=False`, the record cache is bypassed, for the
+        lookups a write is decided on.
+        """
+        if loading_profile is not None:
+            relationship_names = [
+                *get_loading_profile(loading_profile),
+                *relationship_names,
+            ]
+        db_result: Result = await session.execute(
+            DBInteractionsManager._lookup_query(
+                needed_model,
+                tuple(serializer_data),
+                tuple(
+                    field
+                    for field, value in serializer_data.items()
+                    if value is None
+                ),
+                tuple(relationship_names) if projection is None else (),
+                projection,
+            ),
+            {
+                field: value
+                for field, value in serializer_data.items()
+                if value is not None
+            },
+        )
+        if projection is not None:
+            row: RowMapping | None = db_result.mappings().first()
+            return projection.model_construct(**row) if row else None
+        return db_result.scalar()
+
+    @staticmethod
+    @async_session_decorator(read_only=True)
+    async def get_records_from_db(
+        serializer_data: dict,
+        needed_model: SQLModel,
+        session: AsyncSession,
+        order_by: list[str] = [],
+        limit: int | None = None,
+        after: tuple[Any, ...] | None = None,
+        projection: type[BaseModel] | None = None,
+    ) -> list:
+        """
+        Fetch the records matching `serializer_data`, ordered by the
+        `order_by` columns.
+
+        `after` holds the values of the `order_by` columns of the last record
+        of the previous page; only records that sort after it are returned,
+        so pages are read with an index seek instead of an OFFSET.
+
+        With a `projection`, only the columns of the fields it declares are
+        selected and projections are returned instead of records.
+        """
+        sql_query: Select = DBInteractionsManager._ordered_query(
+            serializer_data, needed_model, order_by, after, projection
+        )
+        if limit is not None:
+            sql_query = sql_query.limit(limit)
+
+        db_result: Result = await session.execute(sql_query)
+        if projection is not None:
+            return [
+                projection.model_construct(**row)
+                for row in db_result.mappings()
+            ]
+        return list(db_result.scalars())
+
+    @staticmethod
+    @async_session_decorator(read_only=True)
+    async def stream_records_from_db(
+        serializer_data: dict,
+        needed_model: SQLModel,
+        session: AsyncSession,
+        order_by: list[str] = [],
+        chunk_size: int = 1000,
+        projection: type[BaseModel] | None = None,
+    ) -> AsyncIterator[list]:
+        """
+        Read the records matching `serializer_data` through a server-side
+        cursor and yield them in lists of at most `chunk_size` records, so
+        only one chunk is held in memory at a time.
+
+        With a `projection`, only the columns of the fields it declares are
+        selected and projections are yielded instead of records.
+        """
+        sql_query: Select = DBInteractionsManager._ordered_query(
+            serializer_data, needed_model, order_by, projection=projection
+        ).execution_options(yield_per=chunk_size)
+
+        db_result: AsyncResult = await session.stream(sql_query)
+        if projection is None:
+            async for chunk in db_result.scalars().partitions():
+                yield chunk
+            return
+        async for chunk in db_result.mappings().partitions():
+            yield [projection.model_construct(**row) for row in chunk]
+
+    @staticmethod
+    @async_session_decorator(read_only=True)
+    async def stream_tree_from_db(
+        root_value: Any,
+        needed_model: SQLModel,
+        parent_field: str,
+        fields: list[str],
+        max_depth: int,
+        session: AsyncSession,
+        key_field: str = "uuid",
+        chunk_size: int = 1000,
+    ) -> AsyncIterator[list]:
+        """
+        Walk a self-referencing model downwards from `root_value` with a
+        single `WITH RECURSIVE` query and yield the descendants in chunks.
+
+        Every yielded row holds the requested `fields` plus `depth`, which is
+        1 for the direct children of the root. Rows come out level by level.
+        Each row also tracks the path of keys that led to it, and a row whose
+        key is already on its path is not expanded again, so a cycle in the
+        data cannot make the query run away.
+
+        Args:
+            root_value (Any): The key of the node whose subtree is returned.
+            needed_model (SQLModel): The self-referencing model.
+            parent_field (str): The field that references the parent node.
+            fields (list[str]): The fields to return for every node.
+            max_depth (int): How many levels below the root to descend.
+            key_field (str): The field `parent_field` refers to.
+            chunk_size (int): The maximum number of rows per chunk.
+        """
+        for name in (parent_field, key_field, *fields):
+            if not hasattr(needed_model, name):
+                raise AttributeError(
+                    (
+                        f"Model {needed_model.__name__} does not have "
+                        f"attribute {name}."
+                    )
+                )
+        key = getattr(needed_model, key_field)
+        parent = getattr(needed_model, parent_field)
+        tree: CTE = (
+            select(
+                *(getattr(needed_model, name) for name in fields),
+                key.label("tree_key"),
+                literal(1).label("depth"),
+                (cast(parent, String) + "/" + cast(key, String)).label("path"),
+            )
+            .where(parent == root_value)
+            .cte("tree", recursive=True)
+        )
+        child = aliased(needed_model)
+        child_key = getattr(child, key_field)
+        tree = tree.union_all(
+            select(
+                *(getattr(child, name) for name in fields),
+                child_key,
+                tree.c.depth + 1,
+                tree.c.path + "/" + cast(child_key, String),
+            )
+            .join(tree, getattr(child, parent_field) == tree.c.tree_key)
+            .where(
+                tree.c.depth < max_depth,
+                ~tree.c.path.contains(cast(child_key, String)),
+            )
+        )
+        sql_query: Select = select(
+            *(tree.c[name] for name in fields), tree.c.depth
+        ).execution_options(yield_per=chunk_size)
+
+        db_result: AsyncResult = await session.stream(sql_query)
+        async for chunk in db_result.mappings().partitions():
+            yield chunk
+
+    @staticmethod
+    @async_session_decorator(read_only=True)
+    async def stream_table_from_db(
+        needed_model: SQLModel,
+        projection: type[BaseModel],
+        session: AsyncSession,
+        updated_since: datetime | None = None,
+        chunk_size: int = 1000,
+    ) -> AsyncIterator[list]:
+        """
+        Read every record of the model through a server-side cursor, those
+        its `active_criteria` rejects included, and yield the columns of the
+        fields `projection` declares in lists of at most `chunk_size`
+        projections.
+
+        Args:
+            needed_model (SQLModel): The model, which must have an\
+                `updated_at` field to be read incrementally.
+            projection (type[BaseModel]): The serializer of the fields to\
+                read.
+            updated_since (datetime | None): Only read the records updated\
+                at or after this time, all of them when it is not given.
+            chunk_size (int): The maximum number of records per chunk.
+        """
+        for name in projection.model_fields:
+            if name not in needed_model.model_fields:
+                raise AttributeError(
+                    (
+                        f"Model {needed_model.__name__} does not have "
+                        f"attribute {name}."
+                    )
+                )
+        sql_query: Select = select(
+            *(getattr(needed_model, name) for name in projection.model_fields)
+        )
+        if updated_since is not None:
+            sql_query = sql_query.where(
+                needed_model.updated_at >= updated_since
+            )
+
+        db_result: AsyncResult = await session.stream(
+            sql_query.execution_options(yield_per=chunk_size)
+        )
+        async for chunk in db_result.mappings().partitions():
+            yield [projection.model_construct(**row) for row in chunk]
+
+    @staticmethod
+    def _active_query(needed_model: SQLModel) -> Select:
+        """
+        Select the model, leaving out the records its `active_criteria`
+        (if it defines one) rejects, such as expired referral codes.
+        """
         sql_query: Select = select(needed_model)
+        if hasattr(needed_model, "active_criteria"):
+            sql_query = sql_query.where(needed_model.active_criteria())
+        return sql_query
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _lookup_query(
+        needed_model: SQLModel,
+        fields: tuple[str, ...],
+        null_fields: tuple[str, ...],
+        relationship_names: tuple[str, ...],
+        projection: type[BaseModel] | None,
+    ) -> Select:
+        """
+        Select the records whose `fields` equal the bound parameters of the
+        same names, or are NULL for the `null_fields`.
+
+        The statement is built once per combination of arguments, so the
+        common lookups, such as a user by email or a referral code by
+        owner, only bind new values to a statement SQLAlchemy has already
+        compiled and, on asyncpg, prepared.
+        """
+        DBInteractionsManager._check_fields(needed_model, fields)
+        if projection is not None:
+            sql_query: Select = DBInteractionsManager._projected_query(
+                needed_model, projection
+            )
+        else:
+            sql_query = DBInteractionsManager._active_query(needed_model)
         for name in relationship_names:
             if not hasattr(needed_model, name):
                 raise AttributeError(
@@ -30,10 +318,67 @@ class DBInteractionsManager:
             sql_query = sql_query.options(
                 selectinload(getattr(needed_model, name))
             )
-        sql_query = sql_query.filter_by(**serializer_data)
+        return sql_query.where(
+            *(
+                (
+                    getattr(needed_model, field).is_(None)
+                    if field in null_fields
+                    else getattr(needed_model, field) == bindparam(field)
+                )
+                for field in fields
+            )
+        )
 
-        db_result: Result = await session.execute(sql_query)
-        return db_result.scalar()
+    @staticmethod
+    def _projected_query(
+        needed_model: SQLModel, projection: type[BaseModel]
+    ) -> Select:
+        """
+        Select the columns of the fields `projection` declares, leaving out
+        the records the `active_criteria` of the model rejects.
+        """
+        for name in projection.model_fields:
+            if name not in needed_model.model_fields:
+                raise AttributeError(
+                    (
+                        f"Model {needed_model.__name__} does not have "
+                        f"attribute {name}."
+                    )
+                )
+        sql_query: Select = select(
+            *(getattr(needed_model, name) for name in projection.model_fields)
+        )
+        if hasattr(needed_model, "active_criteria"):
+            sql_query = sql_query.where(needed_model.active_criteria())
+        return sql_query
+
+    @staticmethod
+    def _ordered_query(
+        serializer_data: dict,
+        needed_model: SQLModel,
+        order_by: list[str],
+        after: tuple[Any, ...] | None = None,
+        projection: type[BaseModel] | None = None,
+    ) -> Select:
+        for name in order_by:
+            if not hasattr(needed_model, name):
+                raise AttributeError(
+                    (
+                        f"Model {needed_model.__name__} does not have "
+                        f"attribute {name}."
+                    )
+                )
+        columns: list = [getattr(needed_model, name) for name in order_by]
+        sql_query: Select = (
+            DBInteractionsManager._active_query(needed_model)
+            if projection is None
+            else DBInteractionsManager._projected_query(
+                needed_model, projection
+            )
+        ).filter_by(**serializer_data)
+        if after is not None:
+            sql_query = sql_query.where(tuple_(*columns) > tuple_(*after))
+        return sql_query.order_by(*columns)
 
     @staticmethod
     @async_session_decorator
@@ -41,35 +386,293 @@ class DBInteractionsManager:
         serializer_data: dict, needed_model: SQLModel, session: AsyncSession
     ):
         model: SQLModel = needed_model(**serializer_data)
-        session.add(model)
         try:
-            await session.commit()
+            async with savepoint_if_request_session(session):
+                session.add(model)
+                await commit_or_flush(session)
+            await record_cache.invalidate(session, needed_model, [model])
             return "Successfully created!"
         except IntegrityError:
             return None
 
+    @staticmethod
+    @async_session_decorator
+    async def upsert_record_in_db(
+        serializer_data: dict,
+        needed_model: SQLModel,
+        conflict_fields: list[str],
+        session: AsyncSession,
+    ) -> SQLModel | None:
+        """
+        Insert a record, or update the existing one that has the same values
+        in `conflict_fields`, with a single
+        `INSERT ... ON CONFLICT ... DO UPDATE ... RETURNING` statement.
+
+        `conflict_fields` must be covered by a unique constraint. The fields
+        of `serializer_data` that are not conflict fields are overwritten on
+        the existing record.
+
+        Returns:
+            `SQLModel`: The inserted or updated record.\n
+            `None`: If the statement violated another constraint.
+        """
+        insert_query = DBInteractionsManager._insert(
+            needed_model, session
+        ).values(**serializer_data)
+        # `DO UPDATE` does not apply the `onupdate` of the columns: the row
+        # version is bumped from the existing row, and the other columns
+        # take the value the insert would have stored
+        updated_fields: list[str] = [*serializer_data] + [
+            column.name
+            for column in needed_model.__table__.columns
+            if column.onupdate is not None
+            and not column.onupdate.is_clause_element
+            and column.name not in serializer_data
+        ]
+        values_to_set: dict = {
+            name: insert_query.excluded[name]
+            for name in updated_fields
+            if name not in conflict_fields
+        }
+        if hasattr(needed_model, "row_version"):
+            values_to_set["row_version"] = needed_model.row_version + 1
+        sql_query = (
+            insert_query.on_conflict_do_update(
+                index_elements=conflict_fields, set_=values_to_set
+            )
+            .returning(needed_model)
+            .execution_options(populate_existing=True)
+        )
+        try:
+            async with savepoint_if_request_session(session):
+                db_result: Result = await session.execute(sql_query)
+                record: SQLModel = db_result.scalar_one()
+                await commit_or_flush(session)
+            await record_cache.invalidate(session, needed_model, [record])
+            return record
+        except IntegrityError:
+            return None
+
+    @staticmethod
+    def _insert(needed_model: SQLModel, session: AsyncSession):
+        """
+        Start an `INSERT` in the dialect of the session, which provides
+        `ON CONFLICT` clauses.
+        """
+        dialect_name: str = session.bind.dialect.name
+        if dialect_name == "postgresql":
+            return postgresql.insert(needed_model)
+        if dialect_name == "sqlite":
+            return sqlite.insert(needed_model)
+        raise RuntimeError(f"Upserts are not supported on {dialect_name}.")
+
     @staticmethod
     @async_session_decorator
     async def update_record_in_db(
         model_object: SQLModel, fields_to_change: dict, session: AsyncSession
     ):
-        for field, value in fields_to_change.items():
-            if not hasattr(model_object, field):
+        """
+        Update the record of `model_object` with a single
+        `UPDATE ... RETURNING` statement on its primary key, and give
+        `model_object` the values stored.
+
+        Raises:
+            AttributeError: If the model does not have one of the fields.
+        """
+        # the values before the update, whose lookups are invalidated too
+        previous: dict = model_object.model_dump()
+        needed_model: SQLModel = type(model_object)
+        records: list[SQLModel] = await DBInteractionsManager._update_where(
+            DBInteractionsManager._primary_key_filter(model_object),
+            fields_to_change,
+            needed_model,
+            session,
+            active_only=False,
+        )
+        for record in records:
+            for field, value in record.model_dump().items():
+                set_committed_value(model_object, field, value)
+        await record_cache.invalidate(session, needed_model, [previous])
+        return model_object
+
+    @staticmethod
+    @async_session_decorator
+    async def update_records_where(
+        filters: dict,
+        fields_to_change: dict,
+        needed_model: SQLModel,
+        session: AsyncSession,
+    ) -> list[SQLModel]:
+        """
+        Update the records matching `filters` with a single
+        `UPDATE ... WHERE ... RETURNING` statement, without loading them
+        first. Like lookups, it leaves out the records the `active_criteria`
+        of the model rejects.
+
+        Args:
+            filters (dict): The values the fields of the updated records\
+                must have, such as the owner, so a record that belongs to\
+                someone else is not matched.
+            fields_to_change (dict): The new values of the fields.
+            needed_model (SQLModel): The model of the records.
+
+        Returns:
+            list[SQLModel]: The updated records, with their new values.
+
+        Raises:
+            AttributeError: If the model does not have one of the fields.
+        """
+        return await DBInteractionsManager._update_where(
+            filters, fields_to_change, needed_model, session
+        )
+
+    @staticmethod
+    @async_session_decorator
+    async def delete_record_from_db(
+        model_object: SQLModel, session: AsyncSession
+    ):
+        await DBInteractionsManager._delete_where(
+            DBInteractionsManager._primary_key_filter(model_object),
+            type(model_object),
+            session,
+            active_only=False,
+        )
+
+    @staticmethod
+    @async_session_decorator
+    async def delete_records_where(
+        filters: dict, needed_model: SQLModel, session: AsyncSession
+    ) -> list[SQLModel]:
+        """
+        Delete the records matching `filters` with a single
+        `DELETE ... WHERE ... RETURNING` statement, without loading them
+        first. Like lookups, it leaves out the records the `active_criteria`
+        of the model rejects.
+
+        Args:
+            filters (dict): The values the fields of the deleted records\
+                must have, such as the owner, so a record that belongs to\
+                someone else is not matched.
+            needed_model (SQLModel): The model of the records.
+
+        Returns:
+            list[SQLModel]: The deleted records.
+
+        Raises:
+            AttributeError: If the model does not have one of the fields.
+        """
+        return await DBInteractionsManager._delete_where(
+            filters, needed_model, session
+        )
+
+    @staticmethod
+    async def _update_where(
+        filters: dict,
+        fields_to_change: dict,
+        needed_model: SQLModel,
+        session: AsyncSession,
+        active_only: bool = True,
+    ) -> list[SQLModel]:
+        DBInteractionsManager._check_fields(needed_model, fields_to_change)
+        db_result: Result = await session.execute(
+            update(needed_model)
+            .where(
+                *DBInteractionsManager._where(
+                    needed_model, filters, active_only
+                )
+            )
+            .values(**fields_to_change)
+            .returning(needed_model)
+            .execution_options(
+                populate_existing=True, synchronize_session=False
+            )
+        )
+        records: list[SQLModel] = list(db_result.scalars())
+        await commit_or_flush(session)
+        if records:
+            await record_cache.invalidate(session, needed_model, records)
+        return records
+
+    @staticmethod
+    async def _delete_where(
+        filters: dict,
+        needed_model: SQLModel,
+        session: AsyncSession,
+        active_only: bool = True,
+    ) -> list[SQLModel]:
+        db_result: Result = await session.execute(
+            delete(needed_model)
+            .where(
+                *DBInteractionsManager._where(
+                    needed_model, filters, active_only
+                )
+            )
+            .returning(needed_model)
+            .execution_options(synchronize_session=False)
+        )
+        records: list[SQLModel] = list(db_result.scalars())
+        await commit_or_flush(session)
+        if records:
+            await record_cache.invalidate(session, needed_model, records)
+        return records
+
+    @staticmethod
+    def _where(
+        needed_model: SQLModel, filters: dict, active_only: bool
+    ) -> list:
+        DBInteractionsManager._check_fields(needed_model, filters)
+        where_clauses: list = [
+            getattr(needed_model, field) == value
+            for field, value in filters.items()
+        ]
+        if active_only and hasattr(needed_model, "active_criteria"):
+            where_clauses.append(needed_model.active_criteria())
+        return where_clauses
+
+    @staticmethod
+    def _primary_key_filter(model_object: SQLModel) -> dict:
+        return {
+            column.key: getattr(model_object, column.key)
+            for column in inspect(type(model_object)).primary_key
+        }
+
+    @staticmethod
+    def _check_fields(needed_model: SQLModel, fields: dict) -> None:
+        for field in fields:
+            if field not in needed_model.model_fields:
                 raise AttributeError(
                     (
-                        f"Model {model_object.__name__} does not have "
+                        f"Model {needed_model.__name__} does not have "
                         f"attribute {field}."
                     )
                 )
-            setattr(model_object, field, value)
-            session.add(model_object)
-            await session.commit()
-            await session.refresh(model_object)
 
     @staticmethod
     @async_session_decorator
-    async def delete_record_from_db(
-        model_object: SQLModel, session: AsyncSession
-    ):
-        await session.delete(model_object)
-        await session.commit()
+    async def delete_batch_from_db(
+        needed_model: SQLModel,
+        where_clauses: list,
+        batch_size: int,
+        session: AsyncSession,
+    ) -> int:
+        """
+        Delete at most `batch_size` records matching `where_clauses` in one
+        statement. Records locked by other transactions are skipped rather
+        than waited for.
+
+        Returns:
+            int: The number of deleted records.
+        """
+        primary_key = inspect(needed_model).primary_key[0]
+        batch: Select = (
+            select(primary_key)
+            .where(*where_clauses)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        db_result: Result = await session.execute(
+            delete(needed_model).where(primary_key.in_(batch)),
+            execution_options={"synchronize_session": False},
+        )
+        await commit_or_flush(session)
+        return db_result.rowcount
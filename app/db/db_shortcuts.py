@@ -1,12 +1,17 @@
 from fastapi import HTTPException
+from pydantic import BaseModel
 from sqlmodel import SQLModel
 
 from app.db.db_interactions import DBInteractionsManager
 
 
 async def get_object_or_404(
-    model: SQLModel, relationship_names: list = [], **kwargs
-) -> SQLModel:
+    model: SQLModel,
+    relationship_names: list = [],
+    loading_profile: str | None = None,
+    projection: type[BaseModel] | None = None,
+    **kwargs,
+) -> SQLModel | BaseModel:
     """
     This function attempts to fetch a record from the database based on the
     provided model and search criteria. If the record is not found,
@@ -17,17 +22,28 @@ async def get_object_or_404(
         to query.
         relationship_names (list): A list of relationship names to be included\
         in the query.
+        loading_profile (str | None): The name of a loading profile from\
+        `LOADING_PROFILES` with the relationships to be included in the query.
+        projection (type[BaseModel] | None): A serializer whose fields are\
+        the only columns read, returned instead of the database object.
         **kwargs: Arbitrary keyword arguments used as search criteria for the\
         database query.
 
     Returns:
-        SQLModel: The retrieved database object if found.
+        SQLModel | BaseModel: The retrieved database object, or its\
+        projection, if found.
 
     Raises:
         HTTPException: A 404 error if the object is not found in the database.
     """
-    result: SQLModel | None = await DBInteractionsManager.get_record_from_db(
-        kwargs, needed_model=model, relationship_names=relationship_names
+    result: SQLModel | BaseModel | None = (
+        await DBInteractionsManager.get_record_from_db(
+            kwargs,
+            needed_model=model,
+            relationship_names=relationship_names,
+            loading_profile=loading_profile,
+            projection=projection,
+        )
     )
     if not result:
         raise HTTPException(
@@ -0,0 +1,182 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
+from logging import Logger, getLogger
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config.settings import Settings, get_settings
+from app.core.metrics import (
+    db_pool_checked_out,
+    db_pool_checkout_wait,
+    db_pool_overflow,
+    db_pool_size,
+    db_pool_timeouts,
+    db_pool_utilization,
+    db_slow_queries,
+    http_request_db_duration,
+    http_request_db_statements,
+    http_request_duration,
+    http_request_pool_wait,
+    http_requests,
+    registry,
+)
+
+settings: Settings = get_settings()
+logger: Logger = getLogger(__name__)
+# the instrumented engines by name, for the pool gauges
+engines: dict[str, AsyncEngine] = {}
+
+
+@dataclass
+class RequestStats:
+    """
+    The database work done for one request.
+    """
+
+    path: str
+    statements: int = 0
+    db_seconds: float = 0
+    pool_wait_seconds: float = 0
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.statements} '
+            f'statements", pool;dur={self.pool_wait_seconds * 1000:.1f}'
+        )
+
+
+# stats of the current request, set by `MetricsMiddleware`
+request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "request_stats", default=None
+)
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records the time spent getting a connection, waiting
+    for a free one or opening a new one, in the stats of the current request
+    and in the checkout wait of the engine it was named after, and counts
+    the waits that timed out.
+    """
+
+    def _do_get(self):
+        started: float = perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            db_pool_timeouts.inc(self.logging_name)
+            raise
+        finally:
+            elapsed: float = perf_counter() - started
+            db_pool_checkout_wait.observe(self.logging_name, value=elapsed)
+            if (stats := request_stats.get()) is not None:
+                stats.pool_wait_seconds += elapsed
+
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    """
+    Count and time the statements executed by `engine` for the current
+    request, and log those slower than the `SLOW_QUERY_SECONDS` setting.
+    """
+    engines[name] = engine
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, many):
+        context._instrumentation_started = perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, many):
+        elapsed: float = perf_counter() - context._instrumentation_started
+        stats: RequestStats | None = request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_seconds += elapsed
+        if (
+            settings.SLOW_QUERY_SECONDS is not None
+            and elapsed >= settings.SLOW_QUERY_SECONDS
+        ):
+            db_slow_queries.inc(name)
+            logger.warning(
+                "Slow query on %s took %.3f s%s: %s",
+                name,
+                elapsed,
+                f" for {stats.path}" if stats is not None else "",
+                statement,
+            )
+
+
+def collect_pool_stats() -> None:
+    for name, engine in engines.items():
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            db_pool_size.set(name, value=pool.size())
+            db_pool_checked_out.set(name, value=pool.checkedout())
+            db_pool_overflow.set(name, value=max(pool.overflow(), 0))
+            capacity: int = pool.size() + settings.DATABASE_MAX_OVERFLOW
+            # a negative max overflow lets the pool open any number
+            if settings.DATABASE_MAX_OVERFLOW >= 0 and capacity > 0:
+                db_pool_utilization.set(
+                    name, value=pool.checkedout() / capacity
+                )
+
+
+registry.add_collector(collect_pool_stats)
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, the status and the database work of every HTTP
+    request in the metrics, labelled with the route template, and reports
+    the database work done before the response in a `Server-Timing` header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(path=scope["path"])
+        status: int = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"server-timing", stats.server_timing().encode()),
+                    ],
+                }
+            await send(message)
+
+        token = request_stats.set(stats)
+        started: float = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stats.reset(token)
+            route = scope.get("route")
+            labels: tuple[str, str] = (
+                scope["method"],
+                route.path if route is not None else "unmatched",
+            )
+            http_requests.inc(*labels, str(status))
+            http_request_duration.observe(
+                *labels, value=perf_counter() - started
+            )
+            http_request_db_statements.observe(
+                *labels, value=stats.statements
+            )
+            http_request_db_duration.observe(*labels, value=stats.db_seconds)
+            http_request_pool_wait.observe(
+                *labels, value=stats.pool_wait_seconds
+            )
@@ -0,0 +1,22 @@
+# Named sets of relationships to eager-load with a query. Model
+# relationships are not loaded by default, so every query states what it
+# needs instead of paying for the whole object graph on each fetch.
+LOADING_PROFILES: dict[str, tuple[str, ...]] = {
+    # the authenticated user, without any related rows
+    "auth": (),
+    "with_code": ("referral_code",),
+    "with_referrals": ("referrals",),
+    "with_referrer": ("referrer",),
+    "with_owner": ("owner",),
+}
+
+
+def get_loading_profile(name: str) -> tuple[str, ...]:
+    if name not in LOADING_PROFILES:
+        raise ValueError(
+            (
+                f"Unknown loading profile '{name}'. Available profiles: "
+                f"{', '.join(LOADING_PROFILES)}."
+            )
+        )
+    return LOADING_PROFILES[name]
@@ -0,0 +1,3 @@
+from app.core.autoimport import make_autoimport
+
+__all__: list = make_autoimport(__path__, __name__)
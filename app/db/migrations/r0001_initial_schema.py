@@ -0,0 +1,39 @@
+"""
+Initial schema, as created by `SQLModel.metadata.create_all` before the
+migrations were introduced. Databases created that way are adopted as they
+are.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+revision: int = 1
+transactional: bool = True
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    await connection.execute(
+        text(
+            'CREATE TABLE IF NOT EXISTS "user" ('
+            "uuid UUID NOT NULL, "
+            "email VARCHAR(255) NOT NULL, "
+            "password VARCHAR(255) NOT NULL, "
+            "referrer_uuid UUID, "
+            "CONSTRAINT user_pkey PRIMARY KEY (uuid), "
+            "CONSTRAINT user_email_key UNIQUE (email), "
+            "CONSTRAINT user_referrer_uuid_fkey FOREIGN KEY (referrer_uuid) "
+            'REFERENCES "user" (uuid))'
+        )
+    )
+    await connection.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS referralcode ("
+            "code VARCHAR(255) NOT NULL, "
+            "expiration_time TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+            "uuid UUID NOT NULL, "
+            "owner_uuid UUID NOT NULL, "
+            "CONSTRAINT referralcode_pkey PRIMARY KEY (uuid), "
+            "CONSTRAINT referralcode_code_key UNIQUE (code), "
+            "CONSTRAINT referralcode_owner_uuid_fkey FOREIGN KEY (owner_uuid) "
+            'REFERENCES "user" (uuid))'
+        )
+    )
@@ -0,0 +1,26 @@
+"""
+Adds the signup time used to order the referrals of a user and the
+denormalized referral counter. Both columns get a constant default, so
+adding them does not rewrite the table; existing users are stamped with the
+time of the migration.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+revision: int = 2
+transactional: bool = True
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    await connection.execute(
+        text(
+            'ALTER TABLE "user" '
+            "ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITHOUT TIME ZONE "
+            "NOT NULL DEFAULT (now() AT TIME ZONE 'utc'), "
+            "ADD COLUMN IF NOT EXISTS referral_count INTEGER NOT NULL "
+            "DEFAULT 0"
+        )
+    )
+    await connection.execute(
+        text('ALTER TABLE "user" ALTER COLUMN created_at DROP DEFAULT')
+    )
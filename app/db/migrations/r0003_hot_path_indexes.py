@@ -0,0 +1,65 @@
+"""
+Indexes the foreign keys and sort keys of the hot queries: the referrals of
+a user, the referral code of an owner (unique, as there is at most one per
+user), the expired codes and the leaderboard. They are built `CONCURRENTLY`
+so that a live table keeps accepting writes.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.migrator import create_index_concurrently
+
+revision: int = 3
+transactional: bool = False
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    await create_index_concurrently(
+        connection,
+        "ix_user_referrer_uuid_created_at_uuid",
+        '"user"',
+        "referrer_uuid, created_at, uuid",
+    )
+    await create_index_concurrently(
+        connection,
+        "ix_user_referral_count_uuid",
+        '"user"',
+        "referral_count, uuid",
+    )
+    await create_index_concurrently(
+        connection,
+        "ix_referralcode_expiration_time",
+        "referralcode",
+        "expiration_time",
+    )
+    # concurrent creations could leave several codes for one owner, only
+    # the one that expires last is kept
+    await connection.execute(
+        text(
+            "DELETE FROM referralcode AS duplicate USING referralcode AS kept "
+            "WHERE duplicate.owner_uuid = kept.owner_uuid "
+            "AND (duplicate.expiration_time, duplicate.uuid) "
+            "< (kept.expiration_time, kept.uuid)"
+        )
+    )
+    await create_index_concurrently(
+        connection,
+        "referralcode_owner_uuid_key",
+        "referralcode",
+        "owner_uuid",
+        unique=True,
+    )
+    constraint_exists: bool = await connection.scalar(
+        text(
+            "SELECT EXISTS (SELECT FROM pg_constraint "
+            "WHERE conname = 'referralcode_owner_uuid_key')"
+        )
+    )
+    if not constraint_exists:
+        await connection.execute(
+            text(
+                "ALTER TABLE referralcode "
+                "ADD CONSTRAINT referralcode_owner_uuid_key "
+                "UNIQUE USING INDEX referralcode_owner_uuid_key"
+            )
+        )
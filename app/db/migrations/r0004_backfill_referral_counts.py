@@ -0,0 +1,37 @@
+"""
+Computes the referral counter of the users that existed before it was
+maintained. Users are updated in small batches, each in its own
+transaction, so that no long lock is held on the table.
+"""
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+revision: int = 4
+transactional: bool = False
+
+BATCH_SIZE: int = 1000
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    after: UUID | None = None
+    while True:
+        updated: list[UUID] = list(
+            await connection.scalars(
+                text(
+                    'UPDATE "user" SET referral_count = ('
+                    'SELECT count(*) FROM "user" AS referral '
+                    'WHERE referral.referrer_uuid = "user".uuid) '
+                    'WHERE uuid IN (SELECT uuid FROM "user" '
+                    "WHERE CAST(:after AS UUID) IS NULL "
+                    "OR uuid > CAST(:after AS UUID) "
+                    "ORDER BY uuid LIMIT :batch_size) "
+                    "RETURNING uuid"
+                ),
+                {"after": after, "batch_size": BATCH_SIZE},
+            )
+        )
+        if not updated:
+            return
+        after = max(updated)
@@ -0,0 +1,31 @@
+"""
+Adds the time of the last change of users and referral codes, on which the
+incremental export selects, and indexes it. Existing rows are stamped with
+the time of the migration, without rewriting the tables. The column keeps
+its default for the rows written with raw SQL, such as by the bulk import;
+the application sets it on every insert and update.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.migrator import create_index_concurrently
+
+revision: int = 5
+transactional: bool = False
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    for table in ('"user"', "referralcode"):
+        await connection.execute(
+            text(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at "
+                "TIMESTAMP WITHOUT TIME ZONE NOT NULL "
+                "DEFAULT (now() AT TIME ZONE 'utc')"
+            )
+        )
+    await create_index_concurrently(
+        connection, "ix_user_updated_at", '"user"', "updated_at"
+    )
+    await create_index_concurrently(
+        connection, "ix_referralcode_updated_at", "referralcode", "updated_at"
+    )
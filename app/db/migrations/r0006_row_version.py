@@ -0,0 +1,21 @@
+"""
+Adds the version of users and referral codes, which every update bumps and
+the ETags of the read endpoints are made from. The column gets a constant
+default, so adding it does not rewrite the tables; it keeps the default for
+the rows inserted with raw SQL.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+revision: int = 6
+transactional: bool = True
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    for table in ('"user"', "referralcode"):
+        await connection.execute(
+            text(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_version "
+                "INTEGER NOT NULL DEFAULT 1"
+            )
+        )
@@ -0,0 +1,41 @@
+"""
+Stores the times of users and referral codes as `timestamp with time zone`,
+so they are read as aware UTC datetimes. The stored values are UTC already:
+with the session time zone set to UTC the conversion keeps them as they are,
+and PostgreSQL changes the column types without rewriting the tables or
+rebuilding their indexes. The defaults for the rows written with raw SQL
+become the current time itself.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+revision: int = 7
+transactional: bool = True
+COLUMNS: dict[str, tuple[str, ...]] = {
+    '"user"': ("created_at", "updated_at"),
+    "referralcode": ("expiration_time", "updated_at"),
+}
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    await connection.execute(text("SET LOCAL TIME ZONE 'UTC'"))
+    for table, columns in COLUMNS.items():
+        await connection.execute(
+            text(
+                f"ALTER TABLE {table} "
+                + ", ".join(
+                    f"ALTER COLUMN {column} TYPE TIMESTAMP WITH TIME ZONE"
+                    for column in columns
+                )
+            )
+        )
+    await connection.execute(
+        text('ALTER TABLE "user" ALTER COLUMN created_at SET DEFAULT now()')
+    )
+    for table in COLUMNS:
+        await connection.execute(
+            text(
+                f"ALTER TABLE {table} ALTER COLUMN updated_at "
+                "SET DEFAULT now()"
+            )
+        )
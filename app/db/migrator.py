@@ -0,0 +1,220 @@
+from importlib import import_module
+from types import ModuleType
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlmodel import SQLModel
+
+REVISION_TABLE: str = "schema_revision"
+# key of the advisory lock held while migrating, so that migrators started
+# at the same time apply every revision once
+MIGRATION_LOCK_KEY: int = 4_611_686_018_427_387_911
+MIGRATIONS_PACKAGE: str = "app.db.migrations"
+
+
+class SchemaRevisionError(RuntimeError):
+    """
+    Raised when the database schema is older than the revision the
+    application was written for.
+    """
+
+
+def get_revisions() -> list[ModuleType]:
+    """
+    Load the revisions of the migrations package, in the order they are
+    applied.
+
+    Every revision module defines its `revision` number, whether it runs in
+    a `transactional` block, and an asynchronous `upgrade(connection)`
+    function. Revisions that are not `transactional` run on an autocommit
+    connection, which `CREATE INDEX CONCURRENTLY` requires, and must be
+    safe to run again after a failure.
+
+    Returns:
+        list[ModuleType]: The revision modules, sorted by revision number.
+
+    Raises:
+        RuntimeError: If the revision numbers are not consecutive from 1.
+    """
+    package: ModuleType = import_module(MIGRATIONS_PACKAGE)
+    revisions: list[ModuleType] = sorted(
+        (
+            import_module(f"{MIGRATIONS_PACKAGE}.{name}")
+            for name in package.__all__
+        ),
+        key=lambda module: module.revision,
+    )
+    for expected, module in enumerate(revisions, start=1):
+        if module.revision != expected:
+            raise RuntimeError(
+                f"Migration {module.__name__} has revision "
+                f"{module.revision}, expected {expected}."
+            )
+    return revisions
+
+
+def get_head_revision() -> int:
+    """
+    Return the revision the application was written for, the last one.
+    """
+    return len(get_revisions())
+
+
+async def get_current_revision(connection: AsyncConnection) -> int:
+    """
+    Return the last revision applied to the database, 0 when none was.
+    """
+    if not await connection.run_sync(
+        lambda sync_connection: inspect(sync_connection).has_table(
+            REVISION_TABLE
+        )
+    ):
+        return 0
+    current: int | None = await connection.scalar(
+        text(f"SELECT max(revision) FROM {REVISION_TABLE}")
+    )
+    return current or 0
+
+
+async def create_index_concurrently(
+    connection: AsyncConnection,
+    name: str,
+    table: str,
+    columns: str,
+    unique: bool = False,
+) -> None:
+    """
+    Create an index without locking the table against writes.
+
+    A concurrent build that failed leaves an invalid index behind, which
+    `IF NOT EXISTS` would keep, so such an index is dropped and built
+    again.
+
+    Args:
+        connection (AsyncConnection): An autocommit connection.
+        name (str): The name of the index.
+        table (str): The quoted name of the table.
+        columns (str): The indexed columns, separated by commas.
+        unique (bool): Whether the index is unique.
+    """
+    invalid: bool | None = await connection.scalar(
+        text(
+            "SELECT NOT indisvalid FROM pg_index "
+            "WHERE indexrelid = to_regclass(:name)"
+        ),
+        {"name": name},
+    )
+    if invalid:
+        await connection.execute(
+            text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        )
+    await connection.execute(
+        text(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY "
+            f"IF NOT EXISTS {name} ON {table} ({columns})"
+        )
+    )
+
+
+async def upgrade(engine: AsyncEngine) -> list[int]:
+    """
+    Apply the revisions the database is missing, up to the head revision.
+
+    An advisory lock serializes migrators, so it is safe to start the
+    migration from several places at once. Each revision is recorded as
+    soon as it is applied; an interrupted migration resumes from the first
+    revision that was not.
+
+    The revisions are written for PostgreSQL. Other databases, such as the
+    SQLite database of local runs and benchmarks, get the tables of the
+    models and are stamped with the head revision.
+
+    Args:
+        engine (AsyncEngine): The engine of the migrated database.
+
+    Returns:
+        list[int]: The revisions applied by this call.
+    """
+    if engine.dialect.name != "postgresql":
+        return await _create_from_models(engine)
+    applied: list[int] = []
+    async with engine.connect() as lock_connection:
+        lock_connection = await lock_connection.execution_options(
+            isolation_level="AUTOCOMMIT"
+        )
+        await lock_connection.execute(
+            text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}
+        )
+        try:
+            await lock_connection.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {REVISION_TABLE} ("
+                    "revision INTEGER PRIMARY KEY, "
+                    "applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL "
+                    "DEFAULT (now() AT TIME ZONE 'utc'))"
+                )
+            )
+            current: int = await get_current_revision(lock_connection)
+            for module in get_revisions()[current:]:
+                if module.transactional:
+                    async with engine.begin() as connection:
+                        await module.upgrade(connection)
+                        await _record_revision(connection, module.revision)
+                else:
+                    async with engine.connect() as connection:
+                        connection = await connection.execution_options(
+                            isolation_level="AUTOCOMMIT"
+                        )
+                        await module.upgrade(connection)
+                        await _record_revision(connection, module.revision)
+                applied.append(module.revision)
+        finally:
+            await lock_connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"),
+                {"key": MIGRATION_LOCK_KEY},
+            )
+    return applied
+
+
+async def verify_schema_revision(engine: AsyncEngine) -> None:
+    """
+    Check that the migrations were applied before the application starts.
+
+    A database at a newer revision is accepted, so that instances of the
+    previous release keep running while a deployment rolls out.
+
+    Raises:
+        SchemaRevisionError: If the database is behind the head revision.
+    """
+    async with engine.connect() as connection:
+        current: int = await get_current_revision(connection)
+    head: int = get_head_revision()
+    if current < head:
+        raise SchemaRevisionError(
+            f"The database schema is at revision {current}, the application "
+            f"expects revision {head}. Run `python -m app migrate` first."
+        )
+
+
+async def _create_from_models(engine: AsyncEngine) -> list[int]:
+    async with engine.begin() as connection:
+        await connection.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {REVISION_TABLE} ("
+                "revision INTEGER PRIMARY KEY, "
+                "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+            )
+        )
+        current: int = await get_current_revision(connection)
+        await connection.run_sync(SQLModel.metadata.create_all)
+        applied: list[int] = list(range(current + 1, get_head_revision() + 1))
+        for revision in applied:
+            await _record_revision(connection, revision)
+    return applied
+
+
+async def _record_revision(connection: AsyncConnection, revision: int) -> None:
+    await connection.execute(
+        text(f"INSERT INTO {REVISION_TABLE} (revision) VALUES (:revision)"),
+        {"revision": revision},
+    )
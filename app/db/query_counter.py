@@ -0,0 +1,64 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements executed by every engine while it is active.
+
+    Usage:
+    ------
+    ```
+    with QueryCounter() as counter:
+        await client.get("/referral_codes/?email=user@example.com")
+    print(counter.count, counter.statements)
+    ```
+    """
+
+    def __init__(self):
+        self.statements: list[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, many):
+        self.statements.append(statement)
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        event.remove(Engine, "before_cursor_execute", self._on_execute)
+
+
+@contextmanager
+def assert_num_queries(expected: int) -> Iterator[QueryCounter]:
+    """
+    Assert that exactly `expected` SQL statements are executed in the block.
+
+    Usage:
+    ------
+    ```
+    with assert_num_queries(2):
+        await client.get("/referral_codes/?email=user@example.com")
+    ```
+
+    Raises:
+        AssertionError: If a different number of statements was executed.\
+            The message lists every executed statement.
+    """
+    with QueryCounter() as counter:
+        yield counter
+    if counter.count != expected:
+        raise AssertionError(
+            f"Expected {expected} queries, {counter.count} were executed:\n"
+            + "\n".join(
+                f"{number}. {statement}"
+                for number, statement in enumerate(counter.statements, 1)
+            )
+        )
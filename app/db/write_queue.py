@@ -0,0 +1,316 @@
+from asyncio import (
+    CancelledError,
+    Event,
+    Lock,
+    Task,
+    TimeoutError,
+    create_task,
+    wait_for,
+)
+from fcntl import LOCK_EX, LOCK_NB, flock
+from json import dumps, loads
+from logging import Logger, getLogger
+from os import fsync, getpid
+from pathlib import Path
+from time import perf_counter, time_ns
+from typing import IO, Awaitable, Callable
+
+from app.config.settings import Settings, get_settings
+from app.core.metrics import (
+    registry,
+    write_queue_coalesced,
+    write_queue_depth,
+    write_queue_failed,
+    write_queue_flush_duration,
+    write_queue_written,
+)
+from app.db.db import is_disconnect
+
+settings: Settings = get_settings()
+logger: Logger = getLogger(__name__)
+
+# writes one handler applies in a batch, as the parameters they were
+# submitted with
+WriteHandler = Callable[[list[dict]], Awaitable[None]]
+
+
+class JournalSegment:
+    """
+    A journal file, locked for as long as its writes are not committed so
+    that no other worker recovers them.
+    """
+
+    def __init__(self, path: Path):
+        self.path: Path = path
+        self.file: IO[str] = open(path, "a+")
+
+    def try_lock(self) -> bool:
+        try:
+            flock(self.file, LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def read(self) -> list[dict]:
+        self.file.seek(0)
+        entries: list[dict] = []
+        for line in self.file:
+            try:
+                entries.append(loads(line))
+            except ValueError:
+                # the last line of a worker that died while writing it
+                logger.warning("Skipped a torn entry of %s.", self.path)
+        return entries
+
+    def append(self, entry: dict, sync: bool) -> None:
+        self.file.write(dumps(entry) + "\n")
+        self.file.flush()
+        if sync:
+            fsync(self.file.fileno())
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.file.close()
+
+
+class WriteBehindQueue:
+    """
+    Queue of the writes that do not have to be done before the response,
+    applied in batches by a background task.
+
+    Every write is submitted under a registered handler name and a key,
+    such as the user whose referrer is set. A write replaces the pending
+    one of the same handler and key, so only the last of repeated updates
+    to a row is applied. The pending writes are applied once there are
+    `max_batch` of them or `flush_interval_seconds` after the previous
+    flush, each handler getting all its writes at once.
+
+    Writes are appended to a journal file in `directory` before they are
+    queued, and the file is deleted once they are committed. Journals left
+    by a worker that died are taken over and applied by the next worker
+    that starts. Handlers must therefore be idempotent. A failed batch is
+    retried write by write; writes failing because the database cannot be
+    reached stay queued, other failing writes are logged and dropped.
+
+    When the queue is disabled, every write is applied as soon as it is
+    submitted.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        directory: str,
+        max_batch: int,
+        flush_interval_seconds: float,
+        sync_journal: bool,
+    ):
+        self.enabled: bool = enabled
+        self.directory = Path(directory)
+        self.max_batch: int = max_batch
+        self.flush_interval_seconds: float = flush_interval_seconds
+        self.sync_journal: bool = sync_journal
+        self.handlers: dict[str, WriteHandler] = {}
+        self.pending: dict[tuple[str, str], dict] = {}
+        # the writes of the flush in progress, until they are committed
+        self._applying: dict[tuple[str, str], dict] = {}
+        # the journal new writes are appended to, and the journals of the
+        # pending writes that no longer take new ones
+        self._segment: JournalSegment | None = None
+        self._sealed: list[JournalSegment] = []
+        self._flush_lock = Lock()
+        self._batch_ready = Event()
+        self._task: Task | None = None
+
+    def register(self, name: str, handler: WriteHandler) -> None:
+        self.handlers[name] = handler
+
+    async def submit(self, name: str, key: str, params: dict) -> None:
+        """
+        Queue the write of handler `name` to the row identified by `key`.
+
+        Args:
+            name (str): The name the handler was registered with.
+            key (str): Identifies the written row among the writes of the\
+                handler; a pending write with the same key is replaced.
+            params (dict): The JSON-serializable parameters of the write.
+        """
+        if not self.enabled:
+            await self.handlers[name]([params])
+            return
+        if self._segment is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._segment = JournalSegment(
+                self.directory / f"{time_ns()}-{getpid()}.jsonl"
+            )
+            self._segment.try_lock()
+        self._segment.append(
+            {"name": name, "key": key, "params": params}, self.sync_journal
+        )
+        if (name, key) in self.pending:
+            write_queue_coalesced.inc(name)
+        self.pending[(name, key)] = params
+        if len(self.pending) >= self.max_batch:
+            self._batch_ready.set()
+
+    def get_pending(self, name: str, key: str) -> dict | None:
+        """
+        Return the parameters of the write of handler `name` to the row
+        `key` that this worker queued and did not commit yet, `None` if
+        there is none.
+
+        Reads use it to see the writes of their own worker before they are
+        applied; the writes queued by other workers are not seen until they
+        are applied.
+        """
+        return self.pending.get((name, key)) or self._applying.get(
+            (name, key)
+        )
+
+    async def flush(self) -> int:
+        """
+        Apply the pending writes, in one transaction per handler.
+
+        Returns:
+            int: The number of writes applied or dropped.
+        """
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            started: float = perf_counter()
+            batch: dict[tuple[str, str], dict] = self.pending
+            self.pending = {}
+            if self._segment is not None:
+                self._sealed.append(self._segment)
+                self._segment = None
+            segments: list[JournalSegment] = list(self._sealed)
+
+            requeued: dict[tuple[str, str], dict] = {}
+            self._applying = batch
+            try:
+                for name in {name for name, _ in batch}:
+                    writes: dict[tuple[str, str], dict] = {
+                        write_key: params
+                        for write_key, params in batch.items()
+                        if write_key[0] == name
+                    }
+                    requeued.update(await self._apply(name, writes))
+            except CancelledError:
+                # keep the journals, the writes are applied again later
+                self.pending = {**batch, **self.pending}
+                raise
+            finally:
+                self._applying = {}
+
+            if requeued:
+                # the writes submitted during the flush are newer
+                self.pending = {**requeued, **self.pending}
+            else:
+                for segment in segments:
+                    segment.remove()
+                    self._sealed.remove(segment)
+            write_queue_flush_duration.observe(
+                value=perf_counter() - started
+            )
+            return len(batch) - len(requeued)
+
+    async def _apply(
+        self, name: str, writes: dict[tuple[str, str], dict]
+    ) -> dict[tuple[str, str], dict]:
+        # returns the writes to try again
+        handler: WriteHandler = self.handlers[name]
+        try:
+            await handler(list(writes.values()))
+            write_queue_written.inc(name, amount=len(writes))
+            return {}
+        except Exception as error:
+            if is_disconnect(error):
+                logger.warning("Database unreachable, writes kept queued.")
+                return writes
+            logger.warning(
+                "Batch of %d %s writes failed, applying them one by one.",
+                len(writes),
+                name,
+            )
+        requeued: dict[tuple[str, str], dict] = {}
+        for write_key, params in writes.items():
+            try:
+                await handler([params])
+                write_queue_written.inc(name)
+            except Exception as error:
+                if is_disconnect(error):
+                    requeued[write_key] = params
+                    continue
+                write_queue_failed.inc(name)
+                logger.exception(
+                    "Dropped the %s write of %s.", name, write_key[1]
+                )
+        return requeued
+
+    def start(self) -> None:
+        """
+        Take over the journals of workers that died and start flushing.
+        """
+        if not self.enabled or self._task is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in sorted(self.directory.glob("*.jsonl")):
+            segment = JournalSegment(path)
+            if not segment.try_lock():
+                # a journal of a running worker
+                segment.file.close()
+                continue
+            for entry in segment.read():
+                self.pending[(entry["name"], entry["key"])] = entry["params"]
+            self._sealed.append(segment)
+        if self.pending:
+            logger.info(
+                "Recovered %d queued writes from journals.", len(self.pending)
+            )
+            self._batch_ready.set()
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop flushing after applying the pending writes. Writes that could
+        not be applied stay in the journal.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Flushing the write queue on shutdown failed.")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await wait_for(
+                    self._batch_ready.wait(), self.flush_interval_seconds
+                )
+            except TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush()
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception("Flushing the write queue failed.")
+
+
+write_queue = WriteBehindQueue(
+    settings.WRITE_QUEUE_ENABLED,
+    settings.WRITE_QUEUE_DIR,
+    settings.WRITE_QUEUE_MAX_BATCH,
+    settings.WRITE_QUEUE_FLUSH_INTERVAL_SECONDS,
+    settings.WRITE_QUEUE_FSYNC,
+)
+registry.add_collector(
+    lambda: write_queue_depth.set(value=len(write_queue.pending))
+)
@@ -0,0 +1,45 @@
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+from app.config.settings import Settings, get_settings
+from app.core.metrics import registry
+from app.core.security import PasswordHasher
+from app.core.sweeper import expired_codes_sweeper
+from app.db.db import db_lifespan
+from app.db.migrator import verify_schema_revision
+from app.db.write_queue import write_queue
+
+settings: Settings = get_settings()
+
+
+@asynccontextmanager
+async def app_lifespan(app: FastAPI):
+    """
+    Manages the lifespan of the FastAPI application by setting up and tearing
+    down the database connection and the background jobs.
+
+    This function opens the database connection, checks that the database
+    schema was migrated to the revision the application expects, unless the
+    server checked it before forking the workers, starts the write queue,
+    the expired referral codes sweeper and the sharing of the metrics, and
+    ensures the queued writes are applied, the metrics shared with the
+    other workers and the engine and the password hashing pool disposed of
+    when the application shuts down.
+    """
+    async with db_lifespan() as engine:
+        # already checked by `python -m app serve` before forking workers
+        if not getattr(app.state, "schema_verified", False):
+            await verify_schema_revision(engine)
+        write_queue.start()
+        if settings.EXPIRED_CODES_SWEEPER_ENABLED:
+            expired_codes_sweeper.start()
+        if settings.METRICS_ENABLED:
+            registry.start()
+        try:
+            yield
+        finally:
+            await expired_codes_sweeper.stop()
+            await write_queue.stop()
+            await registry.stop()
+    PasswordHasher.shutdown_executor()
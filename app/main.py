@@ -1,7 +1,11 @@
 from fastapi import FastAPI
 
 from app.config.settings import Settings, get_settings
-from app.db.db import app_lifespan
+from app.core.profiling import ProfilingMiddleware
+from app.core.responses import FastJSONResponse
+from app.db.db import RequestSessionMiddleware
+from app.db.instrumentation import MetricsMiddleware
+from app.lifespan import app_lifespan
 from app.routes import ALL_ROUTERS
 from app.views import *     # noqa: F401, F403
 
@@ -14,7 +18,16 @@ app = FastAPI(
     version=settings.version,
     contact=settings.contact,
     lifespan=app_lifespan,
+    default_response_class=FastJSONResponse,
 )
 
 for router in ALL_ROUTERS:
     app.include_router(router)
+
+if settings.REQUEST_SCOPED_SESSION:
+    app.add_middleware(RequestSessionMiddleware)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+# outermost, so the commit of the request session is measured too
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
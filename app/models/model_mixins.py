@@ -1,7 +1,73 @@
+from datetime import datetime, timezone
 from uuid import UUID, uuid4
 
+from sqlalchemy import DateTime, literal_column
+from sqlalchemy.types import TypeDecorator
 from sqlmodel import Field, SQLModel
 
+from app.config.settings import Settings, get_settings
+
+settings: Settings = get_settings()
+# a relationship that was not loaded is never silently empty: reading it
+# fails if it needs a query, or always in debug mode
+RELATIONSHIP_LAZY: str = (
+    "raise" if settings.RAISE_ON_UNLOADED_RELATIONSHIPS else "raise_on_sql"
+)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class UTCDateTime(TypeDecorator):
+    """
+    A `timestamp with time zone` column holding UTC times, read as aware
+    UTC datetimes on every database, SQLite included, which drops the
+    offset. Naive values written to it are taken to be UTC.
+    """
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value: datetime | None, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
+    def process_result_value(self, value: datetime | None, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
 
 class UUIDMixin(SQLModel):
     uuid: UUID = Field(default_factory=uuid4, primary_key=True)
+
+
+class UpdatedAtMixin(SQLModel):
+    # time of the last change, which incremental exports select on; set by
+    # every ORM and Core insert and update of the model, and by the default
+    # of the column for rows written with raw SQL
+    updated_at: datetime = Field(
+        default_factory=utc_now,
+        nullable=False,
+        sa_type=UTCDateTime,
+        sa_column_kwargs={"default": utc_now, "onupdate": utc_now},
+    )
+
+
+class RowVersionMixin(SQLModel):
+    # version of the row, bumped by every update of the model, from which
+    # the ETags of the responses built from the row are made
+    row_version: int = Field(
+        default=1,
+        nullable=False,
+        sa_column_kwargs={
+            "default": 1,
+            "onupdate": literal_column("row_version") + 1,
+        },
+    )
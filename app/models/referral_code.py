@@ -1,15 +1,57 @@
+from datetime import datetime
 from uuid import UUID
 
+from sqlalchemy import ColumnElement, Index, bindparam
 from sqlmodel import Field, Relationship
 
-from app.models.model_mixins import UUIDMixin
+from app.models.model_mixins import (
+    RELATIONSHIP_LAZY,
+    RowVersionMixin,
+    UpdatedAtMixin,
+    UTCDateTime,
+    UUIDMixin,
+    utc_now,
+)
 from app.models.user import User
 from app.serializers.referral_code import ReferralCodeSerializer
 
 
-class ReferralCode(UUIDMixin, ReferralCodeSerializer, table=True):
-    owner_uuid: UUID = Field(foreign_key="user.uuid")
+class ReferralCode(
+    UUIDMixin,
+    RowVersionMixin,
+    UpdatedAtMixin,
+    ReferralCodeSerializer,
+    table=True,
+):
+    __table_args__ = (
+        # serves the expiry check of lookups and the expired codes sweeper
+        Index("ix_referralcode_expiration_time", "expiration_time"),
+        # serves the incremental export
+        Index("ix_referralcode_updated_at", "updated_at"),
+    )
+
+    expiration_time: datetime = Field(sa_type=UTCDateTime)
+    # one code per user, referral codes are rotated with an upsert on it
+    owner_uuid: UUID = Field(foreign_key="user.uuid", unique=True)
     owner: User = Relationship(
         back_populates="referral_code",
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": RELATIONSHIP_LAZY},
     )
+
+    @classmethod
+    def active_criteria(cls) -> ColumnElement[bool]:
+        """
+        Condition added to every lookup of referral codes so expired codes
+        are never returned. The current time is bound when the statement is
+        executed.
+        """
+        return cls.expiration_time > bindparam(
+            "active_at", callable_=utc_now
+        )
+
+    def active_until(self) -> datetime:
+        """
+        End of the validity of the code, past which it must not be served
+        from the cache either.
+        """
+        return self.expiration_time
@@ -1,8 +1,17 @@
+from datetime import datetime
 from typing import TYPE_CHECKING
 from uuid import UUID
 
+from sqlalchemy import Index
 from sqlmodel import Field, Relationship
 
+from app.models.model_mixins import (
+    RELATIONSHIP_LAZY,
+    RowVersionMixin,
+    UpdatedAtMixin,
+    UTCDateTime,
+    utc_now,
+)
 from app.serializers.user import UserInSerializer
 
 if TYPE_CHECKING:
@@ -10,11 +19,34 @@ if TYPE_CHECKING:
     from app.models.user import User    # noqa: F811
 
 
-class User(UserInSerializer, table=True):               # noqa: F811
+class User(                                              # noqa: F811
+    RowVersionMixin, UpdatedAtMixin, UserInSerializer, table=True
+):
+    __table_args__ = (
+        # serves the referrals lookup and its keyset pagination
+        Index(
+            "ix_user_referrer_uuid_created_at_uuid",
+            "referrer_uuid",
+            "created_at",
+            "uuid",
+        ),
+        # serves the top referrers leaderboard
+        Index("ix_user_referral_count_uuid", "referral_count", "uuid"),
+        # serves the incremental export
+        Index("ix_user_updated_at", "updated_at"),
+    )
+
+    created_at: datetime = Field(
+        default_factory=utc_now, nullable=False, sa_type=UTCDateTime
+    )
+    # number of users whose referrer is this user, kept in step with
+    # `referrer_uuid` by `assign_referrer`
+    referral_count: int = Field(default=0, nullable=False)
+
     referral_code: "ReferralCode" = Relationship(
         back_populates="owner",
         cascade_delete=True,
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": RELATIONSHIP_LAZY},
     )
 
     # begin recursive relationship:
@@ -27,11 +59,12 @@ class User(UserInSerializer, table=True):               # noqa: F811
         back_populates="referrals",
         sa_relationship_kwargs={
             "remote_side": "User.uuid",
-            "lazy": "selectin",
+            "lazy": RELATIONSHIP_LAZY,
         },
     )
 
     # our lookup field
     referrals: list["User"] = Relationship(
-        back_populates="referrer", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="referrer",
+        sa_relationship_kwargs={"lazy": RELATIONSHIP_LAZY},
     )
@@ -1,15 +1,33 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+
+from app.core.responses import TrustedResponseRoute
+from app.core.security import verify_admin_token
 
 user_router = APIRouter(
+    route_class=TrustedResponseRoute,
     prefix="/users",
     tags=["Users"],
 )
 
 referral_code_router = APIRouter(
+    route_class=TrustedResponseRoute,
     prefix="/referral_codes",
     tags=["Referral_codes"],
 )
 
+admin_router = APIRouter(
+    route_class=TrustedResponseRoute,
+    prefix="/admin",
+    tags=["Admin"],
+    dependencies=[Depends(verify_admin_token)],
+    responses={403: {"description": "Invalid or missing admin token."}},
+)
+
+metrics_router = APIRouter(
+    route_class=TrustedResponseRoute,
+    tags=["Metrics"],
+)
+
 ALL_ROUTERS: list[APIRouter] = [
     value for _, value in locals().items() if isinstance(value, APIRouter)
 ]
@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+
+
+class RejectedRowSerializer(BaseModel):
+    line: int
+    email: str | None = None
+    reason: str
+
+
+class UserImportReportSerializer(BaseModel):
+    total_rows: int = 0
+    imported: int = 0
+    rejected: int = 0
+    # imported without a referrer because the referrer email is unknown
+    unresolved_referrers: int = 0
+    seconds: float = 0
+    rows_per_second: float = 0
+    # capped at `BULK_IMPORT_MAX_REPORTED_ROWS` entries
+    rejected_rows: list[RejectedRowSerializer] = []
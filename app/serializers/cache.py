@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+
+class CacheModelStatsSerializer(BaseModel):
+    hits: int
+    misses: int
+    invalidations: int
+
+
+class CacheStatsSerializer(BaseModel):
+    backend: str
+    models: dict[str, CacheModelStatsSerializer]
@@ -1,5 +1,12 @@
+from uuid import UUID
+
 from pydantic import BaseModel
 
 
 class DefaultMessageSerializer(BaseModel):
     message: str
+
+
+class RowVersionSerializer(BaseModel):
+    uuid: UUID
+    row_version: int
@@ -0,0 +1,22 @@
+from datetime import datetime
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class UserExportSerializer(BaseModel):
+    # the password hash is not exported
+    uuid: UUID
+    email: str
+    created_at: datetime
+    updated_at: datetime
+    referral_count: int
+    referrer_uuid: UUID | None
+
+
+class ReferralCodeExportSerializer(BaseModel):
+    uuid: UUID
+    code: str
+    owner_uuid: UUID
+    expiration_time: datetime
+    updated_at: datetime
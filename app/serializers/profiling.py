@@ -0,0 +1,14 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+
+class ProfileSerializer(BaseModel):
+    id: str
+    method: str
+    path: str
+    route: str | None
+    status: int
+    duration_seconds: float
+    samples: int
+    created_at: datetime
@@ -1,8 +1,21 @@
 from datetime import datetime
+from uuid import UUID
 
+from pydantic import BaseModel
 from sqlmodel import Field, SQLModel
 
 
 class ReferralCodeSerializer(SQLModel):
     code: str = Field(max_length=255, unique=True)
     expiration_time: datetime = Field()
+
+
+class ReferralCodeVersionSerializer(ReferralCodeSerializer):
+    # the version stamp of the ETag along with the served fields
+    uuid: UUID
+    row_version: int
+
+
+class ReferralCodesBatchSerializer(BaseModel):
+    # null for the emails without an active referral code
+    referral_codes: dict[str, ReferralCodeSerializer | None]
@@ -0,0 +1,14 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+
+class SweeperStatsSerializer(BaseModel):
+    # whether this worker is the one sweeping
+    holds_lock: bool = False
+    runs: int = 0
+    failed_runs: int = 0
+    total_removed: int = 0
+    last_run_removed: int = 0
+    last_run_seconds: float = 0
+    last_run_at: datetime | None = None
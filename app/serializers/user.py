@@ -1,3 +1,6 @@
+from datetime import datetime
+from uuid import UUID
+
 from pydantic import BaseModel, EmailStr
 from sqlmodel import Field, SQLModel
 
@@ -17,5 +20,29 @@ class UserOutSerializerWithToken(SQLModel):
     access_token: str = Field()
 
 
+class ReferralSerializer(UserSerializer):
+    # read for the cursor of the next page, not part of the response
+    created_at: datetime
+
+
 class ReferralsSerializer(BaseModel):
     referrals: list[UserSerializer]
+    next_cursor: str | None = None
+
+
+class ReferralTreeNodeSerializer(UserSerializer):
+    referrer_uuid: UUID
+    depth: int
+
+
+class ReferralTreeSummarySerializer(BaseModel):
+    total: int
+    levels: dict[int, int]
+
+
+class LeaderboardEntrySerializer(UserSerializer):
+    referral_count: int
+
+
+class LeaderboardSerializer(BaseModel):
+    leaders: list[LeaderboardEntrySerializer]
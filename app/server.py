@@ -0,0 +1,133 @@
+from asyncio import run
+from gc import collect, freeze
+from logging import Logger, getLogger
+from os import _exit, fork, kill, wait, waitstatus_to_exitcode
+from shutil import rmtree
+from signal import SIG_DFL, SIGINT, SIGTERM, signal
+from socket import socket
+from sys import exit
+from tempfile import mkdtemp
+
+from uvicorn import Config, Server
+from uvicorn.config import STARTUP_FAILURE
+
+from app.config.settings import Settings, get_settings
+from app.core.metrics import registry
+from app.db.db import db_lifespan
+from app.db.db_interactions import record_cache
+from app.db.migrator import verify_schema_revision
+from app.main import app
+
+settings: Settings = get_settings()
+logger: Logger = getLogger(__name__)
+
+
+class PreforkServer:
+    """
+    Serves the application from `workers` processes forked from this one.
+
+    The application is imported, its OpenAPI document generated and the
+    database schema revision checked once, before forking, so workers start
+    serving right away and share the memory of the imported modules. The
+    workers accept connections on one socket bound before forking. A worker
+    that dies is replaced, unless it failed to start, which stops the
+    server. SIGTERM stops the workers gracefully; SIGINT, which a terminal
+    sends to every process of the group, is left to them. The workers share
+    their metrics through a temporary directory, removed when the server
+    stops. Several workers refuse to start with a record cache held by each
+    of them, whose entries the writes of the others would not invalidate.
+    """
+
+    def __init__(self, host: str, port: int, workers: int):
+        self.config = Config(app, host=host, port=port, lifespan="on")
+        self.workers: int = workers
+        self.pids: set[int] = set()
+        self.stopping: bool = False
+        self.failed: bool = False
+
+    def run(self) -> None:
+        if self.workers > 1 and record_cache.process_local:
+            exit(
+                f"CACHE_BACKEND={settings.CACHE_BACKEND} is not shared by "
+                "the workers: use the network cache with a real client, "
+                "CACHE_BACKEND=none or a single worker."
+            )
+        app.openapi()
+        run(_verify_schema())
+        # the workers skip the check in their lifespan
+        app.state.schema_verified = True
+        if self.workers == 1:
+            exit(_serve(self.config))
+
+        sock: socket = self.config.bind_socket()
+        metrics_directory: str = mkdtemp(prefix="referral-api-metrics-")
+        registry.share(
+            metrics_directory, settings.METRICS_SHARE_INTERVAL_SECONDS
+        )
+        # keeps the objects allocated so far out of the collections of the
+        # workers, so their pages stay shared instead of being copied
+        collect()
+        freeze()
+        for _ in range(self.workers):
+            self._spawn(sock)
+        signal(SIGTERM, self._stop)
+        signal(SIGINT, self._stop)
+        logger.info("Serving with %d workers.", self.workers)
+
+        while self.pids:
+            pid, status = wait()
+            self.pids.discard(pid)
+            code: int = waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            if code == STARTUP_FAILURE:
+                logger.error("Worker %d failed to start, stopping.", pid)
+                self.failed = True
+                self._stop(SIGTERM, None)
+                continue
+            logger.warning(
+                "Worker %d exited with %d, replacing it.", pid, code
+            )
+            self._spawn(sock)
+        sock.close()
+        rmtree(metrics_directory, ignore_errors=True)
+        if self.failed:
+            exit(1)
+
+    def _spawn(self, sock: socket) -> None:
+        pid: int = fork()
+        if pid:
+            self.pids.add(pid)
+            return
+        signal(SIGTERM, SIG_DFL)
+        signal(SIGINT, SIG_DFL)
+        code: int = 1
+        try:
+            code = _serve(self.config, sock)
+        except SystemExit as error:
+            code = error.code if isinstance(error.code, int) else 1
+        except BaseException:
+            logger.exception("Worker crashed.")
+        # skips the exit handlers inherited from the parent process
+        _exit(code)
+
+    def _stop(self, signum: int, frame) -> None:
+        if signum == SIGTERM or self.stopping:
+            for pid in self.pids:
+                try:
+                    kill(pid, SIGTERM)
+                except ProcessLookupError:
+                    pass
+        self.stopping = True
+
+
+def _serve(config: Config, sock: socket | None = None) -> int:
+    # returns the exit code of the process serving with `config`
+    server = Server(config)
+    server.run(sockets=[sock] if sock is not None else None)
+    return 0 if server.started else STARTUP_FAILURE
+
+
+async def _verify_schema() -> None:
+    async with db_lifespan() as engine:
+        await verify_schema_revision(engine)
@@ -0,0 +1,178 @@
+from asyncio import to_thread
+from datetime import datetime
+from pathlib import Path
+from typing import Annotated
+
+from fastapi import HTTPException, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
+
+from app.config.settings import Settings, get_settings
+from app.core.bulk_import import ImportFormat, import_users
+from app.core.export import (
+    EXPORT_MEDIA_TYPES,
+    ExportFormat,
+    ExportTable,
+    export_table,
+    export_watermark,
+)
+from app.core.profiling import profile_store
+from app.core.streaming import (
+    CSV_MEDIA_TYPE,
+    GZIP_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    iter_lines,
+)
+from app.core.sweeper import expired_codes_sweeper
+from app.db.cache import get_record_cache
+from app.routes import admin_router
+from app.serializers.bulk_import import UserImportReportSerializer
+from app.serializers.cache import CacheStatsSerializer
+from app.serializers.profiling import ProfileSerializer
+from app.serializers.sweeper import SweeperStatsSerializer
+
+settings: Settings = get_settings()
+
+
+@admin_router.post(
+    "/users/import",
+    response_model=UserImportReportSerializer,
+    responses={
+        400: {"description": "Bulk import is not available."},
+    },
+    summary="Bulk Import Users",
+    description=(
+        "Import users from a CSV or JSON Lines request body. Every row has "
+        "an `email`, a plain-text `password` or a bcrypt `password_hash`, "
+        "and an optional `referrer_email`. CSV bodies start with a header "
+        "row. Invalid rows are skipped and reported."
+    ),
+)
+async def bulk_import_users(
+    request: Request,
+    file_format: Annotated[ImportFormat, Query(alias="format")] = "csv",
+):
+    try:
+        return await import_users(
+            iter_lines(request.stream()), file_format
+        )
+    except RuntimeError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@admin_router.get(
+    "/export/{table}",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {
+                NDJSON_MEDIA_TYPE: {},
+                CSV_MEDIA_TYPE: {},
+                GZIP_MEDIA_TYPE: {},
+            },
+            "headers": {
+                "X-Export-Watermark": {
+                    "description": (
+                        "The `updated_since` of the next incremental export."
+                    ),
+                },
+            },
+        },
+    },
+    summary="Export Table",
+    description=(
+        "Stream all the users or referral codes as newline-delimited JSON "
+        "or as CSV with a header row, optionally compressed with gzip. "
+        "With `updated_since`, only the rows updated at or after it are "
+        "exported; pass the `X-Export-Watermark` of the previous export to "
+        "read the changes since then. Rows may be exported again, and "
+        "deleted rows are only left out of a full export."
+    ),
+)
+async def export(
+    table: ExportTable,
+    file_format: Annotated[ExportFormat, Query(alias="format")] = "ndjson",
+    updated_since: datetime | None = None,
+    gzip: bool = False,
+):
+    # taken before any row is read
+    watermark: datetime = export_watermark()
+    filename: str = f"{table}.{file_format}"
+    media_type: str = EXPORT_MEDIA_TYPES[file_format]
+    if gzip:
+        filename, media_type = f"{filename}.gz", GZIP_MEDIA_TYPE
+    return StreamingResponse(
+        export_table(table, file_format, updated_since, compress=gzip),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Export-Watermark": watermark.isoformat(),
+        },
+    )
+
+
+@admin_router.get(
+    "/sweeper",
+    response_model=SweeperStatsSerializer,
+    summary="Expired Codes Sweeper Stats",
+    description=(
+        "Get the figures of the background job that deletes expired "
+        "referral codes, as seen by the worker answering. On PostgreSQL "
+        "one worker of all the servers sweeps, the one with `holds_lock`."
+    ),
+)
+async def get_sweeper_stats():
+    return expired_codes_sweeper.stats
+
+
+@admin_router.get(
+    "/cache",
+    response_model=CacheStatsSerializer,
+    summary="Record Cache Stats",
+    description=(
+        "Get the hits, misses and invalidations of the record cache per "
+        "model. The figures are those of the worker serving the request."
+    ),
+)
+async def get_cache_stats():
+    return CacheStatsSerializer(
+        backend=settings.CACHE_BACKEND, models=get_record_cache().stats()
+    )
+
+
+@admin_router.get(
+    "/profiles",
+    response_model=list[ProfileSerializer],
+    summary="List Request Profiles",
+    description=(
+        "List the request profiles kept on disk, the latest first. Requests "
+        "are profiled when `PROFILING_ENABLED` is set and they carry the "
+        "admin token in the `X-Profile-Token` header, or are picked by the "
+        "`PROFILING_SAMPLE_RATE`."
+    ),
+)
+async def list_profiles():
+    return await to_thread(profile_store.list)
+
+
+@admin_router.get(
+    "/profiles/{profile_id}",
+    response_class=FileResponse,
+    responses={
+        200: {"content": {"text/plain": {}}},
+        404: {"description": "Profile not found."},
+    },
+    summary="Download Request Profile",
+    description=(
+        "Download the sampled stacks of a request in the collapsed stacks "
+        "format, which `flamegraph.pl` and speedscope render as a "
+        "flamegraph. Samples ending in `(waiting)` were taken while the "
+        "request waited, e.g. on the database or on a worker thread."
+    ),
+)
+async def download_profile(profile_id: str):
+    path: Path | None = profile_store.get_stacks_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return FileResponse(
+        path, media_type="text/plain", filename=f"{profile_id}.collapsed"
+    )
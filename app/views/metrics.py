@@ -0,0 +1,31 @@
+from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.config.settings import Settings, get_settings
+from app.core.metrics import registry
+from app.routes import metrics_router
+
+settings: Settings = get_settings()
+PROMETHEUS_MEDIA_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@metrics_router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    responses={404: {"description": "Metrics are disabled."}},
+    summary="Prometheus Metrics",
+    description=(
+        "Get the metrics of the server in the Prometheus text format: "
+        "request counts and latency, SQL statements, database time and "
+        "pool waits per route, slow queries and connection pool usage. "
+        "With several workers, any of them answers for all of them, with "
+        "the figures of the others as of their last share, at most "
+        "`METRICS_SHARE_INTERVAL_SECONDS` old."
+    ),
+)
+async def get_metrics():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(
+        registry.render(), media_type=PROMETHEUS_MEDIA_TYPE
+    )
@@ -1,53 +1,156 @@
+from datetime import datetime
 from typing import Annotated
 from uuid import UUID
 
-from fastapi import BackgroundTasks, Depends, HTTPException
+from fastapi import Body, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
-from app.core.objects_getter import get_user_from_jwt
-from app.core.referral_codes import generate_new_referral_code
-from app.core.security import verify_ownership
+from app.config.settings import Settings, get_settings
+from app.core.objects_getter import get_principal_from_jwt
+from app.core.pagination import decode_cursor, encode_cursor
+from app.core.principal import UserPrincipal
+from app.core.referral_codes import (
+    generate_new_referral_code,
+    get_referral_codes_by_emails,
+    is_revoked,
+    revoke_referral_code,
+)
+from app.core.referrals import (
+    assign_referrer_by_code,
+    get_referrals_page,
+    referral_tree_ndjson,
+)
+from app.core.responses import (
+    cache_headers,
+    etag_matches,
+    make_etag,
+    not_modified_response,
+    trusted_response,
+)
+from app.core.streaming import NDJSON_MEDIA_TYPE, ndjson_chunks
 from app.db.db_interactions import DBInteractionsManager
 from app.db.db_shortcuts import get_object_or_404
+from app.models.model_mixins import utc_now
 from app.models.referral_code import ReferralCode
 from app.models.user import User
 from app.routes import referral_code_router
-from app.serializers.default import DefaultMessageSerializer
-from app.serializers.referral_code import ReferralCodeSerializer
-from app.serializers.user import ReferralsSerializer
+from app.serializers.default import (
+    DefaultMessageSerializer,
+    RowVersionSerializer,
+)
+from app.serializers.referral_code import (
+    ReferralCodesBatchSerializer,
+    ReferralCodeSerializer,
+    ReferralCodeVersionSerializer,
+)
+from app.serializers.user import (
+    ReferralSerializer,
+    ReferralsSerializer,
+    UserSerializer,
+)
+
+settings: Settings = get_settings()
+REFERRALS_ORDER: list[str] = ["created_at", "uuid"]
 
 
 @referral_code_router.post(
     "/",
-    response_model=DefaultMessageSerializer,
+    response_model=ReferralCodeSerializer,
     responses={
         404: {"description": "User not found."},
         401: {"description": "Invalid token."},
     },
     summary="Create Referral Code",
-    description="Generate a new referral code for the given user.",
+    description=(
+        "Generate a new referral code for the given user, replacing the "
+        "current one."
+    ),
 )
 async def create_referral_code(
-    user: Annotated[User, Depends(get_user_from_jwt)],
-    background_tasks: BackgroundTasks,
+    user: Annotated[UserPrincipal, Depends(get_principal_from_jwt)],
 ):
-    background_tasks.add_task(generate_new_referral_code, user)
-    return DefaultMessageSerializer(
-        message="Referral code created successfully."
+    referral_code: ReferralCode | None = await generate_new_referral_code(
+        user.uuid
     )
+    if referral_code is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+    return referral_code
 
 
 @referral_code_router.get(
     "/",
     response_model=ReferralCodeSerializer,
+    responses={
+        304: {"description": "The referral code has the given ETag."},
+        404: {"description": "User or Referral code not found."},
+    },
     summary="Get Referral Code by Email",
-    description="Get the referral code associated with the given user's email."
+    description=(
+        "Get the referral code associated with the given user's email. "
+        "Pass the `ETag` of a previous response in `If-None-Match` to get "
+        "a `304 Not Modified` while the code did not change."
+    ),
 )
-async def get_referral_code_by_email(email: str):
-    user: User = await get_object_or_404(User, email=email)
-    referral_code: ReferralCode = await get_object_or_404(
-        ReferralCode, owner_uuid=user.uuid
+async def get_referral_code_by_email(
+    email: str, if_none_match: Annotated[str | None, Header()] = None
+):
+    user: UserSerializer = await get_object_or_404(
+        User, email=email, projection=UserSerializer
+    )
+    # only the served columns and the version stamp, never cached as the
+    # code expires, so the ETag is compared without loading the record
+    referral_code: ReferralCodeVersionSerializer = await get_object_or_404(
+        ReferralCode,
+        owner_uuid=user.uuid,
+        projection=ReferralCodeVersionSerializer,
+    )
+    if is_revoked(referral_code):
+        raise HTTPException(
+            status_code=404, detail="ReferralCode not found."
+        )
+    # reused no longer than the code is valid
+    seconds_left: float = (
+        referral_code.expiration_time - utc_now()
+    ).total_seconds()
+    headers: dict[str, str] = cache_headers(
+        make_etag(referral_code.uuid, referral_code.row_version),
+        max(0, min(settings.HTTP_CACHE_MAX_AGE_SECONDS, int(seconds_left))),
+    )
+    if etag_matches(if_none_match, headers["ETag"]):
+        return not_modified_response(headers)
+    return trusted_response(
+        ReferralCodeSerializer.model_construct(
+            code=referral_code.code,
+            expiration_time=referral_code.expiration_time,
+        ),
+        headers=headers,
+    )
+
+
+@referral_code_router.post(
+    "/batch",
+    response_model=ReferralCodesBatchSerializer,
+    summary="Get Referral Codes by Emails",
+    description=(
+        "Get the referral codes associated with the given users' emails, "
+        "at most `REFERRAL_CODES_BATCH_MAX_EMAILS` of them, in one request. "
+        "The code of an email is null when there is no such user or the "
+        "user has no active referral code."
+    ),
+)
+async def get_referral_codes_by_email_batch(
+    emails: Annotated[
+        list[str],
+        Body(
+            embed=True,
+            min_length=1,
+            max_length=settings.REFERRAL_CODES_BATCH_MAX_EMAILS,
+        ),
+    ],
+):
+    return ReferralCodesBatchSerializer(
+        referral_codes=await get_referral_codes_by_emails(emails)
     )
-    return referral_code
 
 
 @referral_code_router.delete(
@@ -60,21 +163,24 @@ async def get_referral_code_by_email(email: str):
     },
     summary="Delete Referral Code",
     description=(
-        "Delete the referral code associated with the given " "referral code."
+        "Delete the referral code associated with the given referral code. "
+        "With `WRITE_QUEUE_ENABLED`, the deletion is applied in the "
+        "background within `WRITE_QUEUE_FLUSH_INTERVAL_SECONDS`; until "
+        "then the worker that queued it serves the code as deleted, but "
+        "the other workers may still return it."
     ),
 )
 async def delete_referral_code(
     referral_code: str,
-    user: Annotated[User, Depends(get_user_from_jwt)],
-    background_tasks: BackgroundTasks,
+    user: Annotated[UserPrincipal, Depends(get_principal_from_jwt)],
 ):
-    referral_code: ReferralCode = await get_object_or_404(
-        ReferralCode, code=referral_code
-    )
-    verify_ownership(referral_code, "owner_uuid", user.uuid)
-    background_tasks.add_task(
-        DBInteractionsManager.delete_record_from_db, referral_code
-    )
+    if not await revoke_referral_code(referral_code, user.uuid):
+        # tell a missing code from a code of someone else
+        await get_object_or_404(ReferralCode, code=referral_code)
+        raise HTTPException(
+            status_code=403,
+            detail="You are not allowed to perform this action.",
+        )
     return DefaultMessageSerializer(
         message="Referral code deleted successfully."
     )
@@ -89,37 +195,145 @@ async def delete_referral_code(
         404: {"description": "User or Referral code not found."},
     },
     summary="Become Referral",
-    description="Make the given user a referral of the user from ref code.",
+    description=(
+        "Make the given user a referral of the user from ref code. With "
+        "`WRITE_QUEUE_ENABLED`, the referrer is assigned in the background "
+        "within `WRITE_QUEUE_FLUSH_INTERVAL_SECONDS`, and the referrals, "
+        "the referral tree and the leaderboard, ETags included, only show "
+        "it once it is applied."
+    ),
 )
 async def become_referral(
     ref_code: str,
-    user: Annotated[User, Depends(get_user_from_jwt)],
-    background_tasks: BackgroundTasks,
+    user: Annotated[UserPrincipal, Depends(get_principal_from_jwt)],
 ):
-    referral_code: ReferralCode = await get_object_or_404(
-        ReferralCode, code=ref_code
+    referrer_uuid: UUID | None = await assign_referrer_by_code(
+        user.uuid, ref_code
     )
-    if referral_code.owner_uuid == user.uuid:
+    if referrer_uuid is None:
+        raise HTTPException(
+            status_code=404, detail="ReferralCode not found."
+        )
+    if referrer_uuid == user.uuid:
         raise HTTPException(
             status_code=400, detail="You cannot become a referral of your own."
         )
-    background_tasks.add_task(
-        DBInteractionsManager.update_record_in_db,
-        user,
-        {"referrer_uuid": referral_code.owner_uuid},
-    )
     return DefaultMessageSerializer(message="You became a referral.")
 
 
 @referral_code_router.get(
     "/all_referrals/{uuid_referrer}",
     response_model=ReferralsSerializer,
-    responses={404: {"description": "User not found."}},
+    responses={
+        304: {"description": "The page has the given ETag."},
+        400: {"description": "Invalid cursor."},
+        404: {"description": "User not found."},
+    },
     summary="Get All Referrals",
-    description="Get all users who referred the user with the given UUID.",
+    description=(
+        "Get the users who referred the user with the given UUID, page by "
+        "page, `limit` of them at a time (`REFERRALS_PAGE_DEFAULT_LIMIT` by "
+        "default). Pass the `next_cursor` of a page as `cursor` to get the "
+        "next one, or use the `/stream` endpoint to get them all. Pass the "
+        "`ETag` of a previous response in `If-None-Match` to get a `304 Not "
+        "Modified` while the referrals did not change. Referrers assigned "
+        "through the write queue are listed once the queue applied them."
+    ),
+)
+async def get_all_referrals(
+    uuid_referrer: UUID,
+    limit: Annotated[
+        int, Query(ge=1, le=settings.REFERRALS_PAGE_MAX_LIMIT)
+    ] = settings.REFERRALS_PAGE_DEFAULT_LIMIT,
+    cursor: str | None = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+):
+    after: tuple[datetime, UUID] | None = (
+        decode_cursor(cursor) if cursor else None
+    )
+    if if_none_match is not None:
+        # a lookup of the primary key only, never cached as it lacks the
+        # email, so the version is as fresh as the page would be
+        version: RowVersionSerializer = await get_object_or_404(
+            User, uuid=uuid_referrer, projection=RowVersionSerializer
+        )
+        headers: dict[str, str] = cache_headers(
+            make_etag(uuid_referrer, version.row_version, limit, cursor)
+        )
+        if etag_matches(if_none_match, headers["ETag"]):
+            return not_modified_response(headers)
+    page: tuple[int, list[ReferralSerializer]] | None = (
+        await get_referrals_page(uuid_referrer, limit, after)
+    )
+    if page is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+    row_version, referrals = page
+    next_cursor: str | None = None
+    if len(referrals) == limit:
+        next_cursor = encode_cursor(
+            referrals[-1].created_at, referrals[-1].uuid
+        )
+    return trusted_response(
+        ReferralsSerializer(referrals=referrals, next_cursor=next_cursor),
+        headers=cache_headers(
+            make_etag(uuid_referrer, row_version, limit, cursor)
+        ),
+    )
+
+
+@referral_code_router.get(
+    "/all_referrals/{uuid_referrer}/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {NDJSON_MEDIA_TYPE: {}}},
+        404: {"description": "User not found."},
+    },
+    summary="Stream All Referrals",
+    description=(
+        "Stream all users who referred the user with the given UUID as "
+        "newline-delimited JSON, one user per line."
+    ),
 )
-async def get_all_referrals(uuid_referrer: UUID):
-    user: User = await get_object_or_404(
-        User, relationship_names=["referrals"], uuid=uuid_referrer
+async def stream_all_referrals(uuid_referrer: UUID):
+    await get_object_or_404(
+        User, uuid=uuid_referrer, projection=UserSerializer
+    )
+    chunks = DBInteractionsManager.stream_records_from_db(
+        {"referrer_uuid": uuid_referrer},
+        User,
+        order_by=REFERRALS_ORDER,
+        chunk_size=settings.STREAM_CHUNK_SIZE,
+        projection=UserSerializer,
+    )
+    return StreamingResponse(
+        ndjson_chunks(chunks, UserSerializer), media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+@referral_code_router.get(
+    "/referral_tree/{uuid_referrer}",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {NDJSON_MEDIA_TYPE: {}}},
+        404: {"description": "User not found."},
+    },
+    summary="Stream Referral Tree",
+    description=(
+        "Stream the referrals of the user with the given UUID, their "
+        "referrals and so on down to `depth` levels, as newline-delimited "
+        "JSON. The last line holds the number of referrals per level."
+    ),
+)
+async def stream_referral_tree(
+    uuid_referrer: UUID,
+    depth: Annotated[
+        int, Query(ge=1, le=settings.REFERRAL_TREE_MAX_DEPTH)
+    ] = 3,
+):
+    await get_object_or_404(
+        User, uuid=uuid_referrer, projection=UserSerializer
+    )
+    return StreamingResponse(
+        referral_tree_ndjson(uuid_referrer, depth),
+        media_type=NDJSON_MEDIA_TYPE,
     )
-    return ReferralsSerializer(referrals=user.referrals)
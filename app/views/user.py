@@ -1,24 +1,35 @@
 from typing import Annotated
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Query
 from fastapi.exceptions import ResponseValidationError
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config.settings import Settings, get_settings
+from app.core.referrals import get_top_referrers
 from app.core.security import JWT_Token, PasswordHasher
 from app.db.db import get_session
 from app.db.db_shortcuts import get_object_or_404
 from app.models.user import User
 from app.routes import user_router
 from app.serializers.token import Token
-from app.serializers.user import UserInSerializer, UserOutSerializerWithToken
+from app.serializers.user import (
+    LeaderboardSerializer,
+    UserInSerializer,
+    UserOutSerializerWithToken,
+)
+
+settings: Settings = get_settings()
 
 
 @user_router.post(
     "/signup",
     response_model=UserOutSerializerWithToken,
-    responses={400: {"description": "Email already exists"}},
+    responses={
+        400: {"description": "Email already exists"},
+        503: {"description": "Server is busy."},
+    },
     summary="User Registration",
     description=(
         "Register a new user with email, password and receive a JWT token."
@@ -28,12 +39,12 @@ async def register_user(
     body: UserInSerializer,
     async_session: Annotated[AsyncSession, Depends(get_session)],
 ) -> dict:
-    body.password = PasswordHasher.hash_password(body.password)
+    body.password = await PasswordHasher.async_hash_password(body.password)
     user = User(**dict(body))
     async_session.add(user)
     try:
         await async_session.commit()
-        jwt_token: str = JWT_Token.create_token({"user_email": user.email})
+        jwt_token: str = JWT_Token.create_user_token(user)
         return {"user": user, "access_token": jwt_token}
     except (IntegrityError, ResponseValidationError):
         raise HTTPException(
@@ -47,6 +58,7 @@ async def register_user(
     responses={
         400: {"description": "Invalid password."},
         404: {"description": "User not found."},
+        503: {"description": "Server is busy."},
     },
     summary="User Login",
     description=(
@@ -57,10 +69,33 @@ async def register_user(
 async def login_user(
     user_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ):
-    user: User = await get_object_or_404(User, email=user_data.username)
-    if PasswordHasher.check_password(user_data.password, user.password):
-        jwt_token: str = JWT_Token.create_token({"user_email": user.email})
+    # read from the database every time, the password hash is never cached
+    user: UserInSerializer = await get_object_or_404(
+        User, email=user_data.username, projection=UserInSerializer
+    )
+    if await PasswordHasher.async_check_password(
+        user_data.password, user.password
+    ):
+        jwt_token: str = JWT_Token.create_user_token(user)
         return Token(access_token=jwt_token)
     raise HTTPException(
         status_code=400, detail="Invalid password, please pass correct one."
     )
+
+
+@user_router.get(
+    "/leaderboard",
+    response_model=LeaderboardSerializer,
+    summary="Top Referrers",
+    description=(
+        "Get the users with the most referrals, best first. Referrers "
+        "assigned through the write queue are counted once the queue "
+        "applied them."
+    ),
+)
+async def get_leaderboard(
+    limit: Annotated[
+        int, Query(ge=1, le=settings.LEADERBOARD_MAX_LIMIT)
+    ] = 10,
+):
+    return LeaderboardSerializer(leaders=await get_top_referrers(limit))
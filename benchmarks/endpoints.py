@@ -0,0 +1,492 @@
+"""
+Throughput, latency and SQL statements per request of every route of the
+API under concurrent load, with a baseline to compare changes against.
+
+The FastAPI app is driven in-process through an ASGI client. The suite
+writes to its database, so it never uses the database of the `.env`
+settings: it runs against `--database-url` or the `DATABASE_URL`
+environment variable, and falls back to a fresh SQLite database so it runs
+without any service. The database is seeded with `--users` users whose
+referrers follow a heavy-tailed fan-out, a few users bringing most of the
+referrals, and half of them own a referral code.
+
+Usage:
+    python -m benchmarks.endpoints --users 2000 --requests 200
+    python -m benchmarks.endpoints --save benchmarks/baseline.json
+    python -m benchmarks.endpoints --compare benchmarks/baseline.json
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import gather, run
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from json import dump, load
+from os import environ
+from pathlib import Path
+from random import Random
+from secrets import token_hex
+from sys import exit
+from tempfile import gettempdir
+from time import perf_counter
+from typing import Callable
+from uuid import UUID, uuid4
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.stats import percentiles
+
+PASSWORD: str = "benchmark-password"
+SQLITE_PATH: Path = Path(gettempdir()) / "referral-benchmark.sqlite3"
+# share of the users that signed up with a referral code, and share of
+# those referrals that go to a user who already brought referrals
+REFERRED_SHARE: float = 0.8
+REPEAT_REFERRER_SHARE: float = 0.7
+
+RequestSpec = tuple[str, str, dict]
+
+
+@dataclass
+class SeedData:
+    users: list[dict]
+    # one entry per referral, so popular referrers are drawn more often
+    referrals: list[UUID]
+    codes: dict[UUID, str]
+
+
+@dataclass
+class Scenario:
+    name: str
+    requests: int
+    build: Callable[[int], RequestSpec]
+
+
+async def seed_database(users_count: int, rng: Random) -> SeedData:
+    """
+    Insert `users_count` users, their referral links and referral codes
+    directly, with a single bcrypt hash shared by every user.
+    """
+    from sqlalchemy import insert
+
+    from app.core.security import PasswordHasher
+    from app.db.db import get_engine
+    from app.models.referral_code import ReferralCode
+    from app.models.user import User
+
+    password: str = PasswordHasher.hash_password(PASSWORD)
+    run_id: str = token_hex(4)
+    now: datetime = datetime.now(timezone.utc)
+    users: list[dict] = []
+    referrals: list[UUID] = []
+    for index in range(users_count):
+        referrer_uuid: UUID | None = None
+        if users and rng.random() < REFERRED_SHARE:
+            if referrals and rng.random() < REPEAT_REFERRER_SHARE:
+                referrer_uuid = rng.choice(referrals)
+            else:
+                referrer_uuid = rng.choice(users)["uuid"]
+            referrals.append(referrer_uuid)
+        users.append(
+            {
+                "uuid": uuid4(),
+                "email": f"bench-{run_id}-{index}@example.com",
+                "password": password,
+                "created_at": now - timedelta(seconds=users_count - index),
+                "referral_count": 0,
+                "referrer_uuid": referrer_uuid,
+            }
+        )
+    counts: Counter = Counter(referrals)
+    for user in users:
+        user["referral_count"] = counts[user["uuid"]]
+    codes: dict[UUID, str] = {
+        user["uuid"]: token_hex(16) for user in users if rng.random() < 0.5
+    }
+
+    async with get_engine().begin() as connection:
+        for start in range(0, len(users), 1000):
+            await connection.execute(insert(User), users[start:start + 1000])
+        code_rows: list[dict] = [
+            {
+                "uuid": uuid4(),
+                "code": code,
+                "owner_uuid": owner_uuid,
+                "expiration_time": now + timedelta(days=30),
+            }
+            for owner_uuid, code in codes.items()
+        ]
+        for start in range(0, len(code_rows), 1000):
+            await connection.execute(
+                insert(ReferralCode), code_rows[start:start + 1000]
+            )
+    return SeedData(users, referrals, codes)
+
+
+def make_scenarios(
+    data: SeedData, requests: int, rng: Random
+) -> list[Scenario]:
+    """
+    Build the requests of every route, reads first, then the writes, which
+    change the data the reads would see.
+    """
+    from app.core.responses import make_etag
+    from app.core.security import JWT_Token
+    from app.models.user import User
+
+    def auth(user: dict) -> dict:
+        token: str = JWT_Token.create_user_token(
+            User(uuid=user["uuid"], email=user["email"])
+        )
+        return {"Authorization": f"Bearer {token}"}
+
+    emails: dict[UUID, str] = {
+        user["uuid"]: user["email"] for user in data.users
+    }
+    owners: list[UUID] = list(data.codes)
+    rng.shuffle(owners)
+    # the codes deleted by the benchmark are not used, nor rotated, by the
+    # other routes
+    deleted_owners: list[UUID] = owners[:requests]
+    owners = owners[requests:] or deleted_owners
+    reserved: set[UUID] = set(deleted_owners)
+    rotating_users: list[dict] = [
+        user for user in data.users if user["uuid"] not in reserved
+    ]
+    referrers: list[UUID] = data.referrals or [data.users[0]["uuid"]]
+    users_by_uuid: dict[UUID, dict] = {
+        user["uuid"]: user for user in data.users
+    }
+    signup_prefix: str = token_hex(4)
+
+    def revalidate_referrals(_: int) -> RequestSpec:
+        # seeded users are at their first version, and the reads run
+        # before the writes, so every request is answered with a 304
+        referrer_uuid: UUID = rng.choice(referrers)
+        return (
+            "GET",
+            f"/referral_codes/all_referrals/{referrer_uuid}",
+            {
+                "params": {"limit": 50},
+                "headers": {
+                    "If-None-Match": make_etag(referrer_uuid, 1, 50, None)
+                },
+            },
+        )
+
+    def become_referral(_: int) -> RequestSpec:
+        user: dict = rng.choice(data.users)
+        owner_uuid: UUID = rng.choice(owners)
+        return (
+            "POST",
+            "/referral_codes/become_referral",
+            {
+                "params": {"ref_code": data.codes[owner_uuid]},
+                "headers": auth(user),
+            },
+        )
+
+    return [
+        Scenario(
+            "GET /users/leaderboard",
+            requests,
+            lambda _: ("GET", "/users/leaderboard", {"params": {"limit": 10}}),
+        ),
+        Scenario(
+            "GET /referral_codes/",
+            requests,
+            lambda _: (
+                "GET",
+                "/referral_codes/",
+                {"params": {"email": emails[rng.choice(owners)]}},
+            ),
+        ),
+        Scenario(
+            "POST /referral_codes/batch",
+            requests,
+            lambda _: (
+                "POST",
+                "/referral_codes/batch",
+                {
+                    "json": {
+                        "emails": [
+                            user["email"]
+                            for user in rng.sample(
+                                data.users, min(50, len(data.users))
+                            )
+                        ]
+                    }
+                },
+            ),
+        ),
+        Scenario(
+            "GET /referral_codes/all_referrals/{uuid_referrer}",
+            requests,
+            lambda _: (
+                "GET",
+                f"/referral_codes/all_referrals/{rng.choice(referrers)}",
+                {"params": {"limit": 50}},
+            ),
+        ),
+        Scenario(
+            "GET /referral_codes/all_referrals/{uuid_referrer} (304)",
+            requests,
+            revalidate_referrals,
+        ),
+        Scenario(
+            "GET /referral_codes/all_referrals/{uuid_referrer}/stream",
+            requests,
+            lambda _: (
+                "GET",
+                "/referral_codes/all_referrals/"
+                f"{rng.choice(referrers)}/stream",
+                {},
+            ),
+        ),
+        Scenario(
+            "GET /referral_codes/referral_tree/{uuid_referrer}",
+            requests,
+            lambda _: (
+                "GET",
+                f"/referral_codes/referral_tree/{rng.choice(referrers)}",
+                {"params": {"depth": 3}},
+            ),
+        ),
+        Scenario(
+            "POST /users/login",
+            requests,
+            lambda _: (
+                "POST",
+                "/users/login",
+                {
+                    "data": {
+                        "username": rng.choice(data.users)["email"],
+                        "password": PASSWORD,
+                    }
+                },
+            ),
+        ),
+        Scenario(
+            "POST /users/signup",
+            requests,
+            lambda index: (
+                "POST",
+                "/users/signup",
+                {
+                    "json": {
+                        "email": f"signup-{signup_prefix}-{index}"
+                        "@example.com",
+                        "password": PASSWORD,
+                    }
+                },
+            ),
+        ),
+        Scenario(
+            "POST /referral_codes/become_referral", requests, become_referral
+        ),
+        Scenario(
+            "POST /referral_codes/",
+            requests,
+            lambda _: (
+                "POST",
+                "/referral_codes/",
+                {"headers": auth(rng.choice(rotating_users))},
+            ),
+        ),
+        Scenario(
+            "DELETE /referral_codes/{referral_code}",
+            len(deleted_owners),
+            lambda index: (
+                "DELETE",
+                f"/referral_codes/{data.codes[deleted_owners[index]]}",
+                {"headers": auth(users_by_uuid[deleted_owners[index]])},
+            ),
+        ),
+    ]
+
+
+async def run_scenario(
+    client: AsyncClient, scenario: Scenario, concurrency: int
+) -> dict:
+    from app.db.query_counter import QueryCounter
+
+    latencies: list[float] = []
+    errors: Counter = Counter()
+    next_index: list[int] = [0]
+
+    async def worker():
+        while next_index[0] < scenario.requests:
+            index: int = next_index[0]
+            next_index[0] += 1
+            method, url, kwargs = scenario.build(index)
+            started: float = perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(perf_counter() - started)
+            if response.status_code >= 400:
+                errors[response.status_code] += 1
+
+    with QueryCounter() as counter:
+        started: float = perf_counter()
+        await gather(*(worker() for _ in range(concurrency)))
+        elapsed: float = perf_counter() - started
+    return {
+        "requests": scenario.requests,
+        "errors": {str(status): count for status, count in errors.items()},
+        "throughput_rps": scenario.requests / elapsed,
+        "latency_ms": percentiles(latencies),
+        "statements_per_request": counter.count / scenario.requests,
+    }
+
+
+async def benchmark(arguments: Namespace, database_url: str) -> dict:
+    from sqlalchemy import make_url
+
+    from app.db.db import db_lifespan
+    from app.db.migrator import upgrade
+    from app.main import app
+
+    rng = Random(arguments.seed)
+    async with db_lifespan() as engine:
+        await upgrade(engine)
+        data: SeedData = await seed_database(arguments.users, rng)
+    routes: dict[str, dict] = {}
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://benchmark"
+        ) as client:
+            for scenario in make_scenarios(data, arguments.requests, rng):
+                routes[scenario.name] = await run_scenario(
+                    client, scenario, arguments.concurrency
+                )
+                print_route(scenario.name, routes[scenario.name])
+    return {
+        "meta": {
+            "database": make_url(database_url).get_backend_name(),
+            "users": arguments.users,
+            "requests": arguments.requests,
+            "concurrency": arguments.concurrency,
+            "seed": arguments.seed,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        },
+        "routes": routes,
+    }
+
+
+def print_route(name: str, result: dict) -> None:
+    errors: str = ", ".join(
+        f"{count}x{status}" for status, count in result["errors"].items()
+    )
+    latency: dict = result["latency_ms"]
+    print(
+        f"{name:<58} {result['throughput_rps']:8.1f} req/s  "
+        f"p50/p95/p99 {latency['p50']:7.1f} {latency['p95']:7.1f} "
+        f"{latency['p99']:7.1f} ms  "
+        f"{result['statements_per_request']:5.1f} SQL/req"
+        + (f"  errors: {errors}" if errors else "")
+    )
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Print the changes from the baseline and return the regressions: a p95
+    latency or a throughput worse by more than `tolerance`, or an extra SQL
+    statement per request.
+    """
+    if result["meta"]["database"] != baseline["meta"]["database"] or any(
+        result["meta"][name] != baseline["meta"][name]
+        for name in ("users", "requests", "concurrency")
+    ):
+        print("Warning: the baseline was run with other parameters.")
+    regressions: list[str] = []
+    print(f"\n{'Compared to the baseline':<58}   p95      req/s    SQL/req")
+    for name, current in result["routes"].items():
+        previous: dict | None = baseline["routes"].get(name)
+        if previous is None:
+            continue
+        p95_change: float = (
+            current["latency_ms"]["p95"] / previous["latency_ms"]["p95"] - 1
+        )
+        throughput_change: float = (
+            current["throughput_rps"] / previous["throughput_rps"] - 1
+        )
+        statements_change: float = (
+            current["statements_per_request"]
+            - previous["statements_per_request"]
+        )
+        print(
+            f"{name:<58} {p95_change:+7.1%}  {throughput_change:+7.1%}  "
+            f"{statements_change:+6.2f}"
+        )
+        if p95_change > tolerance:
+            regressions.append(f"{name}: p95 latency {p95_change:+.1%}")
+        if throughput_change < -tolerance:
+            regressions.append(
+                f"{name}: throughput {throughput_change:+.1%}"
+            )
+        # cache hits move the average a little, an extra query per request
+        # moves it by one
+        if statements_change >= 0.5:
+            regressions.append(
+                f"{name}: {statements_change:+.2f} SQL statements per request"
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--database-url",
+        help="defaults to DATABASE_URL, then to a fresh SQLite database",
+    )
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--bcrypt-rounds",
+        type=int,
+        help="bcrypt cost of signup and login, defaults to BCRYPT_ROUNDS",
+    )
+    parser.add_argument("--save", type=Path, help="write the results here")
+    parser.add_argument(
+        "--compare", type=Path, help="baseline to compare the results with"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative slowdown reported as a regression",
+    )
+    arguments: Namespace = parser.parse_args(argv)
+
+    database_url: str | None = arguments.database_url or environ.get(
+        "DATABASE_URL"
+    )
+    if database_url is None:
+        for path in SQLITE_PATH.parent.glob(f"{SQLITE_PATH.name}*"):
+            path.unlink()
+        database_url = f"sqlite+aiosqlite:///{SQLITE_PATH}"
+    # the settings are read when the app is imported, after this
+    environ["DATABASE_URL"] = database_url
+    environ["DATABASE_ECHO"] = "false"
+    environ["EXPIRED_CODES_SWEEPER_ENABLED"] = "false"
+    environ.setdefault("SECRET_KEY", token_hex(32))
+    if arguments.bcrypt_rounds is not None:
+        environ["BCRYPT_ROUNDS"] = str(arguments.bcrypt_rounds)
+
+    result: dict = run(benchmark(arguments, database_url))
+    if arguments.save is not None:
+        with arguments.save.open("w") as file:
+            dump(result, file, indent=4)
+    if arguments.compare is not None:
+        with arguments.compare.open() as file:
+            baseline: dict = load(file)
+        regressions: list[str] = compare(
+            result, baseline, arguments.tolerance
+        )
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
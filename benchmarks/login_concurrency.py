@@ -0,0 +1,108 @@
+"""
+Login latency under concurrent load, with bcrypt running inline on the event
+loop ("before") and inside the configured worker pool ("after").
+
+The FastAPI app is driven in-process through an ASGI client against the
+database from the usual `.env` settings. While the logins are in flight a
+probe keeps requesting a route that does no hashing, so the report also
+shows how long the event loop was stalled for everybody else.
+
+Usage:
+    python -m benchmarks.login_concurrency --requests 200 --concurrency 50
+"""
+
+from argparse import ArgumentParser
+from asyncio import Event, create_task, gather, run, sleep
+from time import perf_counter
+from uuid import uuid4
+
+from httpx import ASGITransport, AsyncClient
+
+from app.config.settings import get_settings
+from app.core.security import PasswordHasher
+from app.main import app
+from benchmarks.stats import percentiles
+
+PASSWORD: str = "benchmark-password"
+
+
+async def run_mode(
+    client: AsyncClient, email: str, requests: int, concurrency: int
+) -> dict:
+    login_latencies: list[float] = []
+    probe_latencies: list[float] = []
+    done = Event()
+    remaining: list[int] = [requests]
+
+    async def login_worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            started: float = perf_counter()
+            response = await client.post(
+                "/users/login", data={"username": email, "password": PASSWORD}
+            )
+            response.raise_for_status()
+            login_latencies.append(perf_counter() - started)
+
+    async def probe():
+        # measured from the moment the probe wanted to run, so time spent
+        # waiting for a blocked event loop is included
+        while not done.is_set():
+            scheduled: float = perf_counter() + 0.01
+            await sleep(0.01)
+            await client.get("/openapi.json")
+            probe_latencies.append(perf_counter() - scheduled)
+
+    probe_task = create_task(probe())
+    started: float = perf_counter()
+    await gather(*(login_worker() for _ in range(concurrency)))
+    elapsed: float = perf_counter() - started
+    done.set()
+    await probe_task
+    return {
+        "throughput_rps": requests / elapsed,
+        "login_ms": percentiles(login_latencies),
+        "probe_ms": percentiles(probe_latencies),
+    }
+
+
+async def main(requests: int, concurrency: int):
+    settings = get_settings()
+    configured_mode: str = settings.PASSWORD_HASHER_EXECUTOR
+    email: str = f"bench-{uuid4().hex[:12]}@example.com"
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://benchmark"
+        ) as client:
+            response = await client.post(
+                "/users/signup", json={"email": email, "password": PASSWORD}
+            )
+            response.raise_for_status()
+            await client.get("/openapi.json")
+
+            for label, mode in (
+                ("before (inline)", "inline"),
+                (f"after ({configured_mode})", configured_mode),
+            ):
+                settings.PASSWORD_HASHER_EXECUTOR = mode
+                PasswordHasher.shutdown_executor()
+                result: dict = await run_mode(
+                    client, email, requests, concurrency
+                )
+                print(
+                    f"{label:<20} {result['throughput_rps']:8.1f} req/s  "
+                    "login p50/p95/p99 "
+                    "{p50:8.1f} {p95:8.1f} {p99:8.1f} ms  ".format(
+                        **result["login_ms"]
+                    )
+                    + "probe p99 {p99:8.1f} ms".format(**result["probe_ms"])
+                )
+    settings.PASSWORD_HASHER_EXECUTOR = configured_mode
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    arguments = parser.parse_args()
+    run(main(arguments.requests, arguments.concurrency))
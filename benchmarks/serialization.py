@@ -0,0 +1,215 @@
+"""
+Latency of a large JSON list response, with FastAPI validating and encoding
+the response as usual ("default") and with the fast JSON path of the app
+("fast"): responses encoded by orjson, and serializers returned by the
+endpoints dumped by pydantic in one pass by `TrustedResponseRoute`.
+
+A referrer with `--referrals` referrals is seeded, and an endpoint
+returning the payload of `GET /referral_codes/all_referrals/{uuid_referrer}`
+is mounted on one app per mode, which are driven in-process through an ASGI
+client one request at a time. As loading the referrals takes most of a
+request, the time to render the return value of the endpoint is measured
+on its own too.
+
+Like `benchmarks.endpoints`, it runs against `--database-url` or the
+`DATABASE_URL` environment variable, and falls back to a fresh SQLite
+database.
+
+Usage:
+    python -m benchmarks.serialization --referrals 10000 --requests 50
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from datetime import datetime, timedelta, timezone
+from os import environ
+from pathlib import Path
+from secrets import token_hex
+from tempfile import gettempdir
+from time import perf_counter
+from uuid import UUID, uuid4
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.stats import percentiles
+
+SQLITE_PATH: Path = Path(gettempdir()) / "serialization-benchmark.sqlite3"
+ROUTE: str = "/all_referrals/{uuid_referrer}"
+
+
+async def seed_referrals(referrals_count: int) -> UUID:
+    """
+    Insert a referrer and `referrals_count` users it referred, and return
+    the UUID of the referrer.
+    """
+    from sqlalchemy import insert
+
+    from app.db.db import get_engine
+    from app.models.user import User
+
+    run_id: str = token_hex(4)
+    now: datetime = datetime.now(timezone.utc)
+    referrer_uuid: UUID = uuid4()
+    users: list[dict] = [
+        {
+            "uuid": referrer_uuid,
+            "email": f"referrer-{run_id}@example.com",
+            # nobody logs in, so no bcrypt hash is needed
+            "password": "unused",
+            "created_at": now - timedelta(days=1),
+            "referral_count": referrals_count,
+            "referrer_uuid": None,
+        }
+    ]
+    users.extend(
+        {
+            "uuid": uuid4(),
+            "email": f"referral-{run_id}-{index}@example.com",
+            "password": "unused",
+            "created_at": now - timedelta(seconds=referrals_count - index),
+            "referral_count": 0,
+            "referrer_uuid": referrer_uuid,
+        }
+        for index in range(referrals_count)
+    )
+    async with get_engine().begin() as connection:
+        for start in range(0, len(users), 1000):
+            await connection.execute(insert(User), users[start:start + 1000])
+    return referrer_uuid
+
+
+async def get_all_referrals(uuid_referrer: UUID):
+    # the view renders its response itself, to add its ETag, so the
+    # payload is returned for the route to render instead
+    from app.core.referrals import get_referrals_page
+    from app.serializers.user import ReferralsSerializer
+
+    _, referrals = await get_referrals_page(uuid_referrer, None, None)
+    return ReferralsSerializer(referrals=referrals)
+
+
+def build_app(fast: bool) -> FastAPI:
+    from app.core.responses import FastJSONResponse, TrustedResponseRoute
+    from app.serializers.user import ReferralsSerializer
+
+    router = APIRouter(
+        route_class=TrustedResponseRoute if fast else APIRoute
+    )
+    router.add_api_route(
+        ROUTE, get_all_referrals, response_model=ReferralsSerializer
+    )
+    mode_app = FastAPI(
+        default_response_class=FastJSONResponse if fast else JSONResponse
+    )
+    mode_app.include_router(router)
+    return mode_app
+
+
+async def run_mode(fast: bool, url: str, requests: int) -> dict:
+    latencies: list[float] = []
+    async with AsyncClient(
+        transport=ASGITransport(app=build_app(fast)),
+        base_url="http://benchmark",
+    ) as client:
+        # warms up the caches and the database connection
+        response = await client.get(url)
+        response.raise_for_status()
+        for _ in range(requests):
+            started: float = perf_counter()
+            response = await client.get(url)
+            latencies.append(perf_counter() - started)
+            response.raise_for_status()
+    return {
+        "latency_ms": percentiles(latencies),
+        "bytes": len(response.content),
+        "body": response.json(),
+    }
+
+
+async def time_rendering(
+    fast: bool, referrer_uuid: UUID, requests: int
+) -> dict:
+    # what each mode does with the return value of the endpoint
+    from app.core.responses import trusted_response
+
+    route: APIRoute = build_app(False).router.routes[-1]
+    content = await get_all_referrals(referrer_uuid)
+    latencies: list[float] = []
+    for _ in range(requests):
+        started: float = perf_counter()
+        if fast:
+            trusted_response(content)
+        else:
+            JSONResponse(
+                await serialize_response(
+                    field=route.secure_cloned_response_field,
+                    response_content=content,
+                )
+            )
+        latencies.append(perf_counter() - started)
+    return percentiles(latencies)
+
+
+async def benchmark(arguments: Namespace) -> None:
+    from app.db.db import db_lifespan
+    from app.db.migrator import upgrade
+    from app.main import app
+
+    async with db_lifespan() as engine:
+        await upgrade(engine)
+        referrer_uuid: UUID = await seed_referrals(arguments.referrals)
+    url: str = ROUTE.format(uuid_referrer=referrer_uuid)
+    results: dict[str, dict] = {}
+    async with app.router.lifespan_context(app):
+        for mode, fast in (("default", False), ("fast", True)):
+            results[mode] = await run_mode(fast, url, arguments.requests)
+            results[mode]["rendering_ms"] = await time_rendering(
+                fast, referrer_uuid, arguments.requests
+            )
+            latency: dict = results[mode]["latency_ms"]
+            rendering: dict = results[mode]["rendering_ms"]
+            print(
+                f"{mode:<8} request p50/p95 {latency['p50']:7.1f} "
+                f"{latency['p95']:7.1f} ms  rendering p50/p95 "
+                f"{rendering['p50']:6.1f} {rendering['p95']:6.1f} ms  "
+                f"{results[mode]['bytes']} bytes"
+            )
+    if results["default"]["body"] != results["fast"]["body"]:
+        raise SystemExit("The fast path returned another response.")
+    for name in ("latency_ms", "rendering_ms"):
+        speedup: float = (
+            results["default"][name]["p50"] / results["fast"][name]["p50"]
+        )
+        print(f"p50 {name[:-3]} speedup of the fast path: {speedup:.2f}x")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--database-url",
+        help="defaults to DATABASE_URL, then to a fresh SQLite database",
+    )
+    parser.add_argument("--referrals", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=50)
+    arguments: Namespace = parser.parse_args(argv)
+
+    database_url: str | None = arguments.database_url or environ.get(
+        "DATABASE_URL"
+    )
+    if database_url is None:
+        for path in SQLITE_PATH.parent.glob(f"{SQLITE_PATH.name}*"):
+            path.unlink()
+        database_url = f"sqlite+aiosqlite:///{SQLITE_PATH}"
+    # the settings are read when the app is imported, after this
+    environ["DATABASE_URL"] = database_url
+    environ["DATABASE_ECHO"] = "false"
+    environ["EXPIRED_CODES_SWEEPER_ENABLED"] = "false"
+    environ.setdefault("SECRET_KEY", token_hex(32))
+    run(benchmark(arguments))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Cold start of the application: the time to import it and to generate its
+OpenAPI document in a fresh interpreter, and the time from launching
+`python -m app serve` to its first response, for every worker count.
+
+Every measurement runs in a new process, so nothing is cached between
+runs except by the operating system. Like `benchmarks.endpoints`, it runs
+against `--database-url` or the `DATABASE_URL` environment variable, and
+falls back to a fresh SQLite database, migrated with `python -m app
+migrate`.
+
+Usage:
+    python -m benchmarks.startup --runs 5 --workers 1 4
+"""
+
+from argparse import ArgumentParser, Namespace
+from json import loads
+from os import environ
+from pathlib import Path
+from secrets import token_hex
+from signal import SIGTERM
+from socket import socket
+from statistics import median
+from subprocess import DEVNULL, Popen, check_output, run
+from sys import executable
+from tempfile import gettempdir
+from time import perf_counter, sleep
+
+from httpx import Client, TransportError
+
+SQLITE_PATH: Path = Path(gettempdir()) / "startup-benchmark.sqlite3"
+FIRST_RESPONSE_TIMEOUT_SECONDS: float = 60
+IMPORT_SCRIPT: str = """
+from json import dumps
+from time import perf_counter
+
+started = perf_counter()
+from app.main import app
+imported = perf_counter()
+app.openapi()
+print(dumps({
+    "import_seconds": imported - started,
+    "openapi_seconds": perf_counter() - imported,
+}))
+"""
+
+
+def time_import() -> dict:
+    return loads(check_output([executable, "-c", IMPORT_SCRIPT], text=True))
+
+
+def time_first_response(workers: int) -> float:
+    """
+    Launch the server with `workers` workers and return the seconds until
+    it answered a first request.
+    """
+    with socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port: int = probe.getsockname()[1]
+    started: float = perf_counter()
+    server = Popen(
+        [
+            executable,
+            "-m",
+            "app",
+            "serve",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+        ],
+        stdout=DEVNULL,
+        stderr=DEVNULL,
+    )
+    try:
+        with Client(base_url=f"http://127.0.0.1:{port}") as client:
+            while perf_counter() - started < FIRST_RESPONSE_TIMEOUT_SECONDS:
+                if (code := server.poll()) is not None:
+                    raise SystemExit(f"The server exited with {code}.")
+                try:
+                    client.get("/openapi.json").raise_for_status()
+                    return perf_counter() - started
+                except TransportError:
+                    sleep(0.01)
+        raise SystemExit("The server did not answer in time.")
+    finally:
+        server.send_signal(SIGTERM)
+        server.wait()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--database-url",
+        help="defaults to DATABASE_URL, then to a fresh SQLite database",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    arguments: Namespace = parser.parse_args(argv)
+
+    database_url: str | None = arguments.database_url or environ.get(
+        "DATABASE_URL"
+    )
+    if database_url is None:
+        for path in SQLITE_PATH.parent.glob(f"{SQLITE_PATH.name}*"):
+            path.unlink()
+        database_url = f"sqlite+aiosqlite:///{SQLITE_PATH}"
+    # read by the settings of the processes launched from here
+    environ["DATABASE_URL"] = database_url
+    environ["DATABASE_ECHO"] = "false"
+    environ["EXPIRED_CODES_SWEEPER_ENABLED"] = "false"
+    environ.setdefault("SECRET_KEY", token_hex(32))
+    run([executable, "-m", "app", "migrate"], check=True, stdout=DEVNULL)
+
+    imports: list[dict] = [time_import() for _ in range(arguments.runs)]
+    for name in ("import_seconds", "openapi_seconds"):
+        seconds: float = median(result[name] for result in imports)
+        print(f"{name[:-8] + ' time':<32} {seconds * 1000:8.1f} ms")
+    for workers in arguments.workers:
+        seconds = median(
+            time_first_response(workers) for _ in range(arguments.runs)
+        )
+        print(
+            f"{f'first response, {workers} workers':<32} "
+            f"{seconds * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+from statistics import quantiles
+
+
+def percentiles(latencies: list[float]) -> dict:
+    """
+    Return the p50, p95 and p99 of latencies given in seconds, in
+    milliseconds.
+    """
+    if len(latencies) < 2:
+        latencies = latencies * 2 or [0.0, 0.0]
+    points: list[float] = quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50": points[49] * 1000,
+        "p95": points[94] * 1000,
+        "p99": points[98] * 1000,
+    }
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import uuid
+from typing import AsyncIterator
+
+import pytest
+
+# the application reads the settings when it is imported
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+if "DATABASE_URL" not in os.environ and "POSTGRES_HOST" not in os.environ:
+    os.environ["DATABASE_URL"] = (
+        f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/referral.db"
+    )
+# the counted statements must not depend on background jobs or warm caches
+os.environ.update(
+    BCRYPT_ROUNDS="4",
+    PASSWORD_HASHER_EXECUTOR="inline",
+    CACHE_BACKEND="none",
+    WRITE_QUEUE_ENABLED="false",
+    EXPIRED_CODES_SWEEPER_ENABLED="false",
+    REQUEST_SCOPED_SESSION="false",
+    STATELESS_AUTH="false",
+    POSTGRES_REPLICA_URLS="[]",
+)
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from app.db.db import db_lifespan, get_engine  # noqa: E402
+from app.db.migrator import upgrade  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def client() -> AsyncIterator[AsyncClient]:
+    """
+    The client of the application, with the database migrated to the head
+    revision and the application lifespan running for the whole session.
+    """
+    async with db_lifespan() as engine:
+        await upgrade(engine)
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            yield client
+
+
+@pytest.fixture(scope="session")
+def dialect(client: AsyncClient) -> str:
+    """The name of the dialect of the database the tests run against."""
+    return get_engine().dialect.name
+
+
+@pytest.fixture
+def postgresql_only(dialect: str) -> None:
+    """Skips the tests of PostgreSQL-only features on other databases."""
+    if dialect != "postgresql":
+        pytest.skip("requires PostgreSQL")
+
+
+class SignedUpUser:
+    def __init__(self, email: str, password: str, response: dict):
+        self.email: str = email
+        self.password: str = password
+        self.uuid: str = response["user"]["uuid"]
+        self.headers: dict[str, str] = {
+            "Authorization": f"Bearer {response['access_token']}"
+        }
+
+
+@pytest.fixture
+async def sign_up(client: AsyncClient):
+    """Returns a coroutine function signing up a user with a unique email."""
+
+    async def sign_up() -> SignedUpUser:
+        email: str = f"{uuid.uuid4().hex}@example.com"
+        password: str = "password1"
+        response = await client.post(
+            "/users/signup", json={"email": email, "password": password}
+        )
+        assert response.status_code == 200, response.text
+        return SignedUpUser(email, password, response.json())
+
+    return sign_up
+
+
+@pytest.fixture
+async def user(sign_up) -> SignedUpUser:
+    return await sign_up()
+
+
+@pytest.fixture
+async def referral_code(client: AsyncClient, user: SignedUpUser) -> str:
+    """The code of a referral code created by `user`."""
+    response = await client.post("/referral_codes/", headers=user.headers)
+    assert response.status_code == 200, response.text
+    response = await client.get(
+        "/referral_codes/", params={"email": user.email}
+    )
+    return response.json()["code"]
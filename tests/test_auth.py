@@ -0,0 +1,60 @@
+import uuid
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import delete
+
+from app.core import objects_getter
+from app.core.objects_getter import get_principal_from_jwt
+from app.db.db import get_engine
+from app.db.query_counter import assert_num_queries
+from app.models.user import User
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def stateless_auth(monkeypatch) -> None:
+    monkeypatch.setattr(objects_getter.settings, "STATELESS_AUTH", True)
+
+
+def token(user) -> str:
+    return user.headers["Authorization"].removeprefix("Bearer ")
+
+
+async def test_stateless_token_accepted_without_query(
+    stateless_auth, user
+):
+    with assert_num_queries(0):
+        principal = await get_principal_from_jwt(token(user))
+    assert principal.uuid == uuid.UUID(user.uuid)
+    assert principal.email == user.email
+
+
+async def test_token_checked_against_database(user):
+    with assert_num_queries(1):
+        principal = await get_principal_from_jwt(token(user))
+    assert principal.uuid == uuid.UUID(user.uuid)
+
+
+async def test_stateless_token_of_deleted_user_rejected(
+    client: AsyncClient, stateless_auth, sign_up, referral_code
+):
+    deleted = await sign_up()
+    async with get_engine().begin() as conn:
+        await conn.execute(
+            delete(User).where(User.uuid == uuid.UUID(deleted.uuid))
+        )
+
+    response = await client.post("/referral_codes/", headers=deleted.headers)
+    assert response.status_code == 404
+    response = await client.post(
+        "/referral_codes/become_referral",
+        params={"ref_code": referral_code},
+        headers=deleted.headers,
+    )
+    assert response.status_code == 404
+    response = await client.delete(
+        f"/referral_codes/{referral_code}", headers=deleted.headers
+    )
+    assert response.status_code == 403
@@ -0,0 +1,71 @@
+import uuid
+from typing import AsyncIterator
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import text
+
+from app.core import bulk_import
+from app.db.db import get_engine
+
+pytestmark = [pytest.mark.anyio, pytest.mark.usefixtures("postgresql_only")]
+
+
+async def iterate(lines: list[str]) -> AsyncIterator[str]:
+    for line in lines:
+        yield line
+
+
+async def referrers(emails: list[str]) -> dict[str, tuple]:
+    """The referrer email and referral count of the users, by email."""
+    async with get_engine().connect() as conn:
+        rows = await conn.execute(
+            text(
+                'SELECT u.email, r.email, u.referral_count FROM "user" AS u '
+                'LEFT JOIN "user" AS r ON r.uuid = u.referrer_uuid '
+                "WHERE u.email = ANY(:emails)"
+            ),
+            {"emails": emails},
+        )
+    return {email: (referrer, count) for email, referrer, count in rows}
+
+
+async def test_import_commits_every_chunk(
+    client: AsyncClient, monkeypatch, user
+):
+    monkeypatch.setattr(bulk_import.settings, "BULK_IMPORT_CHUNK_SIZE", 2)
+    prefix: str = uuid.uuid4().hex
+    first, second, third, late = (
+        f"{prefix}-{name}@example.com"
+        for name in ("first", "second", "third", "late")
+    )
+    report = await bulk_import.import_users(
+        iterate(
+            [
+                "email,password,referrer_email",
+                # referred by a row of the last chunk
+                f"{first},password1,{late}",
+                f"{second},password1,{user.email}",
+                f"{first},password1,",
+                f"{user.email},password1,",
+                f"{third},password1,{prefix}-unknown@example.com",
+                f"{late},password1,{user.email}",
+            ]
+        ),
+        "csv",
+    )
+
+    assert report.total_rows == 6
+    assert report.imported == 4
+    assert [(row.line, row.reason) for row in report.rejected_rows] == [
+        (4, "Duplicate email in the import."),
+        (5, "User with this email already exists."),
+    ]
+    assert report.unresolved_referrers == 1
+    assert await referrers([user.email, first, second, third, late]) == {
+        user.email: (None, 2),
+        first: (late, 0),
+        second: (user.email, 0),
+        third: (None, 0),
+        late: (user.email, 1),
+    }
@@ -0,0 +1,100 @@
+import pytest
+from httpx import AsyncClient
+
+from app.db import cache
+from app.db.cache import FakeNetworkCacheClient, InProcessCache, NetworkCache
+from app.db.db_interactions import DBInteractionsManager, record_cache
+from app.db.query_counter import assert_num_queries
+from app.models.referral_code import ReferralCode
+from app.server import PreforkServer
+
+pytestmark = pytest.mark.anyio
+
+TTL_SECONDS: float = 60
+
+
+class Clock:
+    def __init__(self):
+        self.now: float = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    """The time the network cache expires its entries by."""
+    clock = Clock()
+    monkeypatch.setattr(cache, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def network_cache(monkeypatch, clock: Clock) -> FakeNetworkCacheClient:
+    """Runs the record cache on the network cache, for one test."""
+    client = FakeNetworkCacheClient()
+    monkeypatch.setattr(
+        record_cache, "backend", NetworkCache(client, "test:", TTL_SECONDS)
+    )
+    monkeypatch.setattr(record_cache, "ttl", TTL_SECONDS)
+    return client
+
+
+async def get_referral_code(code: str, **kwargs) -> ReferralCode | None:
+    return await DBInteractionsManager.get_record_from_db(
+        {"code": code}, ReferralCode, **kwargs
+    )
+
+
+async def test_lookup_hit_and_miss(network_cache, referral_code):
+    hits: int = record_cache.hits["ReferralCode"]
+    misses: int = record_cache.misses["ReferralCode"]
+    with assert_num_queries(1):
+        stored = await get_referral_code(referral_code)
+    with assert_num_queries(0):
+        cached = await get_referral_code(referral_code)
+
+    assert cached.code == stored.code == referral_code
+    assert cached.owner_uuid == stored.owner_uuid
+    assert cached.expiration_time == stored.expiration_time
+    assert record_cache.hits["ReferralCode"] == hits + 1
+    assert record_cache.misses["ReferralCode"] == misses + 1
+    with assert_num_queries(1):
+        await get_referral_code(referral_code, use_cache=False)
+
+
+async def test_write_invalidates_lookup(
+    client: AsyncClient, network_cache, user, referral_code
+):
+    await get_referral_code(referral_code)
+    response = await client.delete(
+        f"/referral_codes/{referral_code}", headers=user.headers
+    )
+    assert response.status_code == 200, response.text
+    with assert_num_queries(1):
+        assert await get_referral_code(referral_code) is None
+
+
+async def test_entry_expires_after_ttl(
+    network_cache, clock: Clock, referral_code
+):
+    await get_referral_code(referral_code)
+    clock.now += TTL_SECONDS - 1
+    with assert_num_queries(0):
+        await get_referral_code(referral_code)
+    clock.now += 1
+    with assert_num_queries(1):
+        assert await get_referral_code(referral_code) is not None
+
+
+def test_workers_refuse_process_local_cache(monkeypatch):
+    monkeypatch.setattr(record_cache, "backend", InProcessCache(10))
+    with pytest.raises(SystemExit, match="CACHE_BACKEND"):
+        PreforkServer("127.0.0.1", 0, workers=2).run()
+    monkeypatch.setattr(
+        record_cache,
+        "backend",
+        NetworkCache(FakeNetworkCacheClient(), "test:", TTL_SECONDS),
+    )
+    with pytest.raises(SystemExit, match="CACHE_BACKEND"):
+        PreforkServer("127.0.0.1", 0, workers=2).run()
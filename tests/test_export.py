@@ -0,0 +1,61 @@
+import csv
+import gzip
+from io import StringIO
+
+import pytest
+from httpx import AsyncClient
+
+from app.core import export
+from app.serializers.export import UserExportSerializer
+
+pytestmark = pytest.mark.anyio
+
+ADMIN_TOKEN: str = "test-admin-token"
+
+
+@pytest.fixture
+def admin_headers(monkeypatch) -> dict[str, str]:
+    monkeypatch.setattr(export.settings, "ADMIN_TOKEN", ADMIN_TOKEN)
+    # several chunks even for the few rows of the tests
+    monkeypatch.setattr(export.settings, "EXPORT_CHUNK_SIZE", 2)
+    return {"X-Admin-Token": ADMIN_TOKEN}
+
+
+async def get_export(
+    client: AsyncClient, admin_headers: dict[str, str], **params
+) -> tuple[str, bytes]:
+    """The media type and the body of the streamed export of the users."""
+    async with client.stream(
+        "GET", "/admin/export/users", params=params, headers=admin_headers
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["X-Export-Watermark"]
+        body: bytes = b"".join([chunk async for chunk in response.aiter_raw()])
+    return response.headers["Content-Type"], body
+
+
+async def test_export_csv(client: AsyncClient, admin_headers, sign_up):
+    users = [await sign_up() for _ in range(3)]
+    media_type, body = await get_export(client, admin_headers, format="csv")
+
+    assert media_type.startswith("text/csv")
+    rows: list[dict] = list(csv.DictReader(StringIO(body.decode())))
+    assert set(rows[0]) == set(UserExportSerializer.model_fields)
+    assert "password" not in rows[0]
+    exported: dict[str, dict] = {row["email"]: row for row in rows}
+    for user in users:
+        assert exported[user.email]["uuid"] == user.uuid
+        assert exported[user.email]["referral_count"] == "0"
+
+    media_type, compressed = await get_export(
+        client, admin_headers, format="csv", gzip="true"
+    )
+    assert media_type == "application/gzip"
+    assert sorted(gzip.decompress(compressed).splitlines()) == sorted(
+        body.splitlines()
+    )
+
+
+async def test_export_requires_admin_token(client: AsyncClient):
+    response = await client.get("/admin/export/users")
+    assert response.status_code == 403
@@ -0,0 +1,66 @@
+import json
+
+from app.core.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+# the pid of no running process
+EXITED_PID: int = 2**22 + 1
+
+
+def make_registry(directory) -> MetricsRegistry:
+    registry = MetricsRegistry()
+    registry.register(Counter("requests_total", "Requests.", ("route",)))
+    registry.register(Gauge("pool_size", "Pool size."))
+    registry.register(
+        Gauge("pool_utilization", "Utilization.", aggregate="max")
+    )
+    registry.register(
+        Histogram("duration_seconds", "Duration.", buckets=(0.1, 1))
+    )
+    registry.share(str(directory), interval_seconds=5)
+    return registry
+
+
+def test_shared_metrics_are_merged(tmp_path):
+    registry = make_registry(tmp_path)
+    requests_total, pool_size, pool_utilization, duration = registry.metrics
+    requests_total.inc("/a", amount=2)
+    pool_size.set(value=5)
+    pool_utilization.set(value=0.2)
+    duration.observe(value=0.05)
+    (tmp_path / f"{EXITED_PID}.json").write_text(
+        json.dumps(
+            {
+                "requests_total": [[["/a"], 3], [["/b"], 1]],
+                "pool_size": [[[], 5]],
+                "pool_utilization": [[[], 0.9]],
+                "duration_seconds": [[[], [[0, 1, 0], 0.5, 1]]],
+            }
+        )
+    )
+
+    lines: list[str] = registry.render().splitlines()
+
+    assert 'requests_total{route="/a"} 5' in lines
+    assert 'requests_total{route="/b"} 1' in lines
+    # the gauges of the exited worker are left out
+    assert "pool_size 5" in lines
+    assert "pool_utilization 0.2" in lines
+    assert 'duration_seconds_bucket{le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{le="1.0"} 2' in lines
+    assert "duration_seconds_count 2" in lines
+
+
+def test_running_workers_gauges_are_aggregated(tmp_path):
+    registry = make_registry(tmp_path)
+    _, pool_size, pool_utilization, _ = registry.metrics
+    pool_size.set(value=5)
+    pool_utilization.set(value=0.2)
+    # pid 1 is always running
+    (tmp_path / "1.json").write_text(
+        json.dumps({"pool_size": [[[], 5]], "pool_utilization": [[[], 0.9]]})
+    )
+
+    lines: list[str] = registry.render().splitlines()
+
+    assert "pool_size 10" in lines
+    assert "pool_utilization 0.9" in lines
@@ -0,0 +1,20 @@
+from asyncio import sleep
+
+import pytest
+
+from app.core.profiling import WAITING_FRAME, StackSampler
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_stopped_profile_is_not_sampled_anymore():
+    sampler = StackSampler(interval_seconds=0.001)
+    profile = sampler.start()
+    await sleep(0.05)
+    sampler.stop(profile)
+    samples: int = profile.stacks.total()
+    await sleep(0.05)
+
+    assert samples > 0
+    assert profile.stacks.total() == samples
+    assert all(stack.endswith(WAITING_FRAME) for stack in profile.stacks)
@@ -0,0 +1,85 @@
+import pytest
+from httpx import AsyncClient
+
+from app.db.query_counter import assert_num_queries
+
+pytestmark = pytest.mark.anyio
+
+# the authenticated endpoints look the user of the token up first, which
+# the record cache answers outside of the tests
+
+
+async def test_login(client: AsyncClient, user):
+    with assert_num_queries(1):
+        response = await client.post(
+            "/users/login",
+            data={"username": user.email, "password": user.password},
+        )
+    assert response.status_code == 200, response.text
+
+
+async def test_get_referral_code(client: AsyncClient, user, referral_code):
+    with assert_num_queries(2):
+        response = await client.get(
+            "/referral_codes/", params={"email": user.email}
+        )
+    assert response.status_code == 200, response.text
+    assert response.json()["code"] == referral_code
+
+
+async def test_get_referral_code_not_modified(
+    client: AsyncClient, user, referral_code
+):
+    response = await client.get(
+        "/referral_codes/", params={"email": user.email}
+    )
+    with assert_num_queries(2):
+        response = await client.get(
+            "/referral_codes/",
+            params={"email": user.email},
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+    assert response.status_code == 304
+
+
+async def test_become_referral(
+    client: AsyncClient, sign_up, referral_code, dialect
+):
+    referral = await sign_up()
+    with assert_num_queries(2 if dialect == "postgresql" else 5):
+        response = await client.post(
+            "/referral_codes/become_referral",
+            params={"ref_code": referral_code},
+            headers=referral.headers,
+        )
+    assert response.status_code == 200, response.text
+
+
+async def test_delete_referral_code(client: AsyncClient, user, referral_code):
+    with assert_num_queries(2):
+        response = await client.delete(
+            f"/referral_codes/{referral_code}", headers=user.headers
+        )
+    assert response.status_code == 200, response.text
+    response = await client.get(
+        "/referral_codes/", params={"email": user.email}
+    )
+    assert response.status_code == 404
+
+
+async def test_all_referrals(
+    client: AsyncClient, sign_up, user, referral_code
+):
+    for _ in range(3):
+        referral = await sign_up()
+        await client.post(
+            "/referral_codes/become_referral",
+            params={"ref_code": referral_code},
+            headers=referral.headers,
+        )
+    with assert_num_queries(1):
+        response = await client.get(
+            f"/referral_codes/all_referrals/{user.uuid}"
+        )
+    assert response.status_code == 200, response.text
+    assert len(response.json()["referrals"]) == 3
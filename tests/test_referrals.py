@@ -0,0 +1,130 @@
+import uuid
+
+import anyio
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import update
+
+from app.core.referral_codes import revoke_referral_code
+from app.core.referrals import _assign_referrer_by_code
+from app.db.db import get_engine
+from app.db.db_interactions import DBInteractionsManager
+from app.db.query_counter import assert_num_queries
+from app.models.user import User
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.usefixtures("postgresql_only")
+async def test_assign_referrer_by_code(
+    client: AsyncClient, sign_up, user, referral_code
+):
+    referral = await sign_up()
+    with assert_num_queries(1):
+        referrer_uuid = await _assign_referrer_by_code(
+            uuid.UUID(referral.uuid), referral_code
+        )
+    assert referrer_uuid == uuid.UUID(user.uuid)
+    response = await client.get(f"/referral_codes/all_referrals/{user.uuid}")
+    assert [referral["uuid"] for referral in response.json()["referrals"]] == [
+        referral.uuid
+    ]
+
+
+@pytest.mark.usefixtures("postgresql_only")
+async def test_assign_referrer_by_own_code(
+    client: AsyncClient, user, referral_code
+):
+    with assert_num_queries(1):
+        referrer_uuid = await _assign_referrer_by_code(
+            uuid.UUID(user.uuid), referral_code
+        )
+    assert referrer_uuid == uuid.UUID(user.uuid)
+    response = await client.get(f"/referral_codes/all_referrals/{user.uuid}")
+    assert response.json()["referrals"] == []
+
+
+@pytest.mark.usefixtures("postgresql_only")
+async def test_assign_referrer_by_missing_code(user):
+    with assert_num_queries(1):
+        referrer_uuid = await _assign_referrer_by_code(
+            uuid.UUID(user.uuid), "missing"
+        )
+    assert referrer_uuid is None
+
+
+async def test_revoke_referral_code(sign_up, user, referral_code):
+    other = await sign_up()
+    with assert_num_queries(1):
+        assert not await revoke_referral_code(
+            referral_code, uuid.UUID(other.uuid)
+        )
+    with assert_num_queries(1):
+        assert await revoke_referral_code(referral_code, uuid.UUID(user.uuid))
+
+
+async def test_all_referrals_not_modified(
+    client: AsyncClient, sign_up, user, referral_code
+):
+    url: str = f"/referral_codes/all_referrals/{user.uuid}"
+    response = await client.get(url)
+    etag: str = response.headers["ETag"]
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    referral = await sign_up()
+    response = await client.post(
+        "/referral_codes/become_referral",
+        params={"ref_code": referral_code},
+        headers=referral.headers,
+    )
+    assert response.status_code == 200, response.text
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [referral["uuid"] for referral in response.json()["referrals"]] == [
+        referral.uuid
+    ]
+
+
+async def test_referral_tree_stops_at_cycle(sign_up):
+    a, b, d = [await sign_up() for _ in range(3)]
+    # a -> d -> b -> a, which no endpoint creates but the data may hold
+    async with get_engine().begin() as conn:
+        for referral, referrer in ((d, a), (b, d), (a, b)):
+            await conn.execute(
+                update(User)
+                .where(User.uuid == uuid.UUID(referral.uuid))
+                .values(referrer_uuid=uuid.UUID(referrer.uuid))
+            )
+
+    with anyio.fail_after(10):
+        rows: list = [
+            (str(row["uuid"]), row["depth"])
+            async for chunk in DBInteractionsManager.stream_tree_from_db(
+                uuid.UUID(a.uuid), User, "referrer_uuid", ["uuid"], 100
+            )
+            for row in chunk
+        ]
+    assert rows == [(d.uuid, 1), (b.uuid, 2)]
+
+
+async def test_referral_codes_batch(
+    client: AsyncClient, sign_up, user, referral_code
+):
+    without_code = await sign_up()
+    unknown: str = f"{uuid.uuid4().hex}@example.com"
+    with assert_num_queries(1):
+        response = await client.post(
+            "/referral_codes/batch",
+            json={"emails": [user.email, without_code.email, unknown]},
+        )
+    assert response.status_code == 200, response.text
+    referral_codes: dict = response.json()["referral_codes"]
+    assert referral_codes.keys() == {user.email, without_code.email, unknown}
+    assert referral_codes[user.email]["code"] == referral_code
+    assert referral_codes[user.email]["expiration_time"]
+    assert referral_codes[without_code.email] is None
+    assert referral_codes[unknown] is None
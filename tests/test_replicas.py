@@ -0,0 +1,134 @@
+import uuid
+from typing import AsyncIterator
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.db import db
+from app.db.db import Replica, ReplicaSet, create_engine, wrote_to_primary
+from app.db.db_interactions import DBInteractionsManager
+from app.db.migrator import upgrade
+from app.models.user import User
+from app.serializers.user import UserSerializer
+
+pytestmark = pytest.mark.anyio
+
+EJECT_SECONDS: float = 30
+
+
+class Clock:
+    def __init__(self):
+        self.now: float = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FailingConnections:
+    """Fails the connections opened to an engine while `down` is set."""
+
+    def __init__(self, engine: AsyncEngine):
+        self.down: bool = False
+        self.attempts: int = 0
+        event.listen(engine.sync_engine, "do_connect", self._on_connect)
+
+    def _on_connect(self, dialect, connection_record, cargs, cparams):
+        self.attempts += 1
+        if self.down:
+            raise OSError("replica unreachable")
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    """The time replicas are ejected by."""
+    clock = Clock()
+    monkeypatch.setattr(db, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+async def replica(
+    client, monkeypatch, tmp_path, clock: Clock
+) -> AsyncIterator[Replica]:
+    """
+    A SQLite database migrated on its own, serving as the only replica, so
+    the rows written to either database show where a read went.
+    """
+    engine: AsyncEngine = create_engine(
+        f"sqlite+aiosqlite:///{tmp_path}/replica.db", "replica0"
+    )
+    await upgrade(engine)
+    replica = Replica(engine)
+    monkeypatch.setattr(
+        db, "replica_set", ReplicaSet([replica], EJECT_SECONDS)
+    )
+    token = wrote_to_primary.set(False)
+    try:
+        yield replica
+    finally:
+        wrote_to_primary.reset(token)
+        await engine.dispose()
+
+
+def new_user() -> dict:
+    return {
+        "email": f"{uuid.uuid4().hex}@example.com",
+        "password": "password1",
+    }
+
+
+async def add_to_replica(replica: Replica, fields: dict) -> None:
+    async with replica.sessions() as session:
+        session.add(User(**fields))
+        await session.commit()
+
+
+async def get_user(email: str) -> UserSerializer | None:
+    return await DBInteractionsManager.get_record_from_db(
+        {"email": email}, User, projection=UserSerializer
+    )
+
+
+async def test_reads_go_to_replica(replica: Replica):
+    fields: dict = new_user()
+    await add_to_replica(replica, fields)
+    user: UserSerializer | None = await get_user(fields["email"])
+    assert user is not None and user.email == fields["email"]
+
+
+async def test_writes_and_own_reads_go_to_primary(replica: Replica):
+    fields: dict = new_user()
+    assert await DBInteractionsManager.create_record_in_db(fields, User)
+    assert wrote_to_primary.get()
+    assert await get_user(fields["email"]) is not None
+
+    wrote_to_primary.set(False)
+    assert await get_user(fields["email"]) is None
+
+
+async def test_failing_replica_ejected_and_readmitted(
+    replica: Replica, clock: Clock
+):
+    on_replica: dict = new_user()
+    await add_to_replica(replica, on_replica)
+    on_primary: dict = new_user()
+    assert await DBInteractionsManager.create_record_in_db(on_primary, User)
+    wrote_to_primary.set(False)
+    await replica.engine.dispose()
+    connections = FailingConnections(replica.engine)
+    connections.down = True
+
+    # the read falls back to the primary
+    assert await get_user(on_primary["email"]) is not None
+    assert replica.ejected_until == clock.now + EJECT_SECONDS
+    assert connections.attempts == 1
+
+    connections.down = False
+    clock.now += EJECT_SECONDS - 1
+    assert await get_user(on_replica["email"]) is None
+    assert connections.attempts == 1
+
+    clock.now += 1
+    assert await get_user(on_replica["email"]) is not None
+    assert connections.attempts == 2
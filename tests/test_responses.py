@@ -0,0 +1,19 @@
+from uuid import UUID
+
+from app.core.responses import FastJSONResponse
+
+
+def test_fast_json_response_encodes_content():
+    response = FastJSONResponse(
+        {"uuid": UUID(int=1), "counts": {1: 2}}, status_code=201
+    )
+
+    assert response.status_code == 201
+    assert response.media_type == "application/json"
+    assert response.body == (
+        b'{"uuid":"00000000-0000-0000-0000-000000000001","counts":{"1":2}}'
+    )
+
+
+def test_fast_json_response_passes_bytes_through():
+    assert FastJSONResponse(b'{"a":1}').body == b'{"a":1}'
@@ -0,0 +1,31 @@
+import pytest
+
+from app.core.sweeper import ExpiredCodesSweeper
+
+pytestmark = [pytest.mark.anyio, pytest.mark.usefixtures("postgresql_only")]
+
+
+async def test_one_sweeper_holds_the_lock():
+    first = ExpiredCodesSweeper(interval_seconds=60, batch_size=100)
+    second = ExpiredCodesSweeper(interval_seconds=60, batch_size=100)
+    try:
+        assert await first._acquire_lock()
+        assert not await second._acquire_lock()
+        await first.stop()
+        assert not first.stats.holds_lock
+        assert await second._acquire_lock()
+        assert second.stats.holds_lock
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+async def test_sweeper_lock_lost_with_its_connection():
+    sweeper = ExpiredCodesSweeper(interval_seconds=60, batch_size=100)
+    try:
+        assert await sweeper._acquire_lock()
+        await sweeper._lock_connection.invalidate()
+        assert await sweeper._acquire_lock()
+        assert sweeper.stats.holds_lock
+    finally:
+        await sweeper.stop()
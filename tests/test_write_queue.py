@@ -0,0 +1,134 @@
+from pathlib import Path
+from uuid import UUID
+
+import pytest
+
+from app.core.referrals import ASSIGN_REFERRERS, assign_referrers
+from app.db.db_interactions import DBInteractionsManager
+from app.db.write_queue import WriteBehindQueue
+from app.models.user import User
+
+pytestmark = pytest.mark.anyio
+
+
+def new_queue(directory: Path) -> WriteBehindQueue:
+    """A queue flushed only when a test asks, applying real assignments."""
+    queue = WriteBehindQueue(
+        enabled=True,
+        directory=str(directory),
+        max_batch=100,
+        flush_interval_seconds=3600,
+        sync_journal=False,
+    )
+    queue.register(ASSIGN_REFERRERS, assign_referrers)
+    return queue
+
+
+async def assign(queue: WriteBehindQueue, referral, referrer) -> None:
+    await queue.submit(
+        ASSIGN_REFERRERS,
+        referral.uuid,
+        {"user_uuid": referral.uuid, "referrer_uuid": referrer.uuid},
+    )
+
+
+async def get_user(signed_up_user) -> User:
+    return await DBInteractionsManager.get_record_from_db(
+        {"uuid": UUID(signed_up_user.uuid)}, User
+    )
+
+
+def die(queue: WriteBehindQueue) -> None:
+    """Closes the journal of the queue as its worker dying would."""
+    queue._segment.file.close()
+    queue._segment = None
+
+
+async def test_writes_coalesced_and_flushed(tmp_path: Path, sign_up):
+    queue = new_queue(tmp_path)
+    first, second, referral, other = [await sign_up() for _ in range(4)]
+    await assign(queue, referral, first)
+    await assign(queue, referral, second)
+    await assign(queue, other, second)
+    assert len(queue.pending) == 2
+    assert queue.get_pending(ASSIGN_REFERRERS, referral.uuid) == {
+        "user_uuid": referral.uuid,
+        "referrer_uuid": second.uuid,
+    }
+
+    assert await queue.flush() == 2
+    assert queue.pending == {}
+    assert list(tmp_path.iterdir()) == []
+    assert (await get_user(referral)).referrer_uuid == UUID(second.uuid)
+    assert (await get_user(other)).referrer_uuid == UUID(second.uuid)
+    assert (await get_user(first)).referral_count == 0
+    assert (await get_user(second)).referral_count == 2
+
+
+async def test_journal_replayed_after_restart(tmp_path: Path, sign_up):
+    referrer, referral = await sign_up(), await sign_up()
+    crashed = new_queue(tmp_path)
+    await assign(crashed, referral, referrer)
+    die(crashed)
+
+    restarted = new_queue(tmp_path)
+    restarted.start()
+    try:
+        assert restarted.get_pending(ASSIGN_REFERRERS, referral.uuid)
+        await restarted.flush()
+    finally:
+        await restarted.stop()
+    assert list(tmp_path.iterdir()) == []
+    assert (await get_user(referral)).referrer_uuid == UUID(referrer.uuid)
+    assert (await get_user(referrer)).referral_count == 1
+
+
+async def test_writes_requeued_after_lost_connection(
+    tmp_path: Path, sign_up
+):
+    referrer, referral = await sign_up(), await sign_up()
+    queue = new_queue(tmp_path)
+    failures: list[int] = [1]
+
+    async def assign_over_lost_connection(assignments: list[dict]) -> None:
+        if failures[0]:
+            failures[0] -= 1
+            raise ConnectionResetError("connection lost")
+        await assign_referrers(assignments)
+
+    queue.register(ASSIGN_REFERRERS, assign_over_lost_connection)
+    await assign(queue, referral, referrer)
+
+    assert await queue.flush() == 0
+    assert queue.get_pending(ASSIGN_REFERRERS, referral.uuid)
+    assert len(list(tmp_path.iterdir())) == 1
+    assert (await get_user(referral)).referrer_uuid is None
+
+    assert await queue.flush() == 1
+    assert list(tmp_path.iterdir()) == []
+    assert (await get_user(referral)).referrer_uuid == UUID(referrer.uuid)
+
+
+async def test_running_worker_journal_not_taken_over(
+    tmp_path: Path, sign_up
+):
+    referrer, referral = await sign_up(), await sign_up()
+    running = new_queue(tmp_path)
+    await assign(running, referral, referrer)
+
+    starting = new_queue(tmp_path)
+    starting.start()
+    try:
+        assert starting.pending == {}
+    finally:
+        await starting.stop()
+
+    die(running)
+    restarted = new_queue(tmp_path)
+    restarted.start()
+    try:
+        assert restarted.get_pending(ASSIGN_REFERRERS, referral.uuid)
+    finally:
+        await restarted.stop()
+    assert list(tmp_path.iterdir()) == []
+    assert (await get_user(referral)).referrer_uuid == UUID(referrer.uuid)